@@ -8,6 +8,7 @@ __requires__ = [
     "chaco>=4.4",
     "fiona>=1.0.2",
     "scimath>=4.1.2",
+    "scipy>=0.12",
     "shapely>=1.2.17",
     "tables>=2.4.0",
     "sdi",
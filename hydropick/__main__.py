@@ -19,8 +19,8 @@ def main():
     """ A simple main function that creates an application for testing """
     from hydropick.ui.application import Application
     app = Application()
-    app.init()
-    app.run()
+    if app.init():
+        app.run()
     app.cleanup()
 
 
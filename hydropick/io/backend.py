@@ -0,0 +1,537 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import contextlib
+import json
+import os
+import threading
+
+import fiona
+import numpy as np
+import sdi
+from shapely.geometry import (LineString, MultiLineString, MultiPolygon,
+                              Polygon, shape)
+from tables import NoSuchNodeError
+
+
+#: path prefix of in-memory stores, e.g. 'memory:granger'
+MEMORY_PREFIX = 'memory:'
+
+#: extension of directory-of-.npy stores
+NPY_DIRECTORY_EXTENSION = '.npyd'
+
+
+def parse_binary_file(bin_file):
+    """Parse an SDI binary file into a dict ready for
+    StorageBackend.write_binary_data.
+
+    The file is decoded once, unseparated, and the per-frequency arrays are
+    derived from that single trace stream. This does no storage I/O and
+    returns only plain dicts and arrays, so it can run in a worker process
+    with the result sent back to the writer.
+    """
+    data_raw = sdi.binary.read(bin_file, separate=False)
+    bad_indices, bad_values = repair_trace_num(data_raw)
+    freq_dicts = separate_frequencies(data_raw)
+    # the raw intensity is only needed to build the per-frequency images
+    data_raw.pop('intensity', None)
+    default_name = os.path.splitext(os.path.basename(bin_file))[0]
+    return {
+        'line_name': data_raw.get('survey_line_number', default_name),
+        'frequencies': freq_dicts,
+        'raw': data_raw,
+        'trace_num_repairs': [
+            (int(index), int(value))
+            for index, value in zip(bad_indices, bad_values)
+        ],
+    }
+
+
+def repair_trace_num(data_raw):
+    """Replace data_raw['trace_num'] with the sequence 1..N it should be if
+    any of its values are bad. sdi.binary occasionally decodes bad trace
+    numbers; fixing the unseparated array before the frequencies are
+    separated fixes every per-frequency trace_num array too.
+
+    returns (bad_indices, bad_values) of the traces that were repaired
+    """
+    trace_num = np.asarray(data_raw['trace_num'])
+    # int64 whatever the decoded dtype: a narrow dtype would wrap around on
+    # long lines and flag every later trace
+    expected = np.arange(1, trace_num.shape[0] + 1, dtype=np.int64)
+    bad_indices = np.flatnonzero(trace_num.astype(np.int64) != expected)
+    bad_values = trace_num[bad_indices]
+    if bad_indices.size:
+        data_raw['trace_num'] = expected
+    return bad_indices, bad_values
+
+
+def separate_frequencies(data_raw):
+    """Split an unseparated SDI trace stream into one dict per frequency,
+    ordered by increasing frequency.
+
+    Every per-trace array in data_raw is indexed with the positions of the
+    traces recorded at each frequency, so no trace is decoded twice.
+    """
+    khz = np.asarray(data_raw['kHz'])
+    n_traces = khz.shape[0]
+    per_trace = [
+        (key, value) for key, value in data_raw.iteritems()
+        if key != 'kHz' and isinstance(value, np.ndarray) and
+        value.ndim > 0 and value.shape[0] == n_traces
+    ]
+    freq_dicts = []
+    for value in np.unique(khz):
+        indices = np.flatnonzero(khz == value)
+        freq_dict = dict((key, array[indices]) for key, array in per_trace)
+        intensity = freq_dict.get('intensity')
+        if intensity is not None and intensity.dtype == object:
+            # ragged rows: all traces at one frequency share a length
+            freq_dict['intensity'] = np.vstack(intensity)
+        freq_dict['kHz'] = float(value)
+        freq_dicts.append(freq_dict)
+    return freq_dicts
+
+
+def flatten_geometry(geom):
+    """Flatten a (Multi)LineString or (Multi)Polygon into arrays.
+
+    Returns (coordinates, part_offsets, geometry_offsets). coordinates
+    holds the vertices of every part (line or ring) back to back; part i is
+    coordinates[part_offsets[i]:part_offsets[i + 1]]. Geometry j (a line,
+    or a polygon's exterior followed by its interiors) is made of parts
+    geometry_offsets[j] to geometry_offsets[j + 1].
+    """
+    if isinstance(geom, (LineString, Polygon)):
+        geoms = [geom]
+    else:
+        geoms = list(geom.geoms)
+    parts = []
+    geometry_offsets = [0]
+    for g in geoms:
+        if isinstance(g, Polygon):
+            rings = [g.exterior] + list(g.interiors)
+        else:
+            rings = [g]
+        parts.extend(np.asarray(ring.coords, dtype=np.float64)
+                     for ring in rings)
+        geometry_offsets.append(len(parts))
+    part_offsets = np.cumsum([0] + [len(part) for part in parts])
+    return (np.concatenate(parts), part_offsets.astype(np.int64),
+            np.array(geometry_offsets, dtype=np.int64))
+
+
+def build_geometry(geom_type, coordinates, part_offsets, geometry_offsets):
+    """Rebuild the shapely geometry flattened by flatten_geometry."""
+    parts = [coordinates[start:stop]
+             for start, stop in zip(part_offsets[:-1], part_offsets[1:])]
+    geometries = [parts[start:stop] for start, stop in
+                  zip(geometry_offsets[:-1], geometry_offsets[1:])]
+    if geom_type == 'LineString':
+        return LineString(parts[0])
+    elif geom_type == 'MultiLineString':
+        return MultiLineString(parts)
+    elif geom_type == 'Polygon':
+        return Polygon(parts[0], parts[1:])
+    elif geom_type == 'MultiPolygon':
+        return MultiPolygon([(rings[0], rings[1:]) for rings in geometries])
+    raise NotImplementedError(
+        'Unsupported shoreline geometry type: {}'.format(geom_type))
+
+
+
+def read_pick_file(pick_file):
+    """Parse an SDI pick file. returns (line_data, line_name, line_type),
+    the arguments of StorageBackend.write_pick
+    """
+    line_name = os.path.basename(pick_file).split('.')[0]
+    pick_data = sdi.pickfile.read(pick_file)
+    surface_number = pick_data['surface_number']
+    if surface_number == 1:
+        line_type = 'current'
+    elif surface_number == 2:
+        line_type = 'preimpoundment'
+    else:
+        raise NotImplementedError(
+            'unexpected line file type: {}'.format(surface_number))
+
+    line_data = {
+        'name': 'pickfile_' + line_type,
+        'depth_array': pick_data['depth'],
+        'index_array': pick_data['trace_number'] - 1,
+        'edited': False,
+        'source': 'previous depth line',
+        'source_name': pick_file,
+    }
+    return line_data, line_name, line_type
+
+
+def read_shoreline_file(shoreline_file):
+    """Read the shoreline from a GIS file. returns (crs, properties,
+    geometry)
+    """
+    with fiona.open(shoreline_file) as f:
+        crs = f.crs
+        geometries = []
+        for rec in f:
+            geometries.append(rec['geometry'])
+        # XXX: assuming that the properties aren't varying by geometry
+        properties = rec['properties']
+
+        if len(geometries) == 1:
+            geom = shape(geometries[0])
+        else:
+            # XXX: this assumes we'll always get lines, not polygons or other
+            geom = MultiLineString([
+                shape(geometry) for geometry in geometries])
+    return crs, properties, geom
+
+
+#: core sample fields stored natively; anything else goes in 'extra'
+CORE_SAMPLE_FIELDS = ['easting', 'northing', 'layer_interface_depths']
+
+
+#: tolerance (in map units) used to simplify navigation tracks for the
+#: survey catalog
+CATALOG_SIMPLIFY_TOLERANCE = 1.0
+
+
+def current_surface_from_bin(data):
+    """returns the pick (in the format of StorageBackend.write_pick) of the
+    current surface recorded in a line parsed by parse_binary_file.
+
+    Traces are indexed by position rather than by the raw trace_num, which
+    can contain bad values.
+    """
+    raw = data['raw']
+    return {
+        'name': 'current_surface_from_bin',
+        'survey_line_name': data['line_name'],
+        'line_type': 'current surface',
+        'depth_array': raw['depth_r1'],
+        'index_array': np.arange(len(raw['trace_num'])),
+        'edited': False,
+        'source': 'sdi_file',
+        'source_name': os.path.basename(str(raw['filepath'])),
+    }
+
+
+def summarize_survey_line(line_name, coords, n_traces, frequencies,
+                          tolerance=CATALOG_SIMPLIFY_TOLERANCE):
+    """returns the survey catalog entry of a line: its 'name', 'n_traces',
+    'bounds' (xmin, ymin, xmax, ymax), track 'length', list of
+    'frequencies' and the 'navigation_line' coords simplified to tolerance.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) > 2:
+        simplified = LineString(coords).simplify(tolerance,
+                                                 preserve_topology=False)
+        navigation_line = np.array(simplified.coords)
+    else:
+        navigation_line = coords
+    return {
+        'name': line_name,
+        'n_traces': int(n_traces),
+        'bounds': tuple(coords.min(axis=0)) + tuple(coords.max(axis=0)),
+        'length': float(np.hypot(*np.diff(coords, axis=0).T).sum()),
+        'frequencies': sorted(float(khz) for khz in frequencies),
+        'navigation_line': navigation_line,
+    }
+
+
+def summarize_binary_data(data):
+    """returns the survey catalog entry of a line parsed by
+    parse_binary_file
+    """
+    freq_dicts = data['frequencies']
+    coords = np.vstack((freq_dicts[-1]['interpolated_easting'],
+                        freq_dicts[-1]['interpolated_northing'])).T
+    return summarize_survey_line(
+        data['line_name'], coords, len(data['raw']['trace_num']),
+        [freq_dict['kHz'] for freq_dict in freq_dicts])
+
+
+
+class StorageBackend(object):
+    """Interface of the survey data stores used through survey_io.
+
+    A store holds the survey lines (navigation, per-frequency and
+    unseparated SDI data, picks), the core samples, the lake shoreline, the
+    survey catalog and the import manifest. Missing data raises
+    NoSuchNodeError (the PyTables exception, whatever the backend).
+
+    Subclasses implement the read_* and write_* methods; importing source
+    files is shared and goes through them.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release any resources held by the backend."""
+        pass
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """context manager within which every read sees the same state of
+        the store.
+        """
+        yield self
+
+    def compact(self, storage_policy=None):
+        """reclaims unused space in the store. Stores that replace data in
+        place have nothing to reclaim.
+
+        returns {'old_size', 'new_size', 'bytes_reclaimed'}
+        """
+        return {'old_size': 0, 'new_size': 0, 'bytes_reclaimed': 0}
+
+    def import_binary_file(self, bin_file):
+        self.write_binary_data(parse_binary_file(bin_file))
+
+    def import_corestick_file(self, corestick_file):
+        self.import_corestick_files([corestick_file])
+
+    def import_corestick_files(self, corestick_files):
+        """replaces the core samples with those of all the corestick files.
+        A core in more than one file is taken from the last of them.
+        """
+        core_samples = {}
+        for corestick_file in corestick_files:
+            core_samples.update(sdi.corestick.read(corestick_file))
+        self.write_core_samples(core_samples)
+
+    def import_pick_file(self, pick_file):
+        line_data, line_name, line_type = read_pick_file(pick_file)
+        self.write_pick(line_data, line_name, line_type)
+
+    def import_shoreline_file(self, lake_name, shoreline_file):
+        """ Load the shoreline from GIS file. """
+        crs, properties, geom = read_shoreline_file(shoreline_file)
+        self.write_shoreline(lake_name, shoreline_file, crs, properties, geom)
+
+    def read_core_samples(self):
+        """returns {core_id: core sample dict} in the format of
+        sdi.corestick.read
+        """
+        arrays = self.read_core_sample_arrays()
+        core_samples = {}
+        for i, core_id in enumerate(arrays['core_id']):
+            core = json.loads(arrays['extra'][i])
+            core['easting'] = float(arrays['easting'][i])
+            core['northing'] = float(arrays['northing'][i])
+            depths = arrays['layer_interface_depths'][i]
+            core['layer_interface_depths'] = depths.tolist()
+            core_samples[str(core_id)] = core
+        return core_samples
+
+    def write_binary_data(self, data):
+        """writes a survey line parsed by parse_binary_file"""
+        raise NotImplementedError
+
+    def write_core_samples(self, core_sample_dicts):
+        """replaces the core samples with core_sample_dicts, in the format
+        of sdi.corestick.read
+        """
+        raise NotImplementedError
+
+    def write_shoreline(self, lake_name, shoreline_file, crs, properties,
+                        geom):
+        """replaces the lake shoreline with the shapely geometry geom"""
+        raise NotImplementedError
+
+    def write_pick(self, line_data, line_name, line_type):
+        """writes a pick line (current surface or preimpoundment)"""
+        raise NotImplementedError
+
+    def write_picks(self, picks):
+        """writes a sequence of (line_data, line_name, line_type) picks as a
+        single transaction: if any write fails, none of them is kept.
+        """
+        raise NotImplementedError
+
+    def write_import_manifest(self, manifest):
+        """replaces the import manifest with manifest, a dict in the format
+        returned by read_import_manifest
+        """
+        raise NotImplementedError
+
+    def write_survey_catalog(self, catalog):
+        """replaces the survey catalog with catalog, a list of entries in the
+        format returned by read_survey_catalog
+        """
+        raise NotImplementedError
+
+    def read_core_sample_arrays(self):
+        """returns the core samples as a dict of parallel sequences:
+        'core_id', 'easting' and 'northing' arrays, plus lists holding the
+        'layer_interface_depths' array and 'extra' JSON string of each core
+        """
+        raise NotImplementedError
+
+    def read_import_manifest(self):
+        """returns {path: {'kind', 'size', 'mtime', 'sha1'}} for every source
+        file recorded as imported, or {} if nothing has been imported yet
+        """
+        raise NotImplementedError
+
+    def read_picks(self, line_name, line_type):
+        """returns {pick name: pick dict} for a given line and type"""
+        raise NotImplementedError
+
+    def read_shoreline(self):
+        """returns the shoreline dict ('crs', 'geometry', 'coordinates',
+        'part_offsets', 'lake_name', 'original_shapefile', 'properties')
+        """
+        raise NotImplementedError
+
+    def read_sdi_data_unseparated(self, line_name):
+        raise NotImplementedError
+
+    def read_frequency_data(self, line_name):
+        """returns a list of frequency dicts, one per frequency"""
+        raise NotImplementedError
+
+    def read_frequency_info(self, line_name):
+        """returns a list of {'kHz', 'n_traces', 'n_pixels'} dicts, one per
+        frequency, without reading any array data
+        """
+        raise NotImplementedError
+
+    def read_frequency_window(self, line_name, khz, trace_range=None, step=1):
+        """returns the frequency dict for a single frequency, reading only
+        the traces whose trace_num lies within trace_range = (first, last)
+        (inclusive), decimated to every step'th trace.  All traces are
+        read if trace_range is None.  Depending on the storage, step may
+        save memory without reading any less.
+        """
+        raise NotImplementedError
+
+    def read_frequency_rows(self, line_name, khz, start=0, stop=None,
+                            align=False):
+        """returns the frequency dict for a single frequency holding the
+        traces at positions start to stop.  With align, stop is moved
+        forward to the end of the stored chunk it falls in, so no chunk is
+        decompressed without all of its traces being returned.
+        """
+        raise NotImplementedError
+
+    def read_survey_catalog(self):
+        """returns the survey catalog, a list of entries in the format of
+        summarize_survey_line plus each line's 'group', or [] if no catalog
+        has been written yet
+        """
+        raise NotImplementedError
+
+    def read_survey_line_summary(self, line_name):
+        """returns the survey catalog entry of a line, computed from the
+        line's stored data
+        """
+        raise NotImplementedError
+
+    def read_survey_line_coords(self, line_name):
+        raise NotImplementedError
+
+    def read_trace_num_repairs(self, line_name):
+        """returns the trace_num values repaired on import, as a dict of
+        'index' and original 'value' arrays
+        """
+        raise NotImplementedError
+
+
+#: backends shared by everything that touches a given store, keyed by path
+_backends = {}
+_backends_lock = threading.Lock()
+
+#: whether shared HDF5 backends coordinate with other processes using the
+#: file (see HDF5Backend and set_concurrent_access)
+_concurrent_access = False
+
+
+def _backend_key(path):
+    if path.startswith(MEMORY_PREFIX):
+        return path
+    return os.path.abspath(path)
+
+
+def _create_backend(path):
+    """returns a new backend for path: an in-memory store for
+    'memory:<name>' paths, a directory of .npy files for existing
+    directories and paths ending in NPY_DIRECTORY_EXTENSION, and an HDF5
+    file otherwise.
+    """
+    if path.startswith(MEMORY_PREFIX):
+        from .tree_backend import MemoryBackend
+        return MemoryBackend()
+    if os.path.isdir(path) or path.endswith(NPY_DIRECTORY_EXTENSION):
+        from .tree_backend import NpyDirectoryBackend
+        return NpyDirectoryBackend(path)
+    from .hdf5 import HDF5Backend
+    return HDF5Backend(path, concurrent=_concurrent_access)
+
+
+def get_backend(path):
+    """Return the shared backend for the store at path, creating it if
+    needed (see _create_backend for how the backend type is chosen).
+
+    The returned backend keeps its file handle open between calls, so callers
+    should use this rather than creating a new backend for every access.
+    """
+    key = _backend_key(path)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = _create_backend(path)
+    return backend
+
+
+def register_backend(path, backend):
+    """Use backend for every later access to path, closing the backend
+    previously used for it.
+    """
+    key = _backend_key(path)
+    with _backends_lock:
+        previous = _backends.get(key)
+        _backends[key] = backend
+    if previous is not None and previous is not backend:
+        previous.close()
+
+
+def set_concurrent_access(enabled):
+    """Turn concurrent (one writer, many readers) access on or off for all
+    shared HDF5 backends. Every process using a file concurrently must
+    enable it.
+    """
+    global _concurrent_access
+    with _backends_lock:
+        _concurrent_access = enabled
+        for backend in _backends.values():
+            if hasattr(backend, 'concurrent'):
+                backend.concurrent = enabled
+
+
+def close_backend(path):
+    """Close and forget the shared backend for path, if there is one."""
+    key = _backend_key(path)
+    with _backends_lock:
+        backend = _backends.pop(key, None)
+    if backend is not None:
+        backend.close()
+
+
+def close_all_backends():
+    """Close every shared backend. Called on application shutdown."""
+    with _backends_lock:
+        backends = _backends.values()
+        _backends.clear()
+    for backend in backends:
+        backend.close()
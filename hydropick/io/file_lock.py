@@ -0,0 +1,65 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """ An advisory inter-process lock on a file, held through a '.lock'
+    sidecar file next to it.
+
+    The lock can be held shared (any number of readers) or exclusive (a
+    single writer).  Where fcntl is unavailable (Windows) the lock is always
+    exclusive, so readers take turns instead of overlapping.
+
+    The lock is not reentrant and must not be shared between threads; the
+    HDF5 backend serializes its own use of it.
+    """
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._fd = None
+
+    def acquire(self, exclusive=False):
+        """ Block until the lock is held, shared or exclusive. """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 seconds; keep waiting
+                    pass
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        """ Release the lock and close the sidecar file. """
+        if self._fd is not None:
+            self.release()
+            os.close(self._fd)
+            self._fd = None
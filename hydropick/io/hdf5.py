@@ -1,116 +1,282 @@
 import contextlib
 import json
-import os.path
+import os
+import threading
 import warnings
 
-import fiona
 import numpy as np
-import sdi
-from shapely.geometry import MultiLineString, shape, mapping
 import tables
 
-
-class HDF5Backend(object):
-    """Read/write access for HDF5 data store."""
-
-    def __init__(self, filepath):
+from .backend import (CORE_SAMPLE_FIELDS, StorageBackend, build_geometry,
+                      current_surface_from_bin, flatten_geometry,
+                      summarize_survey_line)
+from .file_lock import FileLock
+
+
+#: version of the on-disk layout; bump whenever the layout changes
+#:   2: intensity arrays stored as chunked, compressed CArrays
+#:   3: core samples stored in a table instead of a JSON attribute
+#:   4: shoreline stored as coordinate arrays instead of GeoJSON
+HYDROPICK_FORMAT_VERSION = 4
+
+
+def _default_complib():
+    """Blosc if this PyTables build ships it, zlib otherwise."""
+    if tables.whichLibVersion('blosc') is not None:
+        return 'blosc'
+    return 'zlib'
+
+
+class StoragePolicy(object):
+    """How large arrays (the per-frequency intensity images) are laid out.
+
+    Arrays are written as compressed, chunked CArrays.  Each chunk holds a run
+    of whole traces (rows of the stored intensity array), so reading a range
+    of trace columns only decompresses the chunks covering that range.
+    Reading every step'th trace of a range still decompresses every chunk in
+    it unless step is at least the number of traces in a chunk.
+    """
+
+    def __init__(self, complib=None, complevel=5, shuffle=True,
+                 chunk_bytes=256 * 1024):
+        if complib is None:
+            complib = _default_complib()
+        self.complib = complib
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.chunk_bytes = chunk_bytes
+
+    @property
+    def filters(self):
+        return tables.Filters(complevel=self.complevel, complib=self.complib,
+                              shuffle=self.shuffle)
+
+    def chunkshape(self, shape, itemsize):
+        """returns a chunk shape holding as many whole traces (rows) as fit
+        in chunk_bytes, and at least one.
+        """
+        row_bytes = itemsize * int(np.prod(shape[1:]))
+        rows = max(1, self.chunk_bytes // max(row_bytes, 1))
+        rows = min(rows, shape[0])
+        return (rows,) + tuple(shape[1:])
+
+
+class ImportManifestRow(tables.IsDescription):
+    """one imported source file (see HDF5Backend.write_import_manifest)"""
+    path = tables.StringCol(512, pos=0)
+    kind = tables.StringCol(16, pos=1)
+    size = tables.Int64Col(pos=2)
+    mtime = tables.Float64Col(pos=3)
+    sha1 = tables.StringCol(40, pos=4)
+
+
+# longest core id the core sample table can hold
+MAX_CORE_ID_LENGTH = 64
+
+
+class CoreSampleRow(tables.IsDescription):
+    """one core sample (see HDF5Backend.write_core_samples)"""
+    core_id = tables.StringCol(MAX_CORE_ID_LENGTH, pos=0)
+    easting = tables.Float64Col(pos=1)
+    northing = tables.Float64Col(pos=2)
+
+
+class TraceNumRepairRow(tables.IsDescription):
+    """one repaired trace_num value (see repair_trace_num)"""
+    index = tables.Int64Col(pos=0)
+    value = tables.Int64Col(pos=1)
+
+
+class SurveyCatalogRow(tables.IsDescription):
+    """one survey line (see HDF5Backend.write_survey_catalog)"""
+    name = tables.StringCol(256, pos=0)
+    group = tables.StringCol(256, pos=1)
+    n_traces = tables.Int64Col(pos=2)
+    xmin = tables.Float64Col(pos=3)
+    ymin = tables.Float64Col(pos=4)
+    xmax = tables.Float64Col(pos=5)
+    ymax = tables.Float64Col(pos=6)
+    length = tables.Float64Col(pos=7)
+    # slice of the catalog's nav_coords holding the simplified track
+    nav_start = tables.Int64Col(pos=8)
+    nav_stop = tables.Int64Col(pos=9)
+
+
+class HDF5Backend(StorageBackend):
+    """Read/write access for HDF5 data store.
+
+    The backend holds on to a single file handle for its lifetime. The handle
+    is opened read-only for reads and reopened in append mode the first time
+    a write is requested; after that it is reused for reads and writes alike
+    until close() is called.
+
+    With concurrent=True the backend shares the file with other processes:
+    each outermost read holds a shared lock and each outermost write an
+    exclusive one (see FileLock), so there is one writer at a time and
+    readers never see a half-written file. Writes are flushed before the
+    lock is released, and the handle is reopened whenever the file has
+    changed since this backend last held the lock. Use snapshot() to make
+    several reads from one consistent state of the file.
+    """
+
+    def __init__(self, filepath, storage_policy=None, concurrent=False):
         self.filepath = filepath
-        self.hydropick_format_version = 1
+        self.hydropick_format_version = HYDROPICK_FORMAT_VERSION
+        if storage_policy is None:
+            storage_policy = StoragePolicy()
+        self.storage_policy = storage_policy
+        self.concurrent = concurrent
+        self._file = None
+        # serializes access to the handle; HDF5 is not thread safe
+        self._lock = threading.RLock()
+        # access mode requested by the innermost _open_file context
+        self._access_mode = None
+        self._depth = 0
+        # inter-process lock, and the file's state when it was last released
+        self._file_lock = None
+        self._file_lock_held = False
+        self._file_stat = None
+
+    def close(self):
+        """Flush and close the file handle if it is open."""
+        with self._lock:
+            if self._file is not None:
+                writable = self._file.isopen and self._file.mode != 'r'
+                with self._file_locked('a' if writable else 'r'):
+                    self._close_handle()
+            if self._file_lock is not None and not self._file_lock_held:
+                self._file_lock.close()
+                self._file_lock = None
 
-    def import_binary_file(self, bin_file):
-        data = sdi.binary.read(bin_file)
-        data_raw = sdi.binary.read(bin_file, separate=False)
-        x = data['frequencies'][-1]['interpolated_easting']
-        y = data['frequencies'][-1]['interpolated_northing']
+    @contextlib.contextmanager
+    def snapshot(self):
+        """context manager within which every read sees the same state of
+        the file, even if other processes are writing to it.
+        """
+        with self._open_file('r'):
+            yield self
+
+    @property
+    def is_open(self):
+        return self._file is not None and bool(self._file.isopen)
+
+    def write_binary_data(self, data):
+        """writes a survey line parsed by parse_binary_file to the file"""
+        line_name = data['line_name']
+        freq_dicts = data['frequencies']
+        x = freq_dicts[-1]['interpolated_easting']
+        y = freq_dicts[-1]['interpolated_northing']
         coords = np.vstack((x, y)).T
-        line_name = data['survey_line_number']
         with self._open_file('a') as f:
             line_group = self._get_survey_line_group(f, line_name)
             self._write_array(f, line_group, 'navigation_line', coords)
-            f.flush()
-
-        self._write_freq_dicts(line_name, data['frequencies'])
-        self._write_raw_sdi_dict(line_name, data_raw)
-        
-        # THIS IS MOVED BACK TO SURVEYLINE LOAD UNTIL TRACE_NUM
-        # ERRORS FIXED IN SDI BINARY SO THAT BAD TRACE NUM
-        # ARRAYS CAN BE FIXED
-        # current_surface_line = {
-        #     'name': 'current_surface_from_bin',
-        #     'depth_array': data_raw['depth_r1'],
-        #     'index_array': data_raw['trace_num'] - 1,
-        #     'edited': False,
-        #     'source': 'sdi_file',
-        #     'source_name': bin_file,
-        # }
-        # self.write_pick(current_surface_line, line_name, 'current')
-
-    def import_corestick_file(self, corestick_file):
-        core_sample_dicts = sdi.corestick.read(corestick_file)
-        self._write_core_samples(core_sample_dicts)
-
-    def import_pick_file(self, pick_file):
-        line_name = os.path.basename(pick_file).split('.')[0]
-        pick_data = sdi.pickfile.read(pick_file)
-        surface_number = pick_data['surface_number']
-        if surface_number == 1:
-            line_type = 'current'
-        elif surface_number == 2:
-            line_type = 'preimpoundment'
-        else:
-            raise NotImplementedError(
-                'unexpected line file type: {}'.format(surface_number))
-
-        line_data = {
-            'name': 'pickfile_' + line_type,
-            'depth_array': pick_data['depth'],
-            'index_array': pick_data['trace_number'] - 1,
-            'edited': False,
-            'source': 'previous depth line',
-            'source_name': pick_file,
-        }
-
-        self.write_pick(line_data, line_name, line_type)
-
-    def import_shoreline_file(self, lake_name, shoreline_file):
-        """ Load the shoreline from GIS file.
-
-        NB: Currently has side effects, loading crs and properties traits.
-        """
-        with fiona.open(shoreline_file) as f:
-            crs = f.crs
-            geometries = []
-            for rec in f:
-                geometries.append(rec['geometry'])
-            # XXX: assuming that the properties aren't varying by geometry
-            properties = rec['properties']
-
-            if len(geometries) == 1:
-                geom = shape(geometries[0])
-            else:
-                # XXX: this assumes we'll always get lines, not polygons or other
-                geom = MultiLineString([
-                    shape(geometry) for geometry in geometries])
-
+            self._write_freq_dicts(line_name, freq_dicts)
+            self._write_raw_sdi_dict(line_name, data['raw'])
+            self._write_table(f, line_group, 'trace_num_repairs',
+                              TraceNumRepairRow,
+                              data.get('trace_num_repairs', []))
+            self.write_pick(current_surface_from_bin(data), line_name,
+                            'current')
+
+    def write_shoreline(self, lake_name, shoreline_file, crs, properties,
+                        geom):
         with self._open_file('a') as f:
             shoreline_group = self._get_shoreline_group(f)
             shoreline_group._v_attrs.crs = self._safe_serialize(crs)
             shoreline_group._v_attrs.lake_name = self._safe_serialize(lake_name)
             shoreline_group._v_attrs.original_shapefile = self._safe_serialize(shoreline_file)
             shoreline_group._v_attrs.properties = self._safe_serialize(properties)
-            geometry_str = self._safe_serialize(mapping(geom))
+            shoreline_group._v_attrs.geom_type = self._safe_serialize(geom.geom_type)
+            coordinates, part_offsets, geometry_offsets = flatten_geometry(geom)
+            self._write_array(f, shoreline_group, 'coordinates', coordinates)
+            self._write_array(f, shoreline_group, 'part_offsets', part_offsets)
+            self._write_array(f, shoreline_group, 'geometry_offsets',
+                              geometry_offsets)
+
+    def read_core_sample_arrays(self):
+        """returns the core samples as a dict of parallel sequences:
+        'core_id', 'easting' and 'northing' arrays, plus lists holding the
+        'layer_interface_depths' array and 'extra' JSON string of each core
+        """
+        try:
+            with self._open_file('r') as f:
+                core_samples_group = self._get_core_samples_group(f)
+                table = core_samples_group.samples
+                arrays = {
+                    'core_id': table.col('core_id'),
+                    'easting': table.col('easting'),
+                    'northing': table.col('northing'),
+                    'layer_interface_depths':
+                        core_samples_group.layer_interface_depths.read(),
+                    'extra': core_samples_group.extra.read(),
+                }
+        except tables.FileModeError:
+            raise tables.NoSuchNodeError
+        return arrays
 
-            self._write_array(f, shoreline_group, 'geometry', np.array(geometry_str))
-            f.flush()
+    def read_import_manifest(self):
+        """returns {path: {'kind', 'size', 'mtime', 'sha1'}} for every source
+        file recorded as imported, or {} if nothing has been imported yet
+        """
+        try:
+            with self._open_file('r') as f:
+                rows = f.getNode('/', 'import_manifest').read()
+        except (IOError, tables.NoSuchNodeError):
+            return {}
+        return dict([
+            (row['path'], {
+                'kind': row['kind'],
+                'size': int(row['size']),
+                'mtime': float(row['mtime']),
+                'sha1': row['sha1'],
+            })
+            for row in rows
+        ])
 
-    def read_core_samples(self):
+    def read_survey_catalog(self):
+        """returns the survey catalog, a list of entries in the format of
+        summarize_survey_line plus each line's 'group', or [] if no catalog
+        has been written yet
+        """
         try:
             with self._open_file('r') as f:
-                core_samples_group = self._get_core_samples_group(f)
-                core_samples = self._safe_unserialize(core_samples_group._v_attrs.core_samples)
+                catalog_group = self._get_survey_catalog_group(f)
+                rows = catalog_group.lines.read()
+                frequencies = catalog_group.frequencies.read()
+                nav_coords = catalog_group.nav_coords.read()
+        except (IOError, tables.NoSuchNodeError):
+            return []
+        return [
+            {
+                'name': row['name'],
+                'group': row['group'],
+                'n_traces': int(row['n_traces']),
+                'bounds': (float(row['xmin']), float(row['ymin']),
+                           float(row['xmax']), float(row['ymax'])),
+                'length': float(row['length']),
+                'frequencies': freqs.tolist(),
+                'navigation_line':
+                    nav_coords[row['nav_start']:row['nav_stop']],
+            }
+            for row, freqs in zip(rows, frequencies)
+        ]
+
+    def read_survey_line_summary(self, line_name):
+        """returns the survey catalog entry of a line, computed from the
+        line's stored data
+        """
+        try:
+            with self._open_file('r') as f:
+                line_group = self._get_survey_line_group(f, line_name)
+                coords = line_group.navigation_line.read()
+                unsep_grp = self._get_sdi_data_unseparated_group(f, line_name)
+                n_traces = unsep_grp.trace_num.shape[0]
+                frequencies_group = self._get_frequencies_group(f, line_name)
+                frequencies = [self._khz_from_label(freq._v_name)
+                               for freq in frequencies_group]
         except tables.FileModeError:
             raise tables.NoSuchNodeError
-        return core_samples
+        return summarize_survey_line(line_name, coords, n_traces, frequencies)
 
     def read_picks(self, line_name, line_type):
         """returns picks for a given line and type """
@@ -122,7 +288,7 @@ class HDF5Backend(object):
                     for line_group in pick_type_group
                 ]
                 return dict([(pick['name'], pick) for pick in picks])
-        except tables.FileModeError:
+        except (tables.FileModeError, tables.NoSuchNodeError):
             return {}
 
     def read_shoreline(self):
@@ -133,14 +299,20 @@ class HDF5Backend(object):
                 lake_name = self._safe_unserialize(shoreline_group._v_attrs.lake_name)
                 original_shapefile = self._safe_unserialize(shoreline_group._v_attrs.original_shapefile)
                 properties = self._safe_unserialize(shoreline_group._v_attrs.properties)
-                geometry_str = str(shoreline_group.geometry.read())
-                geometry = shape(self._safe_unserialize(geometry_str))
+                geom_type = self._safe_unserialize(shoreline_group._v_attrs.geom_type)
+                coordinates = shoreline_group.coordinates.read()
+                part_offsets = shoreline_group.part_offsets.read()
+                geometry_offsets = shoreline_group.geometry_offsets.read()
         except tables.FileModeError:
             raise tables.NoSuchNodeError
 
+        geometry = build_geometry(geom_type, coordinates, part_offsets,
+                                  geometry_offsets)
         return {
             'crs': crs,
             'geometry': geometry,
+            'coordinates': coordinates,
+            'part_offsets': part_offsets,
             'lake_name': lake_name,
             'original_shapefile': original_shapefile,
             'properties': properties,
@@ -164,13 +336,109 @@ class HDF5Backend(object):
                     dict([
                         (array.name, array.read())
                         for array in freq
-                    ] + [('kHz', np.float(freq._v_name[4:].replace('_', '.')))])
+                    ] + [('kHz', self._khz_from_label(freq._v_name))])
+                    for freq in frequencies_group
+                ]
+        except tables.FileModeError:
+            raise tables.NoSuchNodeError
+        return freq_data
+
+    def read_frequency_info(self, line_name):
+        """returns a list of {'kHz', 'n_traces', 'n_pixels'} dicts, one per
+        frequency, without reading any array data
+        """
+        try:
+            with self._open_file('r') as f:
+                frequencies_group = self._get_frequencies_group(f, line_name)
+                info = [
+                    {
+                        'kHz': self._khz_from_label(freq._v_name),
+                        'n_traces': freq.intensity.shape[0],
+                        'n_pixels': freq.intensity.shape[1],
+                    }
                     for freq in frequencies_group
                 ]
         except tables.FileModeError:
             raise tables.NoSuchNodeError
+        return info
+
+    def read_frequency_window(self, line_name, khz, trace_range=None, step=1):
+        """returns the frequency dict for a single frequency, reading only
+        the traces whose trace_num lies within trace_range = (first, last)
+        (inclusive), decimated to every step'th trace.  All traces are
+        read if trace_range is None.
+
+        Only the chunks covering trace_range are decompressed, but step
+        saves memory, not reading: each chunk holds a run of whole traces,
+        so every chunk in the range is still decompressed unless step is at
+        least the number of traces in a chunk.
+        """
+        try:
+            with self._open_file('r') as f:
+                freq_group = self._get_frequency_group(f, line_name, khz)
+                trace_num = freq_group.trace_num.read()
+                n_traces = trace_num.shape[0]
+                start, stop = 0, n_traces
+                if trace_range is not None:
+                    first, last = trace_range
+                    start = int(np.searchsorted(trace_num, first, 'left'))
+                    stop = int(np.searchsorted(trace_num, last, 'right'))
+                freq_data = {}
+                for array in freq_group:
+                    if array.shape and array.shape[0] == n_traces:
+                        freq_data[array.name] = array.read(start, stop, step)
+                    else:
+                        freq_data[array.name] = array.read()
+                freq_data['kHz'] = self._khz_from_label(freq_group._v_name)
+        except tables.FileModeError:
+            raise tables.NoSuchNodeError
         return freq_data
 
+    def read_frequency_rows(self, line_name, khz, start=0, stop=None,
+                            align=False):
+        """returns the frequency dict for a single frequency holding the
+        traces at positions start to stop.  With align, stop is moved
+        forward to the end of the chunk it falls in, so no chunk is
+        decompressed without all of its traces being returned.
+        """
+        try:
+            with self._open_file('r') as f:
+                freq_group = self._get_frequency_group(f, line_name, khz)
+                n_traces = freq_group.trace_num.shape[0]
+                if stop is None or stop > n_traces:
+                    stop = n_traces
+                chunkshape = freq_group.intensity.chunkshape
+                if align and chunkshape:
+                    chunk_traces = chunkshape[0]
+                    stop = min(n_traces, -(-stop // chunk_traces) *
+                               chunk_traces)
+                freq_data = {}
+                for array in freq_group:
+                    if array.shape and array.shape[0] == n_traces:
+                        freq_data[array.name] = array.read(start, stop)
+                    else:
+                        freq_data[array.name] = array.read()
+                freq_data['kHz'] = self._khz_from_label(freq_group._v_name)
+        except tables.FileModeError:
+            raise tables.NoSuchNodeError
+        return freq_data
+
+    def read_trace_num_repairs(self, line_name):
+        """returns the trace_num values repaired on import, as a dict of
+        'index' and original 'value' arrays
+        """
+        try:
+            with self._open_file('r') as f:
+                line_group = self._get_survey_line_group(f, line_name)
+                table = f.getNode(line_group, 'trace_num_repairs')
+                repairs = {
+                    'index': table.col('index'),
+                    'value': table.col('value'),
+                }
+        except tables.FileModeError:
+            raise tables.NoSuchNodeError
+        return repairs
+
     def read_survey_line_coords(self, line_name):
         try:
             with self._open_file('r') as f:
@@ -183,6 +451,7 @@ class HDF5Backend(object):
     def write_pick(self, line_data, line_name, line_type):
         """writes a pick line (current surface or preimpoundment) to hdf5 file
         """
+        line_data = dict(line_data)
         with self._open_file('a') as f:
             pick_name = line_data['name']
             pick_line_group = self._get_pick_line_group(f, line_name, line_type, pick_name)
@@ -192,42 +461,229 @@ class HDF5Backend(object):
             for key, value in line_data.iteritems():
                 pick_line_group._v_attrs[key] = self._safe_serialize(value)
 
+    def write_core_samples(self, core_sample_dicts):
+        core_ids = sorted(core_sample_dicts)
+        # longer ids would be silently truncated, and could then collide
+        too_long = [core_id for core_id in core_ids
+                    if len(str(core_id)) > MAX_CORE_ID_LENGTH]
+        if too_long:
+            raise ValueError(
+                "Core ids longer than {} characters cannot be stored: "
+                "{}".format(MAX_CORE_ID_LENGTH, ', '.join(map(str, too_long))))
+        cores = [core_sample_dicts[core_id] for core_id in core_ids]
+        rows = [
+            (str(core_id), core['easting'], core['northing'])
+            for core_id, core in zip(core_ids, cores)
+        ]
+        depths = [
+            np.asarray(core['layer_interface_depths'], dtype=np.float64)
+            for core in cores
+        ]
+        extras = [
+            self._safe_serialize(dict(
+                (key, value) for key, value in core.iteritems()
+                if key not in CORE_SAMPLE_FIELDS
+            ))
+            for core in cores
+        ]
+        with self._open_file('a') as f:
+            core_samples_group = self._get_core_samples_group(f)
+            self._write_table(f, core_samples_group, 'samples', CoreSampleRow,
+                              rows)
+            self._write_vlarray(f, core_samples_group,
+                                'layer_interface_depths',
+                                tables.Float64Atom(), depths)
+            self._write_vlarray(f, core_samples_group, 'extra',
+                                tables.VLStringAtom(), extras)
+
+    def write_import_manifest(self, manifest):
+        """replaces the import manifest with manifest, a dict in the format
+        returned by read_import_manifest
+        """
+        rows = [
+            (path, entry['kind'], entry['size'], entry['mtime'], entry['sha1'])
+            for path, entry in sorted(manifest.iteritems())
+        ]
+        with self._open_file('a') as f:
+            self._write_table(f, f.root, 'import_manifest', ImportManifestRow,
+                              rows)
+
+    def write_survey_catalog(self, catalog):
+        """replaces the survey catalog with catalog, a list of entries in the
+        format returned by read_survey_catalog
+        """
+        rows = []
+        nav_start = 0
+        for entry in catalog:
+            nav_stop = nav_start + len(entry['navigation_line'])
+            rows.append((entry['name'], entry['group'], entry['n_traces'])
+                        + tuple(entry['bounds'])
+                        + (entry['length'], nav_start, nav_stop))
+            nav_start = nav_stop
+        frequencies = [np.asarray(entry['frequencies'], dtype=np.float64)
+                       for entry in catalog]
+        if catalog:
+            nav_coords = np.vstack([entry['navigation_line']
+                                    for entry in catalog])
+        else:
+            nav_coords = np.zeros((0, 2))
+        with self._open_file('a') as f:
+            catalog_group = self._get_survey_catalog_group(f)
+            self._write_table(f, catalog_group, 'lines', SurveyCatalogRow,
+                              rows)
+            self._write_vlarray(f, catalog_group, 'frequencies',
+                                tables.Float64Atom(), frequencies)
+            self._write_array(f, catalog_group, 'nav_coords', nav_coords)
+
+    def write_picks(self, picks):
+        """writes a sequence of (line_data, line_name, line_type) picks as a
+        single transaction: the file is flushed once at the end, and if any
+        write fails every change made by the batch is undone.
+        """
+        with self._open_file('a') as f:
+            undo_was_enabled = f.isUndoEnabled()
+            if not undo_was_enabled:
+                f.enableUndo()
+            try:
+                mark = f.mark()
+                try:
+                    for line_data, line_name, line_type in picks:
+                        self.write_pick(line_data, line_name, line_type)
+                except:
+                    f.undo(mark)
+                    raise
+            finally:
+                if not undo_was_enabled:
+                    f.disableUndo()
+
+    def compact(self, storage_policy=None):
+        """rewrites the file contiguously, dropping the space left behind by
+        replaced arrays and any dangling tmp arrays.
+
+        Compressed arrays are recompressed with storage_policy (default: the
+        backend's current policy), which becomes the backend's policy for
+        later writes. The copy is written next to the file and checked
+        against the original before being swapped in, so the original is
+        untouched if anything goes wrong.
+
+        returns {'old_size', 'new_size', 'bytes_reclaimed'}
+        """
+        if storage_policy is None:
+            storage_policy = self.storage_policy
+        compact_path = self.filepath + '.compact'
+        backup_path = self.filepath + '.bak'
+        with self._lock, self._file_locked('a'):
+            if self._depth > 0:
+                raise tables.FileModeError(
+                    "Cannot compact {} while it is in use".format(
+                        self.filepath))
+            self.close()
+            old_size = os.path.getsize(self.filepath)
+            writer = HDF5Backend(compact_path, storage_policy)
+            try:
+                src = tables.openFile(self.filepath, 'r')
+                try:
+                    self._check_version(src)
+                    dst = tables.openFile(compact_path, 'w')
+                    try:
+                        writer._copy_tree(src, dst)
+                    finally:
+                        dst.close()
+                    self._verify_copy(src, compact_path)
+                finally:
+                    src.close()
+            except:
+                if os.path.exists(compact_path):
+                    os.remove(compact_path)
+                raise
+            os.rename(self.filepath, backup_path)
+            try:
+                os.rename(compact_path, self.filepath)
+            except:
+                os.rename(backup_path, self.filepath)
+                raise
+            os.remove(backup_path)
+            self.storage_policy = storage_policy
+        new_size = os.path.getsize(self.filepath)
+        return {
+            'old_size': old_size,
+            'new_size': new_size,
+            'bytes_reclaimed': old_size - new_size,
+        }
+
+    def _copy_tree(self, src, dst):
+        """copies every node of src into the new file dst, writing CArrays
+        with this backend's storage policy
+        """
+        src.root._v_attrs._f_copy(dst.root)
+        for node in src.walkNodes('/'):
+            if node is src.root or node._v_name.startswith('__tmp_'):
+                continue
+            parent = dst.getNode(node._v_parent._v_pathname)
+            if isinstance(node, tables.Group):
+                group = dst.createGroup(parent, node._v_name)
+                node._v_attrs._f_copy(group)
+            elif isinstance(node, tables.CArray):
+                array = self._create_array(dst, parent, node.name,
+                                           node.read(), compress=True)
+                node._v_attrs._f_copy(array)
+            else:
+                node.copy(parent, node.name)
+
+    def _verify_copy(self, src, copy_path):
+        """raises ValueError unless every leaf of src exists in the file at
+        copy_path with the same shape and node type
+        """
+        def leaf_info(f):
+            return dict(
+                (leaf._v_pathname, (leaf.shape, type(leaf).__name__))
+                for leaf in f.walkNodes('/')
+                if isinstance(leaf, tables.Leaf)
+                and not leaf.name.startswith('__tmp_')
+            )
+        copy = tables.openFile(copy_path, 'r')
+        try:
+            matches = (leaf_info(src) == leaf_info(copy)
+                       and copy.root._v_attrs.version ==
+                       src.root._v_attrs.version)
+        finally:
+            copy.close()
+        if not matches:
+            raise ValueError(
+                "Compacted copy of {} does not match the original; the "
+                "original has been left untouched.".format(self.filepath))
+
     def _get_core_samples_group(self, f):
         """returns the group for the collection of core_sample data for a
         survey. Core samples could be attached to f.root, but giving core
         samples a group node allows the len(f.listNodes('/')) to still work as
         simple check for whether or not the file is new.
         """
-        name = 'core_samples'
-        try:
-            core_sample_group = f.getNode('/', name)
-        except tables.NoSuchNodeError:
-            core_sample_group = f.createGroup('/', name)
-        return core_sample_group
+        return self._get_or_create_group(f, f.root, 'core_samples')
 
     def _get_frequency_group(self, f, line_name, khz):
         """returns the group for the collection of frequency data for a survey line"""
         frequencies_group = self._get_frequencies_group(f, line_name)
         frequency_label = 'khz_' + str(khz).replace('.', '_')
-        try:
-            frequency_group = f.getNode(frequencies_group, frequency_label)
-        except tables.NoSuchNodeError:
-            frequency_group = f.createGroup(frequencies_group, frequency_label)
-        return frequency_group
+        return self._get_or_create_group(f, frequencies_group, frequency_label)
 
     def _get_frequencies_group(self, f, line_name):
         """returns the group for the collection of frequency data for a survey line"""
         survey_line_group = self._get_survey_line_group(f, line_name)
-        try:
-            frequency_group = f.getNode(survey_line_group, 'frequencies')
-        except tables.NoSuchNodeError:
-            frequency_group = f.createGroup(survey_line_group, 'frequencies')
-        return frequency_group
+        return self._get_or_create_group(f, survey_line_group, 'frequencies')
 
     def _get_or_create_group(self, f, parent, name):
+        """returns the named child group of parent, creating it if necessary.
+
+        When the current access is a read, missing groups are not created
+        (even if the shared handle happens to be writable) and
+        NoSuchNodeError is raised instead.
+        """
         try:
             group = f.getNode(parent, name)
         except tables.NoSuchNodeError:
+            if self._access_mode == 'r':
+                raise
             group = f.createGroup(parent, name)
         return group
 
@@ -251,49 +707,126 @@ class HDF5Backend(object):
     def _get_sdi_data_unseparated_group(self, f, line_name):
         """returns the group for the collection of frequency data for a survey line"""
         survey_line_group = self._get_survey_line_group(f, line_name)
-        try:
-            sdi_data_unseparated_group = f.getNode(survey_line_group, 'sdi_data_unseparated')
-        except tables.NoSuchNodeError:
-            sdi_data_unseparated_group = f.createGroup(survey_line_group, 'sdi_data_unseparated')
-        return sdi_data_unseparated_group
+        return self._get_or_create_group(f, survey_line_group, 'sdi_data_unseparated')
 
     def _get_shoreline_group(self, f):
         """returns the group for lake shoreline"""
         return self._get_or_create_group(f, f.root, 'shoreline')
 
+    def _get_survey_catalog_group(self, f):
+        """returns the group for the survey catalog"""
+        return self._get_or_create_group(f, f.root, 'survey_catalog')
+
     def _get_survey_lines_group(self, f):
         """returns the group for the collection of survey_lines - creating it if necessary"""
-        try:
-            survey_lines_group = f.getNode('/survey_lines')
-        except tables.NoSuchNodeError:
-            survey_lines_group = f.createGroup(f.root, 'survey_lines')
-        return survey_lines_group
+        return self._get_or_create_group(f, f.root, 'survey_lines')
 
     def _get_survey_line_group(self, f, line_name):
         """returns a group for a specific survey_line - creating it if necessary"""
         survey_lines = self._get_survey_lines_group(f)
         group_label = 'line_' + line_name
-        try:
-            line_group = f.getNode(survey_lines, group_label)
-        except tables.NoSuchNodeError:
-            line_group = f.createGroup(survey_lines, group_label)
-        return line_group
+        return self._get_or_create_group(f, survey_lines, group_label)
 
     @contextlib.contextmanager
     def _open_file(self, mode):
-        """context manager that opens a file and also checks that the hydropick
-        version number is correct
+        """context manager that provides the shared file handle, opening it
+        (or reopening it writable) as needed for the requested mode.
+
+        Writes are flushed when the outermost context exits; the handle itself
+        stays open for the next call.
         """
-        with tables.openFile(self.filepath, mode) as f:
-            if len(f.listNodes('/')) == 0:
-                f.root._v_attrs.version = self.hydropick_format_version
-            if not hasattr(f.root._v_attrs, 'version') or f.root._v_attrs.version != self.hydropick_format_version:
-                # TODO: implement upgrade code
-                raise NotImplementedError(
-                    "Unsupported version of hdf5 backend file. Delete file and try again."
-                )
-            else:
+        with self._lock, self._file_locked(mode):
+            f = self._get_handle(mode)
+            previous_mode = self._access_mode
+            self._access_mode = mode
+            self._depth += 1
+            try:
                 yield f
+            finally:
+                self._depth -= 1
+                self._access_mode = previous_mode
+                if self._depth == 0 and f.isopen and f.mode != 'r':
+                    f.flush()
+
+    @contextlib.contextmanager
+    def _file_locked(self, mode):
+        """context manager holding the inter-process lock for mode (shared
+        for 'r', exclusive otherwise) in concurrent mode. Does nothing if
+        the lock is already held or the backend is not concurrent.
+        """
+        if not self.concurrent or self._file_lock_held:
+            yield
+            return
+        if self._file_lock is None:
+            self._file_lock = FileLock(self.filepath)
+        self._file_lock.acquire(exclusive=(mode != 'r'))
+        self._file_lock_held = True
+        try:
+            if self._file is not None and \
+                    self._file_stat != self._current_file_stat():
+                # another process has changed the file since we last held
+                # the lock, so anything the handle has cached may be stale
+                self._close_handle()
+            yield
+        finally:
+            self._file_stat = self._current_file_stat()
+            self._file_lock_held = False
+            self._file_lock.release()
+
+    def _current_file_stat(self):
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def _close_handle(self):
+        if self._file is not None:
+            if self._file.isopen:
+                self._file.close()
+            self._file = None
+
+    def _get_handle(self, mode):
+        """returns an open handle usable for mode, upgrading a read-only
+        handle to append mode if a write is requested.
+        """
+        f = self._file
+        if f is not None and f.isopen:
+            if mode == 'r' or f.mode != 'r':
+                return f
+            if self._depth > 0:
+                raise tables.FileModeError(
+                    "Cannot upgrade {} to writable while a read is in "
+                    "progress".format(self.filepath))
+            f.close()
+        self._file = None
+        f = tables.openFile(self.filepath, 'r' if mode == 'r' else 'a')
+        try:
+            self._check_version(f)
+        except:
+            f.close()
+            raise
+        self._file = f
+        return f
+
+    def _check_version(self, f):
+        """checks that the hydropick version number of an opened file is
+        correct, stamping it on new files.
+        """
+        if len(f.listNodes('/')) == 0 and f.mode != 'r':
+            f.root._v_attrs.version = self.hydropick_format_version
+        if not hasattr(f.root._v_attrs, 'version') or f.root._v_attrs.version != self.hydropick_format_version:
+            # TODO: implement upgrade code
+            raise NotImplementedError(
+                "Unsupported version {} of hdf5 backend file (expected {}). "
+                "Delete file and try again.".format(
+                    getattr(f.root._v_attrs, 'version', None),
+                    self.hydropick_format_version)
+            )
+
+    def _khz_from_label(self, frequency_label):
+        """returns the frequency of a 'khz_208_333' style group name"""
+        return np.float(frequency_label[4:].replace('_', '.'))
 
     def _read_pick(self, pick_line_group):
         """returns a dict representation of a pick line group"""
@@ -324,7 +857,23 @@ class HDF5Backend(object):
         """
         return json.loads(string)
 
-    def _write_array(self, f, group, name, array):
+    def _create_array(self, f, group, name, array, compress=False):
+        """Create group/name from array. If compress is True the array is
+        written as a chunked, compressed CArray following the storage policy.
+        """
+        if compress and np.ndim(array) > 0 and np.size(array) > 0:
+            array = np.asarray(array)
+            policy = self.storage_policy
+            atom = tables.Atom.from_dtype(array.dtype)
+            chunkshape = policy.chunkshape(array.shape, array.dtype.itemsize)
+            node = f.createCArray(group, name, atom, array.shape,
+                                  filters=policy.filters,
+                                  chunkshape=chunkshape)
+            node[:] = array
+            return node
+        return f.createArray(group, name, array)
+
+    def _write_array(self, f, group, name, array, compress=False):
         """Write an array to group/name, replacing it if it already exists or
         creating it if it doesn't.
         """
@@ -337,16 +886,38 @@ class HDF5Backend(object):
                     "it you are seeing this a lot.".format(tmp_name))
                 getattr(group, tmp_name).remove()
                 f.flush()
-            tmp_array = f.createArray(group, tmp_name, array)
+            tmp_array = self._create_array(f, group, tmp_name, array, compress)
             tmp_array.move(group, name, overwrite=True)
         else:
-            f.createArray(group, name, array)
+            self._create_array(f, group, name, array, compress)
 
-    def _write_core_samples(self, core_sample_dicts):
-        with self._open_file('a') as f:
-            core_samples_group = self._get_core_samples_group(f)
-            core_samples_group._v_attrs.core_samples = self._safe_serialize(core_sample_dicts)
-            f.flush()
+    def _write_table(self, f, group, name, description, rows):
+        """Write a table of rows (sequence of tuples in column order) to
+        group/name, replacing it if it already exists.
+        """
+        tmp_name = '__tmp_' + name
+        if tmp_name in group:
+            getattr(group, tmp_name).remove()
+        table = f.createTable(group, tmp_name, description,
+                              expectedrows=max(len(rows), 1))
+        if rows:
+            table.append(rows)
+        table.move(group, name, overwrite=True)
+        return table
+
+    def _write_vlarray(self, f, group, name, atom, rows):
+        """Write a variable length array with one row per item of rows to
+        group/name, replacing it if it already exists.
+        """
+        tmp_name = '__tmp_' + name
+        if tmp_name in group:
+            getattr(group, tmp_name).remove()
+        vlarray = f.createVLArray(group, tmp_name, atom,
+                                  expectedsizeinMB=1.0)
+        for row in rows:
+            vlarray.append(row)
+        vlarray.move(group, name, overwrite=True)
+        return vlarray
 
     def _write_freq_dicts(self, line_name, freq_dicts):
         with self._open_file('a') as f:
@@ -354,8 +925,8 @@ class HDF5Backend(object):
                 khz = freq_dict.pop('kHz')
                 freq_group = self._get_frequency_group(f, line_name, khz)
                 for key, value in freq_dict.iteritems():
-                    self._write_array(f, freq_group, key, value)
-            f.flush()
+                    self._write_array(f, freq_group, key, value,
+                                      compress=(key == 'intensity'))
 
     def _write_raw_sdi_dict(self, line_name, raw_dict):
         with self._open_file('a') as f:
@@ -367,4 +938,3 @@ class HDF5Backend(object):
                     if key is 'date':
                         value = line_name
                     self._write_array(f, sdi_unsep_grp, key, value)
-            f.flush()
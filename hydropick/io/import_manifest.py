@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+from hydropick.io import survey_io
+
+# read files in blocks this size when hashing
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_sha1(path):
+    """ Return the hex sha1 digest of a file's contents """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class ImportManifest(object):
+    """ The record of which source files have been imported into a survey's
+    HDF5 store.
+
+    Each imported file is stored with its size, mtime and sha1, keyed by its
+    path relative to the HDF5 file's directory.  A file needs importing if it
+    has no entry or its contents differ from the recorded ones; size and mtime
+    are compared first so that unchanged files are never hashed.
+
+    Entries are only recorded once a file's data has been written, so a file
+    whose import was interrupted is imported again next time.  Call save()
+    to write recorded entries to the store.
+    """
+
+    def __init__(self, h5file):
+        self.h5file = h5file
+        self.root = os.path.dirname(os.path.abspath(h5file))
+        self.entries = survey_io.read_import_manifest_from_hdf(h5file)
+        self._dirty = False
+
+    def key(self, path):
+        relpath = os.path.relpath(os.path.abspath(path), self.root)
+        return relpath.replace(os.sep, '/')
+
+    def needs_import(self, path):
+        """ Return True if path is new or has changed since it was recorded.
+        """
+        entry = self.entries.get(self.key(path))
+        if entry is None:
+            return True
+        stat = os.stat(path)
+        if entry['size'] != stat.st_size:
+            return True
+        if entry['mtime'] == stat.st_mtime:
+            return False
+        # touched but possibly unchanged: let the contents decide
+        if entry['sha1'] != file_sha1(path):
+            return True
+        # remember the new mtime so the file is not hashed again
+        entry['mtime'] = stat.st_mtime
+        self._dirty = True
+        return False
+
+    def record(self, path, kind):
+        """ Record path as imported, as a file of the given kind ('sdi',
+        'corestick', 'shoreline' or 'pick').
+        """
+        stat = os.stat(path)
+        self.entries[self.key(path)] = {
+            'kind': kind,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': file_sha1(path),
+        }
+        self._dirty = True
+
+    def save(self):
+        if self._dirty:
+            survey_io.write_import_manifest_to_hdf(self.h5file, self.entries)
+            self._dirty = False
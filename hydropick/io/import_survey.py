@@ -9,14 +9,14 @@ from __future__ import absolute_import
 
 import logging
 import glob
+import multiprocessing
 import os
 import warnings
 
 import tables
 
-from hydropick.io import survey_io
-from hydropick.io.survey_io import (import_survey_line_from_file,
-                                    read_survey_line_from_hdf)
+from hydropick.io import backend, survey_io
+from hydropick.io.import_manifest import ImportManifest
 
 logger = logging.getLogger(__name__)
 
@@ -45,18 +45,22 @@ def get_number_of_bin_files(path):
         file_names += files_bin
     return len(file_names)
 
-def import_cores(directory, h5file):
+def import_cores(directory, h5file, manifest=None):
     from ..model.core_sample import CoreSample
 
-    try:
-        core_dicts = survey_io.read_core_samples_from_hdf(h5file)
-    except (IOError, tables.exceptions.NoSuchNodeError):
-        for filename in os.listdir(directory):
-            if os.path.splitext(filename)[1] == '.txt':
-                corestick_file = os.path.join(directory, filename)
-                survey_io.import_core_samples_from_file(corestick_file, h5file)
-
-        core_dicts = survey_io.read_core_samples_from_hdf(h5file)
+    if manifest is None:
+        manifest = ImportManifest(h5file)
+    corestick_files = [os.path.join(directory, filename)
+                       for filename in sorted(os.listdir(directory))
+                       if os.path.splitext(filename)[1] == '.txt']
+    # the core samples are stored as one table, so a change to any file
+    # means reading them all again
+    if any(manifest.needs_import(f) for f in corestick_files):
+        survey_io.import_core_samples_from_files(corestick_files, h5file)
+        for corestick_file in corestick_files:
+            manifest.record(corestick_file, 'corestick')
+    manifest.save()
+    core_dicts = survey_io.read_core_samples_from_hdf(h5file)
 
     # this is a corestick file
     return [
@@ -69,79 +73,178 @@ def import_cores(directory, h5file):
     ]
 
 
-def import_pick_files(directory, h5file):
-    # find the GIS file in the directory
-    for path in glob.glob(directory + '/*/*/*[pic,pre]'):
-        survey_io.import_pick_line_from_file(path, h5file)
+def import_pick_files(directory, h5file, manifest=None):
+    if manifest is None:
+        manifest = ImportManifest(h5file)
+    try:
+        for path in glob.glob(directory + '/*/*/*[pic,pre]'):
+            if manifest.needs_import(path):
+                survey_io.import_pick_line_from_file(path, h5file)
+                manifest.record(path, 'pick')
+    finally:
+        manifest.save()
 
 
-def import_lake(name, directory, h5file):
-    try:
-        shoreline = survey_io.read_shoreline_from_hdf(h5file)
-    except (IOError, tables.exceptions.NoSuchNodeError):
-        # find the GIS file in the directory
-        for filename in os.listdir(directory):
-            if os.path.splitext(filename)[1] == '.shp':
-                shp_file = os.path.join(directory, filename)
+def import_lake(name, directory, h5file, manifest=None):
+    if manifest is None:
+        manifest = ImportManifest(h5file)
+    # find the GIS file in the directory
+    for filename in sorted(os.listdir(directory)):
+        if os.path.splitext(filename)[1] == '.shp':
+            shp_file = os.path.join(directory, filename)
+            if manifest.needs_import(shp_file):
                 survey_io.import_shoreline_from_file(name, shp_file, h5file)
+                manifest.record(shp_file, 'shoreline')
                 print 'imported shp file:', filename
-                break
-        shoreline = survey_io.read_shoreline_from_hdf(h5file)
-    return shoreline
+            break
+    manifest.save()
+    return survey_io.read_shoreline_from_hdf(h5file)
+
+
+def _parse_sdi_file(path):
+    """ Parse one .bin file in a worker process.
+
+    Returns (path, data, error message); any exception is caught here so one
+    bad file cannot take down the pool.
+    """
+    try:
+        return path, survey_io.parse_survey_line_file(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def _parsed_sdi_files(paths, workers):
+    """ Yields (path, data, error message) for every path, in completion
+    order.  Files are parsed in a pool of worker processes; with a single
+    worker they are parsed in this process.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield _parse_sdi_file(path)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(_parse_sdi_file, paths):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _warn_import_failed(filename, e):
+    # XXX: blind except to read all the lines that we can for now
+    s = 'Reading file {} failed with error "{}"'
+    msg = s.format(filename, e)
+    warnings.warn(msg)
+    logger.warning(msg)
+
 
+def import_sdi(directory, h5file, workers=None, manifest=None):
+    """ Import every .bin file under directory that is new or has changed
+    since it was last imported into h5file.
 
-def import_sdi(directory, h5file):
+    Binary files are parsed by a pool of `workers` processes (default: one
+    per CPU) while this process is the only one writing to h5file, writing
+    each line as soon as it has been parsed.
+
+    The survey catalog (one entry per line, see backend.summarize_survey_line)
+    is rewritten at the end, and the survey lines are built from it so that
+    lines which did not need importing are never read individually.
+    """
     from hydropick.model.survey_line_group import SurveyLineGroup
-    survey_lines = []
-    survey_line_groups = []
+    if manifest is None:
+        manifest = ImportManifest(h5file)
     location, proj_dir = os.path.split(directory)
     N_bin_total = get_number_of_bin_files(directory)
-    i_total = 0
+
+    # find which lines still need importing
+    folders = []
+    catalog = dict((entry['name'], entry) for entry in
+                   survey_io.read_survey_catalog_from_hdf(h5file))
+    entries = {}
+    to_import = []
     for root, dirs, files in os.walk(directory):
-        group_lines = []
         currentd = root.split(location)[1]
-        N_dir = len(dirs)
         files_bin = [f for f in files if os.path.splitext(f)[1] == '.bin']
-        N_files = len(files_bin)
         print '\nchecking project folder: "{}"\n with {} sub-directories'\
-               .format(currentd, N_dir)
-        print 'loading {} .bin files'.format(N_files)
-        i = 0
+               .format(currentd, len(dirs))
+        print 'found {} .bin files'.format(len(files_bin))
+        folders.append((root, files_bin))
         for filename in files_bin:
-            i += 1
-            i_total += 1
+            path = os.path.join(root, filename)
             linename = os.path.splitext(filename)[0]
-            print '{}  ({}/{} in folder : {}/{} total)'\
-                  .format(linename, i, N_files, i_total, N_bin_total)
+            if manifest.needs_import(path):
+                to_import.append(path)
+                continue
+            if linename in catalog:
+                entries[linename] = catalog[linename]
+                continue
             try:
-                line = read_survey_line_from_hdf(h5file, linename)
+                entries[linename] = survey_io.\
+                    read_survey_line_summary_from_hdf(h5file, linename)
             except (IOError, tables.exceptions.NoSuchNodeError):
-                logger.info("Importing sdi file '%s'", filename)
-                try:
-                    import_survey_line_from_file(os.path.join(root,
-                                                              filename),
-                                                 h5file, linename)
-                    line = read_survey_line_from_hdf(h5file, linename)
-                except Exception as e:
-                    # XXX: blind except to read all the lines that we
-                    # can for now
-                    s = 'Reading file {} failed with error "{}"'
-                    msg = s.format(filename, e)
-                    warnings.warn(msg)
-                    logger.warning(msg)
-                    line = None
-            if line:
-                group_lines.append(line)
+                to_import.append(path)
+
+    # parse in parallel, write from here
+    N_import = len(to_import)
+    print 'importing {} of {} .bin files'.format(N_import, N_bin_total)
+    parsed = _parsed_sdi_files(to_import, workers)
+    try:
+        for i, (path, data, error) in enumerate(parsed):
+            filename = os.path.basename(path)
+            linename = os.path.splitext(filename)[0]
+            print '{}  ({}/{})'.format(linename, i + 1, N_import)
+            if error is not None:
+                _warn_import_failed(filename, error)
+                continue
+            logger.info("Importing sdi file '%s'", filename)
+            if data['trace_num_repairs']:
+                logger.warning("Repaired %d bad trace_num values in '%s'",
+                               len(data['trace_num_repairs']), filename)
+            try:
+                entry = backend.summarize_binary_data(data)
+                survey_io.write_survey_line_to_hdf(h5file, data)
+                manifest.record(path, 'sdi')
+                entries[linename] = entry
+            except Exception as e:
+                _warn_import_failed(filename, e)
+    finally:
+        manifest.save()
+
+    # build catalog and groups in directory order
+    catalog = []
+    survey_lines = []
+    survey_line_groups = []
+    for root, files_bin in folders:
+        dirname = os.path.basename(root)
+        group_lines = []
+        for filename in files_bin:
+            entry = entries.get(os.path.splitext(filename)[0])
+            if entry:
+                entry['group'] = dirname
+                catalog.append(entry)
+                group_lines.append(
+                    survey_io.survey_line_from_catalog_entry(h5file, entry))
         if group_lines:
-            dirname = os.path.basename(root)
             group = SurveyLineGroup(name=dirname, survey_lines=group_lines)
             survey_lines += group_lines
             survey_line_groups.append(group)
+    survey_io.write_survey_catalog_to_hdf(h5file, catalog)
     return survey_lines, survey_line_groups
 
 
-def import_survey(directory, with_pick_files=False):
-    """ Read in a project from the current directory-based format """
+def import_survey(directory, with_pick_files=False, workers=None):
+    """ Read in a project from the current directory-based format
+
+    workers is the number of processes used to parse SDI binary files
+    (default: one per CPU).
+    """
     from ..model.survey import Survey
 
     name = get_name(directory)
@@ -150,20 +253,27 @@ def import_survey(directory, with_pick_files=False):
     hdf5_file = os.path.join(directory, name + '.h5')
     print hdf5_file
 
+    # only new or changed source files are imported
+    manifest = ImportManifest(hdf5_file)
+
     # read in core samples
-    core_samples = import_cores(os.path.join(directory, 'Coring'), hdf5_file)
+    core_samples = import_cores(os.path.join(directory, 'Coring'), hdf5_file,
+                                manifest=manifest)
 
     # read in lake
-    lake = import_lake(name, os.path.join(directory, 'ForSurvey'), hdf5_file)
+    lake = import_lake(name, os.path.join(directory, 'ForSurvey'), hdf5_file,
+                       manifest=manifest)
 
     # read in sdi data
     survey_lines, survey_line_groups = import_sdi(os.path.join(directory,
                                                                'SDI_Data'),
-                                                  hdf5_file)
+                                                  hdf5_file, workers=workers,
+                                                  manifest=manifest)
 
     # read in edits to sdi data
     if with_pick_files:
-        import_pick_files(os.path.join(directory, 'SDI_Edits'), hdf5_file)
+        import_pick_files(os.path.join(directory, 'SDI_Edits'), hdf5_file,
+                          manifest=manifest)
 
     survey = Survey(
         name=name,
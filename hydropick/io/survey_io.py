@@ -6,12 +6,13 @@
 #
 
 from __future__ import absolute_import
+import contextlib
 import logging
 import numpy as np
 
 from shapely.geometry import LineString
 
-from . import hdf5
+from . import backend
 from ..model.depth_line import DepthLine
 from ..model.survey_line import SurveyLine
 from ..model.lake import Lake
@@ -19,63 +20,182 @@ from ..model.lake import Lake
 logger = logging.getLogger(__name__)
 
 
+def close_hdf(h5file):
+    """ Close the shared file handle for h5file.  The next call that touches
+    the file will transparently reopen it.
+    """
+    backend.close_backend(h5file)
+
+
+def use_backend(h5file, storage_backend):
+    """ Make every survey_io function given h5file use storage_backend (a
+    backend.StorageBackend) instead of the one chosen from the path.
+    """
+    backend.register_backend(h5file, storage_backend)
+
+
+def compact_hdf(h5file, storage_policy=None):
+    """ Rewrite h5file contiguously, reclaiming the space left by replaced
+    arrays and recompressing with storage_policy if given.  Returns a dict
+    with 'old_size', 'new_size' and 'bytes_reclaimed'.
+    """
+    logger.info("Compacting '%s'", h5file)
+    return backend.get_backend(h5file).compact(storage_policy)
+
+
+def set_concurrent_access(enabled):
+    """ Share survey files with other processes: one writer and any number
+    of readers, coordinated with file locks.  Every process using a file
+    must enable this for the locking to be effective.
+    """
+    backend.set_concurrent_access(enabled)
+
+
+def hdf_snapshot(h5file):
+    """ Context manager within which all reads of h5file see the same
+    state of the file, even while another process writes to it.
+    """
+    return backend.get_backend(h5file).snapshot()
+
+
 def import_survey_line_from_file(filename, h5file, linename):
-    hdf5.HDF5Backend(h5file).import_binary_file(filename)
+    backend.get_backend(h5file).import_binary_file(filename)
+
+
+def parse_survey_line_file(filename):
+    """ Parse an SDI binary file without touching any HDF5 file.  Safe to
+    call from worker processes; write the result with
+    write_survey_line_to_hdf.
+    """
+    return backend.parse_binary_file(filename)
+
+
+def write_survey_line_to_hdf(h5file, data):
+    backend.get_backend(h5file).write_binary_data(data)
 
 
 def import_core_samples_from_file(filename, h5file):
     logger.info("Importing corestick file '%s'", filename)
-    hdf5.HDF5Backend(h5file).import_corestick_file(filename)
+    backend.get_backend(h5file).import_corestick_file(filename)
+
+
+def import_core_samples_from_files(filenames, h5file):
+    """ Replace the core samples with those of all the corestick files """
+    logger.info("Importing corestick files %s", ', '.join(filenames))
+    backend.get_backend(h5file).import_corestick_files(filenames)
 
 
 def import_pick_line_from_file(filename, h5file):
-    hdf5.HDF5Backend(h5file).import_pick_file(filename)
+    backend.get_backend(h5file).import_pick_file(filename)
 
 
 def import_shoreline_from_file(lake_name, filename, h5file):
     logger.info("Importing shoreline file '%s'", filename)
-    hdf5.HDF5Backend(h5file).import_shoreline_file(lake_name, filename)
+    backend.get_backend(h5file).import_shoreline_file(lake_name, filename)
+
+
+def read_import_manifest_from_hdf(h5file):
+    return backend.get_backend(h5file).read_import_manifest()
+
+
+def write_import_manifest_to_hdf(h5file, manifest):
+    backend.get_backend(h5file).write_import_manifest(manifest)
 
 
 def read_core_samples_from_hdf(h5file):
-    return hdf5.HDF5Backend(h5file).read_core_samples()
+    return backend.get_backend(h5file).read_core_samples()
+
+
+def read_core_sample_arrays_from_hdf(h5file):
+    """ Read core samples as parallel arrays ('core_id', 'easting',
+    'northing', ...) without building a dict per core.
+    """
+    return backend.get_backend(h5file).read_core_sample_arrays()
 
 
 def read_shoreline_from_hdf(h5file):
-    shoreline_dict = hdf5.HDF5Backend(h5file).read_shoreline()
+    shoreline_dict = backend.get_backend(h5file).read_shoreline()
     return Lake(
         crs=shoreline_dict['crs'],
         name=shoreline_dict['lake_name'],
         shoreline=shoreline_dict['geometry'],
+        shoreline_coordinates=shoreline_dict['coordinates'],
+        shoreline_part_offsets=shoreline_dict['part_offsets'],
         _properties=shoreline_dict['properties'],
     )
 
 
 def read_survey_line_from_hdf(h5file, name):
-    coords = hdf5.HDF5Backend(h5file).read_survey_line_coords(name)
+    coords = backend.get_backend(h5file).read_survey_line_coords(name)
     line = SurveyLine(name=name,
                       data_file_path=h5file,
                       navigation_line=LineString(coords))
     return line
 
 
+def read_survey_catalog_from_hdf(h5file):
+    return backend.get_backend(h5file).read_survey_catalog()
+
+
+def write_survey_catalog_to_hdf(h5file, catalog):
+    backend.get_backend(h5file).write_survey_catalog(catalog)
+
+
+def read_survey_line_summary_from_hdf(h5file, name):
+    """ Compute the survey catalog entry of a line from its stored data. """
+    return backend.get_backend(h5file).read_survey_line_summary(name)
+
+
+def survey_line_from_catalog_entry(h5file, entry):
+    """ Build a SurveyLine from a survey catalog entry without reading any
+    of the line's data.
+    """
+    return SurveyLine(name=entry['name'],
+                      data_file_path=h5file,
+                      navigation_line=LineString(entry['navigation_line']))
+
+
 def read_frequency_data_from_hdf(h5file, name):
-    return hdf5.HDF5Backend(h5file).read_frequency_data(name)
+    return backend.get_backend(h5file).read_frequency_data(name)
+
+
+def read_frequency_info_from_hdf(h5file, name):
+    return backend.get_backend(h5file).read_frequency_info(name)
+
+
+def read_frequency_window_from_hdf(h5file, name, khz, trace_range=None,
+                                   step=1):
+    """ Read one frequency of a line restricted to the traces whose trace_num
+    is within trace_range=(first, last), keeping every step'th trace.
+    step reduces the memory used, not the data read from the file.
+    """
+    return backend.get_backend(h5file).read_frequency_window(
+        name, khz, trace_range=trace_range, step=step)
+
+
+def read_frequency_rows_from_hdf(h5file, name, khz, start=0, stop=None,
+                                 align=False):
+    """ Read traces start to stop of one frequency of a line.  With align,
+    stop is extended to the end of the stored chunk it falls in.
+    """
+    return backend.get_backend(h5file).read_frequency_rows(
+        name, khz, start=start, stop=stop, align=align)
 
 
 def read_sdi_data_unseparated_from_hdf(h5file, name):
-    return hdf5.HDF5Backend(h5file).read_sdi_data_unseparated(name)
+    return backend.get_backend(h5file).read_sdi_data_unseparated(name)
 
 
 def read_pick_lines_from_hdf(h5file, line_name, line_type):
-    pick_lines = hdf5.HDF5Backend(h5file).read_picks(line_name, line_type)
+    pick_lines = backend.get_backend(h5file).read_picks(line_name, line_type)
 
     return dict([
         (name, DepthLine(**pick_line))
         for name, pick_line in pick_lines.iteritems()
     ])
 
-def write_depth_line_to_hdf(h5file, depth_line, survey_line_name):
+def _depth_line_to_pick(depth_line):
+    """ returns the (line_data, line_type) pair the backend stores """
     d = depth_line
     data = dict(
         name=d.name,
@@ -95,49 +215,87 @@ def write_depth_line_to_hdf(h5file, depth_line, survey_line_name):
         line_type = 'current'
     else:
         line_type = 'preimpoundment'
-    hdf5.HDF5Backend(h5file).write_pick(data, survey_line_name, line_type)
+    return data, line_type
+
+
+def write_depth_line_to_hdf(h5file, depth_line, survey_line_name):
+    data, line_type = _depth_line_to_pick(depth_line)
+    backend.get_backend(h5file).write_pick(data, survey_line_name, line_type)
+
+
+class DepthLineBatch(object):
+    """ Stages depth line writes so they can be committed together.
+
+    Use through depth_line_batch(); nothing reaches the file until commit().
+    """
+
+    def __init__(self, h5file):
+        self.h5file = h5file
+        self.picks = []
+
+    def write_depth_line(self, depth_line, survey_line_name):
+        data, line_type = _depth_line_to_pick(depth_line)
+        self.picks.append((data, survey_line_name, line_type))
+
+    def commit(self):
+        if self.picks:
+            backend.get_backend(self.h5file).write_picks(self.picks)
+        self.picks = []
+
+
+@contextlib.contextmanager
+def depth_line_batch(h5file):
+    """ Context manager for writing many depth lines with a single commit.
+
+        with depth_line_batch(h5file) as batch:
+            for line in survey_lines:
+                batch.write_depth_line(line.lake_depths[name], line.name)
+
+    The staged lines are written when the block exits normally, in one
+    transaction: if the block raises nothing is written, and if a write
+    fails the file is rolled back to its state before the batch.
+    """
+    batch = DepthLineBatch(h5file)
+    yield batch
+    batch.commit()
 
 def check_trace_num_array(trace_num_array, survey_line_name):
     ''' checks for bad points in trace_num array.
     assumes trace num array should be a sequential array, 1 to len(array)
-    (as specified in sdi.binary).  Returns bad trace numbers and bad values
-    this should be done when loading survey line arrays and associated depth
-    lines.
+    (as specified in sdi.binary).  Returns bad trace numbers and bad values.
+    Lines imported since trace_num repair moved to import time
+    (see backend.repair_trace_num) never have bad points.
     '''
-    ref = np.arange(len(trace_num_array)) + 1
+    ref = np.arange(1, len(trace_num_array) + 1)
     # this returns index for any traces that don't match ref
-    bad_indices = np.nonzero(trace_num_array - ref)[0]
+    bad_indices = np.flatnonzero(trace_num_array != ref)
     bad_values = trace_num_array[bad_indices]
-    if bad_indices:
+    if bad_indices.size:
         # log the problem
         s = '''trace_num not contiguous for array: {}.
         values of {} at traces {}
-        '''.format('name', bad_values, bad_indices + 1)
+        '''.format(survey_line_name, bad_values, bad_indices + 1)
         logger.warn(s)
-    
+
     return bad_indices, bad_values
 
+def read_trace_num_repairs_from_hdf(h5file, name):
+    return backend.get_backend(h5file).read_trace_num_repairs(name)
+
 def fix_trace_num_arrays(trace_num_array, bad_indices, freq_trace_num):
     ''' Replaces bad trace num values with the appropriate sequential value,
-    then fixes main trace num_array
-    This should really be done in sdi binary read but for now this is a fix.
+    then fixes main trace num_array.
+    Only needed for lines imported before the repair was done at import.
     '''
     for freq, trace_array in freq_trace_num.items():
         # find the trace num indices in the freq trace num subset
-        indices_in_freq = np.where(np.in1d(trace_num_array, trace_array))[0]
+        indices_in_freq = np.flatnonzero(np.in1d(trace_num_array, trace_array))
         # get trace num indices of bad traces in this freq_trace_num array
         bad_in_freq = bad_indices[np.in1d(bad_indices, indices_in_freq)]
-        for index in bad_in_freq:
-            # find the index in freq trace num where this index should go
-            i_in_freq = np.searchsorted(indices_in_freq, index)
-            # set the value to correct trace number which is the index + 1
-            trace_array[i_in_freq] = index + 1
+        # find the indices in freq trace num where they should go and set
+        # the values to the correct trace number, which is the index + 1
+        i_in_freq = np.searchsorted(indices_in_freq, bad_in_freq)
+        trace_array[i_in_freq] = bad_in_freq + 1
     trace_num_array = np.arange(1, len(trace_num_array) + 1)
-    
+
     return trace_num_array, freq_trace_num
-        
-            
-        
-    
-    
-    
@@ -10,10 +10,14 @@ import shutil
 import tempfile
 import unittest
 
+import numpy as np
+import tables
 from shapely.geometry.base import BaseGeometry
 from shapely.geometry import LineString
 
-from hydropick.io import survey_io
+from hydropick.io import backend, hdf5, survey_io
+from hydropick.io import import_survey
+from hydropick.io.import_manifest import ImportManifest
 from hydropick.model.depth_line import DepthLine
 
 
@@ -33,6 +37,7 @@ class TestSurveyIO(unittest.TestCase):
         self.pick_line_file = os.path.join(files_dir, self.pick_line_name + '.pre')
 
     def tearDown(self):
+        survey_io.close_hdf(self.h5file)
         shutil.rmtree(self.tempdir)
 
     def test_import_and_read_from_binary(self):
@@ -42,11 +47,68 @@ class TestSurveyIO(unittest.TestCase):
         self.assertEqual(line.name, self.line_name)
         self.assertIsInstance(line.navigation_line, LineString)
 
+    def test_load_data_is_read_only(self):
+        survey_io.import_survey_line_from_file(self.binary_file, self.h5file, self.line_name)
+        survey_io.close_hdf(self.h5file)
+        line = survey_io.read_survey_line_from_hdf(self.h5file, self.line_name)
+        line.load_data(self.h5file)
+        self.assertEqual(backend.get_backend(self.h5file)._file.mode, 'r')
+        repairs = survey_io.read_trace_num_repairs_from_hdf(self.h5file,
+                                                            self.line_name)
+        self.assertEqual(len(repairs['index']), len(repairs['value']))
+        sdi_surface = line.lake_depths['current_surface_from_bin']
+        self.assertEqual(sdi_surface.source, 'sdi_file')
+        np.testing.assert_array_equal(sdi_surface.index_array,
+                                      line.trace_num - 1)
+
+    def test_repair_trace_num(self):
+        data_raw = {'trace_num': np.array([1, 2, 99, 4, 0, 6])}
+        bad_indices, bad_values = backend.repair_trace_num(data_raw)
+        np.testing.assert_array_equal(bad_indices, [2, 4])
+        np.testing.assert_array_equal(bad_values, [99, 0])
+        np.testing.assert_array_equal(data_raw['trace_num'], np.arange(1, 7))
+
+    def test_repair_trace_num_narrow_dtype(self):
+        # a line longer than the decoded dtype can count
+        trace_num = np.arange(1, 300).astype(np.uint8)
+        data_raw = {'trace_num': trace_num}
+        bad_indices, bad_values = backend.repair_trace_num(data_raw)
+        # only the traces whose values actually wrapped are flagged
+        np.testing.assert_array_equal(bad_indices, np.arange(255, 299))
+        np.testing.assert_array_equal(data_raw['trace_num'],
+                                      np.arange(1, 300))
+
+    def test_fix_trace_num_arrays(self):
+        trace_num = np.array([1, 2, 99, 4, 5, 6])
+        bad_indices, bad_values = survey_io.check_trace_num_array(
+            trace_num, self.line_name)
+        freq_trace_num = {'50.0': np.array([1, 99, 5]),
+                          '200.0': np.array([2, 4, 6])}
+        tn, fn = survey_io.fix_trace_num_arrays(trace_num, bad_indices,
+                                                freq_trace_num)
+        np.testing.assert_array_equal(tn, np.arange(1, 7))
+        np.testing.assert_array_equal(fn['50.0'], [1, 3, 5])
+        np.testing.assert_array_equal(fn['200.0'], [2, 4, 6])
+
     def test_import_and_read_from_corestick(self):
         survey_io.import_core_samples_from_file(self.corestick_file, self.h5file)
         core_samples = survey_io.read_core_samples_from_hdf(self.h5file)
         self.assertIsInstance(core_samples, dict)
         self.assertEqual(len(core_samples), 6)
+        arrays = survey_io.read_core_sample_arrays_from_hdf(self.h5file)
+        for i, core_id in enumerate(arrays['core_id']):
+            core = core_samples[core_id]
+            self.assertEqual(arrays['easting'][i], core['easting'])
+            self.assertEqual(arrays['northing'][i], core['northing'])
+            self.assertIsInstance(core['layer_interface_depths'], list)
+
+    def test_long_core_id_rejected(self):
+        core = {'easting': 0.0, 'northing': 0.0,
+                'layer_interface_depths': [0.0, 1.0]}
+        h5 = backend.get_backend(self.h5file)
+        long_id = 'x' * (hdf5.MAX_CORE_ID_LENGTH + 1)
+        with self.assertRaises(ValueError):
+            h5.write_core_samples({long_id: core})
 
     def test_import_and_read_shoreline(self):
         lake_name = 'Granger'
@@ -58,6 +120,20 @@ class TestSurveyIO(unittest.TestCase):
         self.assertEqual(len(lake.shoreline), 35)
         self.assertEqual(lake.elevation, 504.0)
         self.assertEqual(lake.name, lake_name)
+        parts = lake.shoreline_parts()
+        self.assertEqual(len(parts), 35)
+        for part, line in zip(parts, lake.shoreline):
+            np.testing.assert_array_equal(part, np.array(line.coords))
+
+    def test_flatten_and_build_geometry(self):
+        from shapely.geometry import MultiPolygon, Polygon
+        outer = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 2)]
+        for geom in [LineString([(0, 0), (1, 1), (2, 0)]),
+                     MultiPolygon([Polygon(outer, [hole]), Polygon(hole)])]:
+            arrays = backend.flatten_geometry(geom)
+            rebuilt = backend.build_geometry(geom.geom_type, *arrays)
+            self.assertTrue(rebuilt.equals(geom))
 
     def test_import_and_read_pickfile(self):
         survey_io.import_pick_line_from_file(self.pick_line_file, self.h5file)
@@ -66,3 +142,251 @@ class TestSurveyIO(unittest.TestCase):
         self.assertIsInstance(pick, DepthLine)
         self.assertEqual(len(pick.depth_array), 3606)
         self.assertEqual(len(pick.index_array), 3606)
+
+    def test_backend_handle_is_reused(self):
+        survey_io.import_core_samples_from_file(self.corestick_file, self.h5file)
+        h5_backend = backend.get_backend(self.h5file)
+        self.assertIs(h5_backend, backend.get_backend(self.h5file))
+        survey_io.read_core_samples_from_hdf(self.h5file)
+        handle = h5_backend._file
+        self.assertTrue(h5_backend.is_open)
+        survey_io.read_core_samples_from_hdf(self.h5file)
+        survey_io.import_pick_line_from_file(self.pick_line_file, self.h5file)
+        self.assertIs(handle, h5_backend._file)
+        survey_io.close_hdf(self.h5file)
+        self.assertFalse(h5_backend.is_open)
+        self.assertIsNot(h5_backend, backend.get_backend(self.h5file))
+
+    def test_intensity_stored_chunked_and_compressed(self):
+        survey_io.import_survey_line_from_file(self.binary_file, self.h5file, self.line_name)
+        h5_backend = backend.get_backend(self.h5file)
+        with h5_backend._open_file('r') as f:
+            frequencies = h5_backend._get_frequencies_group(f, self.line_name)
+            for freq in frequencies:
+                intensity = freq.intensity
+                self.assertIsInstance(intensity, tables.CArray)
+                self.assertTrue(intensity.filters.complevel > 0)
+                # chunks hold whole traces
+                self.assertEqual(intensity.chunkshape[1:], intensity.shape[1:])
+
+    def test_storage_policy_chunkshape(self):
+        policy = hdf5.StoragePolicy(chunk_bytes=1000)
+        self.assertEqual(policy.chunkshape((50, 100), 1), (10, 100))
+        self.assertEqual(policy.chunkshape((5, 100), 1), (5, 100))
+        self.assertEqual(policy.chunkshape((50, 2000), 1), (1, 2000))
+
+    def test_parallel_parse_isolates_errors(self):
+        missing = [os.path.join(self.tempdir, name + '.bin')
+                   for name in ('a', 'b', 'c')]
+        for workers in (1, 2):
+            results = list(import_survey._parsed_sdi_files(missing, workers))
+            self.assertEqual(sorted(path for path, _, _ in results), missing)
+            for path, data, error in results:
+                self.assertIsNone(data)
+                self.assertIsNotNone(error)
+
+    def test_separate_frequencies(self):
+        data_raw = {
+            'kHz': np.array([200.0, 50.0, 200.0, 50.0, 24.0]),
+            'trace_num': np.arange(1, 6),
+            'intensity': np.arange(15).reshape(5, 3),
+            'filepath': 'line.bin',
+        }
+        freq_dicts = backend.separate_frequencies(data_raw)
+        self.assertEqual([d['kHz'] for d in freq_dicts], [24.0, 50.0, 200.0])
+        high = freq_dicts[-1]
+        np.testing.assert_array_equal(high['trace_num'], [1, 3])
+        np.testing.assert_array_equal(high['intensity'],
+                                      data_raw['intensity'][[0, 2]])
+        self.assertNotIn('filepath', high)
+
+    def test_read_frequency_window(self):
+        survey_io.import_survey_line_from_file(self.binary_file, self.h5file, self.line_name)
+        full = survey_io.read_frequency_data_from_hdf(self.h5file, self.line_name)
+        info = survey_io.read_frequency_info_from_hdf(self.h5file, self.line_name)
+        self.assertEqual([i['kHz'] for i in info], [d['kHz'] for d in full])
+        freq = full[0]
+        trace_num = freq['trace_num']
+        first, last = trace_num[10], trace_num[49]
+        window = survey_io.read_frequency_window_from_hdf(
+            self.h5file, self.line_name, freq['kHz'], trace_range=(first, last))
+        np.testing.assert_array_equal(window['trace_num'], trace_num[10:50])
+        np.testing.assert_array_equal(window['intensity'],
+                                      freq['intensity'][10:50])
+        decimated = survey_io.read_frequency_window_from_hdf(
+            self.h5file, self.line_name, freq['kHz'], step=4)
+        np.testing.assert_array_equal(decimated['intensity'],
+                                      freq['intensity'][::4])
+
+    def test_read_frequency_rows(self):
+        survey_io.import_survey_line_from_file(self.binary_file, self.h5file, self.line_name)
+        freq = survey_io.read_frequency_data_from_hdf(self.h5file, self.line_name)[0]
+        rows = survey_io.read_frequency_rows_from_hdf(
+            self.h5file, self.line_name, freq['kHz'], start=10, stop=50)
+        np.testing.assert_array_equal(rows['intensity'],
+                                      freq['intensity'][10:50])
+        h5_backend = backend.get_backend(self.h5file)
+        with h5_backend._open_file('r') as f:
+            chunk_traces = h5_backend._get_frequency_group(
+                f, self.line_name, freq['kHz']).intensity.chunkshape[0]
+        head = survey_io.read_frequency_rows_from_hdf(
+            self.h5file, self.line_name, freq['kHz'], stop=1, align=True)
+        n_traces = freq['trace_num'].shape[0]
+        self.assertEqual(head['trace_num'].shape[0],
+                         min(chunk_traces, n_traces))
+
+    def test_import_manifest_detects_changes(self):
+        corestick_file = os.path.join(self.tempdir, 'CoreStick.txt')
+        shutil.copy(self.corestick_file, corestick_file)
+        manifest = ImportManifest(self.h5file)
+        self.assertTrue(manifest.needs_import(corestick_file))
+        survey_io.import_core_samples_from_file(corestick_file, self.h5file)
+        manifest.record(corestick_file, 'corestick')
+        manifest.save()
+
+        manifest = ImportManifest(self.h5file)
+        self.assertFalse(manifest.needs_import(corestick_file))
+        # touched but unchanged
+        stat = os.stat(corestick_file)
+        os.utime(corestick_file, (stat.st_atime, stat.st_mtime + 10))
+        self.assertFalse(manifest.needs_import(corestick_file))
+        # changed
+        with open(corestick_file, 'a') as f:
+            f.write('\n')
+        self.assertTrue(manifest.needs_import(corestick_file))
+
+    def test_import_cores_from_several_files(self):
+        coring_dir = os.path.join(self.tempdir, 'Coring')
+        os.makedirs(coring_dir)
+        with open(self.corestick_file) as f:
+            lines = f.read().splitlines()
+        header, rows = lines[:2], lines[2:]
+        paths = []
+        for name, part in [('a.txt', rows[:2]), ('b.txt', rows[2:])]:
+            path = os.path.join(coring_dir, name)
+            with open(path, 'w') as f:
+                f.write('\n'.join(header + part) + '\n')
+            paths.append(path)
+        cores = import_survey.import_cores(coring_dir, self.h5file)
+        self.assertEqual(sorted(core.core_id for core in cores),
+                         ['1', '2', '3', '4', '5', '6'])
+        # changing one file keeps the cores of the other
+        with open(paths[1], 'a') as f:
+            f.write('\n')
+        cores = import_survey.import_cores(coring_dir, self.h5file)
+        self.assertEqual(sorted(core.core_id for core in cores),
+                         ['1', '2', '3', '4', '5', '6'])
+
+    def test_survey_catalog(self):
+        group_dir = os.path.join(self.tempdir, 'SDI_Data', 'group_1')
+        os.makedirs(group_dir)
+        shutil.copy(self.binary_file, group_dir)
+        sdi_dir = os.path.dirname(group_dir)
+        lines, groups = import_survey.import_sdi(sdi_dir, self.h5file,
+                                                 workers=1)
+        catalog = survey_io.read_survey_catalog_from_hdf(self.h5file)
+        self.assertEqual([entry['name'] for entry in catalog],
+                         [self.line_name])
+        entry = catalog[0]
+        self.assertEqual(entry['group'], 'group_1')
+        summary = survey_io.read_survey_line_summary_from_hdf(self.h5file,
+                                                              self.line_name)
+        self.assertEqual(entry['n_traces'], summary['n_traces'])
+        self.assertEqual(entry['frequencies'], summary['frequencies'])
+        np.testing.assert_allclose(entry['bounds'], summary['bounds'])
+        np.testing.assert_allclose(entry['navigation_line'],
+                                   summary['navigation_line'])
+
+        # reopening builds the same lines from the catalog alone
+        lines_again, groups_again = import_survey.import_sdi(
+            sdi_dir, self.h5file, workers=1)
+        self.assertEqual([line.name for line in lines_again],
+                         [line.name for line in lines])
+        self.assertEqual([group.name for group in groups_again], ['group_1'])
+
+    def test_compact(self):
+        survey_io.import_survey_line_from_file(self.binary_file, self.h5file,
+                                               self.line_name)
+        for i in range(3):
+            survey_io.write_depth_line_to_hdf(
+                self.h5file, self._depth_line('replaced'), self.line_name)
+        freq_before = survey_io.read_frequency_data_from_hdf(self.h5file,
+                                                             self.line_name)
+        policy = hdf5.StoragePolicy(complib='zlib', complevel=9)
+        result = survey_io.compact_hdf(self.h5file, policy)
+        self.assertEqual(result['new_size'], os.path.getsize(self.h5file))
+        self.assertEqual(result['bytes_reclaimed'],
+                         result['old_size'] - result['new_size'])
+        self.assertFalse(os.path.exists(self.h5file + '.bak'))
+        self.assertFalse(os.path.exists(self.h5file + '.compact'))
+
+        freq_after = survey_io.read_frequency_data_from_hdf(self.h5file,
+                                                            self.line_name)
+        for before, after in zip(freq_before, freq_after):
+            np.testing.assert_array_equal(before['intensity'],
+                                          after['intensity'])
+        picks = survey_io.read_pick_lines_from_hdf(
+            self.h5file, self.line_name, 'preimpoundment')
+        np.testing.assert_array_equal(picks['replaced'].depth_array,
+                                      np.ones(10))
+        h5_backend = backend.get_backend(self.h5file)
+        with h5_backend._open_file('r') as f:
+            frequencies = h5_backend._get_frequencies_group(f, self.line_name)
+            for freq in frequencies:
+                self.assertEqual(freq.intensity.filters.complevel, 9)
+
+    def test_concurrent_reader_sees_writes(self):
+        writer = hdf5.HDF5Backend(self.h5file, concurrent=True)
+        reader = hdf5.HDF5Backend(self.h5file, concurrent=True)
+        try:
+            data, line_type = survey_io._depth_line_to_pick(
+                self._depth_line('shared'))
+            writer.write_pick(data, self.pick_line_name, line_type)
+            with reader.snapshot():
+                picks = reader.read_picks(self.pick_line_name, line_type)
+            np.testing.assert_array_equal(picks['shared']['depth_array'],
+                                          np.ones(10))
+
+            data['depth_array'] = np.zeros(10)
+            writer.write_pick(data, self.pick_line_name, line_type)
+            picks = reader.read_picks(self.pick_line_name, line_type)
+            np.testing.assert_array_equal(picks['shared']['depth_array'],
+                                          np.zeros(10))
+        finally:
+            reader.close()
+            writer.close()
+
+    def _depth_line(self, name):
+        return DepthLine(survey_line_name=self.pick_line_name, name=name,
+                         line_type='pre-impoundment surface',
+                         source='algorithm', source_name='test',
+                         index_array=np.arange(10),
+                         depth_array=np.ones(10))
+
+    def test_depth_line_batch(self):
+        with survey_io.depth_line_batch(self.h5file) as batch:
+            for name in ('first', 'second'):
+                batch.write_depth_line(self._depth_line(name),
+                                       self.pick_line_name)
+        picks = survey_io.read_pick_lines_from_hdf(
+            self.h5file, self.pick_line_name, 'preimpoundment')
+        self.assertEqual(sorted(picks), ['first', 'second'])
+
+        # nothing is written if the batch body fails
+        with self.assertRaises(RuntimeError):
+            with survey_io.depth_line_batch(self.h5file) as batch:
+                batch.write_depth_line(self._depth_line('third'),
+                                       self.pick_line_name)
+                raise RuntimeError
+        picks = survey_io.read_pick_lines_from_hdf(
+            self.h5file, self.pick_line_name, 'preimpoundment')
+        self.assertNotIn('third', picks)
+
+    def test_failed_pick_batch_is_rolled_back(self):
+        data, line_type = survey_io._depth_line_to_pick(self._depth_line('ok'))
+        picks = [(data, self.pick_line_name, line_type),
+                 (data, self.pick_line_name, 'not a pick type')]
+        h5_backend = backend.get_backend(self.h5file)
+        with self.assertRaises(NotImplementedError):
+            h5_backend.write_picks(picks)
+        self.assertEqual(h5_backend.read_picks(self.pick_line_name, line_type), {})
@@ -0,0 +1,156 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tables
+
+from hydropick.io import backend, survey_io
+from hydropick.io.tree_backend import MemoryBackend, NpyDirectoryBackend
+
+
+class TreeBackendTests(object):
+    """ Round trips shared by the tree backends; results are compared with
+    the HDF5 backend's.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.h5file = os.path.join(self.tempdir, 'test.h5')
+        self.line_name = '12041701'
+        files_dir = os.path.join(os.path.dirname(__file__), 'files')
+        self.binary_file = os.path.join(
+            files_dir, '{}.bin'.format(self.line_name))
+        self.corestick_file = os.path.join(files_dir, 'Granger_CoreStick.txt')
+        self.shoreline_file = os.path.join(files_dir, 'Granger_Lake1283.shp')
+        self.backend = self.create_backend()
+
+    def tearDown(self):
+        self.backend.close()
+        survey_io.close_hdf(self.h5file)
+        shutil.rmtree(self.tempdir)
+
+    def test_binary_data(self):
+        data = backend.parse_binary_file(self.binary_file)
+        self.backend.write_binary_data(data)
+        h5 = backend.get_backend(self.h5file)
+        h5.import_binary_file(self.binary_file)
+
+        freqs = self.backend.read_frequency_data(self.line_name)
+        h5_freqs = h5.read_frequency_data(self.line_name)
+        self.assertEqual([f['kHz'] for f in freqs],
+                         [f['kHz'] for f in h5_freqs])
+        for freq, h5_freq in zip(freqs, h5_freqs):
+            np.testing.assert_array_equal(freq['intensity'],
+                                          h5_freq['intensity'])
+        self.assertEqual(self.backend.read_frequency_info(self.line_name),
+                         h5.read_frequency_info(self.line_name))
+        khz = freqs[0]['kHz']
+        np.testing.assert_array_equal(
+            self.backend.read_frequency_window(self.line_name, khz,
+                                               step=3)['intensity'],
+            h5.read_frequency_window(self.line_name, khz,
+                                     step=3)['intensity'])
+        raw = self.backend.read_sdi_data_unseparated(self.line_name)
+        np.testing.assert_array_equal(
+            raw['trace_num'],
+            h5.read_sdi_data_unseparated(self.line_name)['trace_num'])
+        self.assertEqual(os.path.basename(raw['filepath']),
+                         os.path.basename(self.binary_file))
+        summary = self.backend.read_survey_line_summary(self.line_name)
+        self.assertEqual(summary['n_traces'], len(raw['trace_num']))
+        picks = self.backend.read_picks(self.line_name, 'current')
+        self.assertIn('current_surface_from_bin', picks)
+
+    def test_core_samples(self):
+        self.backend.import_corestick_file(self.corestick_file)
+        h5 = backend.get_backend(self.h5file)
+        h5.import_corestick_file(self.corestick_file)
+        self.assertEqual(self.backend.read_core_samples(),
+                         h5.read_core_samples())
+
+    def test_core_samples_rewritten(self):
+        self.backend.import_corestick_file(self.corestick_file)
+        self.backend._write('core_samples/stale', np.zeros(3))
+        cores = self.backend.read_core_samples()
+        del cores['1']
+        self.backend.write_core_samples(cores)
+        self.assertEqual(self.backend.read_core_samples(), cores)
+        self.assertNotIn('stale', self.backend._children('core_samples'))
+
+    def test_shoreline(self):
+        self.backend.import_shoreline_file('Granger', self.shoreline_file)
+        shoreline = self.backend.read_shoreline()
+        self.assertEqual(shoreline['lake_name'], 'Granger')
+        self.assertEqual(len(shoreline['geometry']), 35)
+
+    def test_picks_rolled_back(self):
+        pick = {'name': 'pick', 'depth_array': np.ones(5),
+                'index_array': np.arange(5), 'source': 'test'}
+        self.backend.write_pick(pick, self.line_name, 'preimpoundment')
+        changed = dict(pick, depth_array=np.zeros(5))
+        with self.assertRaises(NotImplementedError):
+            self.backend.write_picks([
+                (changed, self.line_name, 'preimpoundment'),
+                (changed, self.line_name, 'not a pick type'),
+            ])
+        picks = self.backend.read_picks(self.line_name, 'preimpoundment')
+        np.testing.assert_array_equal(picks['pick']['depth_array'],
+                                      np.ones(5))
+
+    def test_missing_data(self):
+        self.assertEqual(self.backend.read_import_manifest(), {})
+        self.assertEqual(self.backend.read_survey_catalog(), [])
+        self.assertEqual(self.backend.read_picks(self.line_name, 'current'),
+                         {})
+        with self.assertRaises(tables.NoSuchNodeError):
+            self.backend.read_survey_line_coords(self.line_name)
+
+
+class TestMemoryBackend(TreeBackendTests, unittest.TestCase):
+    def create_backend(self):
+        return MemoryBackend()
+
+    def test_get_backend(self):
+        store = backend.get_backend(backend.MEMORY_PREFIX + 'survey')
+        try:
+            self.assertIsInstance(store, MemoryBackend)
+        finally:
+            backend.close_backend(backend.MEMORY_PREFIX + 'survey')
+
+
+class TestNpyDirectoryBackend(TreeBackendTests, unittest.TestCase):
+    def create_backend(self):
+        return NpyDirectoryBackend(os.path.join(self.tempdir, 'survey.npyd'))
+
+    def test_arrays_are_memory_mapped(self):
+        self.backend.import_binary_file(self.binary_file)
+        freqs = self.backend.read_frequency_data(self.line_name)
+        self.assertIsInstance(freqs[0]['intensity'], np.memmap)
+
+    def test_rewritten_arrays_are_not_memory_mapped(self):
+        # a mapped file could not be replaced on Windows
+        pick = {'name': 'pick', 'depth_array': np.ones(5),
+                'index_array': np.arange(5), 'source': 'test'}
+        self.backend.write_pick(pick, self.line_name, 'current')
+        self.backend.import_corestick_file(self.corestick_file)
+        read = self.backend.read_picks(self.line_name, 'current')['pick']
+        arrays = self.backend.read_core_sample_arrays()
+        for array in [read['depth_array'], read['index_array'],
+                      arrays['easting'], arrays['core_id']]:
+            self.assertNotIsInstance(array, np.memmap)
+        # and can be rewritten while the earlier reads are held
+        self.backend.write_pick(dict(pick, depth_array=np.zeros(5)),
+                                self.line_name, 'current')
+        np.testing.assert_array_equal(read['depth_array'], np.ones(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
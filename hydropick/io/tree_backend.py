@@ -0,0 +1,605 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from .backend import (CORE_SAMPLE_FIELDS, NoSuchNodeError, StorageBackend,
+                      build_geometry, current_surface_from_bin,
+                      flatten_geometry, summarize_survey_line)
+
+
+# attempts, and seconds between them, at replacing a file on Windows, where
+# a file that is open or memory-mapped by a reader cannot be replaced
+REPLACE_ATTEMPTS = 20
+REPLACE_RETRY_DELAY = 0.05
+
+
+class TreeBackend(StorageBackend):
+    """Base of the stores that keep a survey as a tree of named arrays, with
+    JSON attributes on the inner nodes, laid out like the HDF5 file (e.g.
+    'survey_lines/line_<name>/frequencies/khz_200_0/intensity').
+
+    Subclasses provide the storage primitives (_read, _write, _children,
+    _read_attrs, _write_attrs, _remove and _exists).
+    """
+
+    def __init__(self):
+        # serializes writes so that readers in other threads never see a
+        # partially written node
+        self._lock = threading.RLock()
+
+    def write_binary_data(self, data):
+        """writes a survey line parsed by parse_binary_file"""
+        line_name = data['line_name']
+        freq_dicts = data['frequencies']
+        x = freq_dicts[-1]['interpolated_easting']
+        y = freq_dicts[-1]['interpolated_northing']
+        coords = np.vstack((x, y)).T
+        line_path = self._survey_line_path(line_name)
+        repairs = np.array(data.get('trace_num_repairs', []),
+                           dtype=np.int64).reshape(-1, 2)
+        with self._lock:
+            self._write(line_path + '/navigation_line', coords)
+            for freq_dict in freq_dicts:
+                freq_path = self._frequency_path(line_name, freq_dict['kHz'])
+                for key, value in freq_dict.iteritems():
+                    if key != 'kHz':
+                        self._write(freq_path + '/' + key, value)
+            unsep_path = line_path + '/sdi_data_unseparated'
+            for key, value in data['raw'].iteritems():
+                if key == 'intensity':
+                    continue
+                if key == 'filepath':
+                    value = str(value)
+                if key == 'date':
+                    value = line_name
+                self._write(unsep_path + '/' + key, value)
+            self._write(line_path + '/trace_num_repairs/index', repairs[:, 0])
+            self._write(line_path + '/trace_num_repairs/value', repairs[:, 1])
+            self.write_pick(current_surface_from_bin(data), line_name,
+                            'current')
+
+    def write_core_samples(self, core_sample_dicts):
+        core_ids = sorted(core_sample_dicts)
+        cores = [core_sample_dicts[core_id] for core_id in core_ids]
+        depths = [
+            np.asarray(core['layer_interface_depths'], dtype=np.float64)
+            for core in cores
+        ]
+        depth_offsets = np.cumsum([0] + [len(d) for d in depths])
+        extras = [
+            json.dumps(dict(
+                (key, value) for key, value in core.iteritems()
+                if key not in CORE_SAMPLE_FIELDS
+            ))
+            for core in cores
+        ]
+        self._rewrite_node('core_samples', [
+            ('core_id', np.array([str(core_id) for core_id in core_ids])),
+            ('easting', np.array([core['easting'] for core in cores],
+                                 dtype=np.float64)),
+            ('northing', np.array([core['northing'] for core in cores],
+                                  dtype=np.float64)),
+            ('depths', np.concatenate(depths) if depths else np.zeros(0)),
+            ('depth_offsets', depth_offsets),
+        ], {'extra': extras})
+
+    def write_shoreline(self, lake_name, shoreline_file, crs, properties,
+                        geom):
+        coordinates, part_offsets, geometry_offsets = flatten_geometry(geom)
+        self._rewrite_node('shoreline', [
+            ('coordinates', coordinates),
+            ('part_offsets', part_offsets),
+            ('geometry_offsets', geometry_offsets),
+        ], {
+            'crs': crs,
+            'lake_name': lake_name,
+            'original_shapefile': shoreline_file,
+            'properties': properties,
+            'geom_type': geom.geom_type,
+        })
+
+    def write_pick(self, line_data, line_name, line_type):
+        line_data = dict(line_data)
+        pick_path = self._pick_path(line_name, line_type, line_data['name'])
+        with self._lock:
+            for array_name in ['depth_array', 'index_array']:
+                self._write(pick_path + '/' + array_name,
+                            line_data.pop(array_name))
+            attrs = self._read_attrs(pick_path)
+            attrs.update(line_data)
+            self._write_attrs(pick_path, attrs)
+
+    def write_picks(self, picks):
+        with self._lock:
+            # keep what each write replaces, to roll back on failure
+            replaced = []
+            try:
+                for line_data, line_name, line_type in picks:
+                    pick_path = self._pick_path(line_name, line_type,
+                                                line_data['name'])
+                    replaced.append((pick_path,
+                                     self._read_pick_node(pick_path)))
+                    self.write_pick(line_data, line_name, line_type)
+            except:
+                for pick_path, node in reversed(replaced):
+                    self._restore_pick_node(pick_path, node)
+                raise
+
+    def write_import_manifest(self, manifest):
+        with self._lock:
+            self._write_attrs('import_manifest', {'entries': manifest})
+
+    def write_survey_catalog(self, catalog):
+        lines = [
+            dict((key, value) for key, value in entry.iteritems()
+                 if key != 'navigation_line')
+            for entry in catalog
+        ]
+        nav_offsets = np.cumsum(
+            [0] + [len(entry['navigation_line']) for entry in catalog])
+        if catalog:
+            nav_coords = np.vstack([entry['navigation_line']
+                                    for entry in catalog])
+        else:
+            nav_coords = np.zeros((0, 2))
+        with self._lock:
+            self._write('survey_catalog/nav_coords', nav_coords)
+            self._write('survey_catalog/nav_offsets', nav_offsets)
+            self._write_attrs('survey_catalog', {'lines': lines})
+
+    def read_core_sample_arrays(self):
+        depths = self._read_copy('core_samples/depths')
+        offsets = self._read_copy('core_samples/depth_offsets')
+        return {
+            'core_id': self._read_copy('core_samples/core_id'),
+            'easting': self._read_copy('core_samples/easting'),
+            'northing': self._read_copy('core_samples/northing'),
+            'layer_interface_depths': [
+                depths[start:stop]
+                for start, stop in zip(offsets[:-1], offsets[1:])
+            ],
+            'extra': self._read_attrs('core_samples')['extra'],
+        }
+
+    def read_import_manifest(self):
+        try:
+            attrs = self._read_attrs('import_manifest')
+        except NoSuchNodeError:
+            return {}
+        return attrs.get('entries', {})
+
+    def read_picks(self, line_name, line_type):
+        type_path = self._pick_type_path(line_name, line_type)
+        try:
+            pick_names = self._children(type_path)
+        except NoSuchNodeError:
+            return {}
+        picks = [self._read_pick(type_path + '/' + pick_name)
+                 for pick_name in pick_names]
+        return dict([(pick['name'], pick) for pick in picks])
+
+    def read_shoreline(self):
+        attrs = self._read_attrs('shoreline')
+        coordinates = self._read_copy('shoreline/coordinates')
+        part_offsets = self._read_copy('shoreline/part_offsets')
+        geometry_offsets = self._read_copy('shoreline/geometry_offsets')
+        geometry = build_geometry(attrs['geom_type'], coordinates,
+                                  part_offsets, geometry_offsets)
+        return {
+            'crs': attrs['crs'],
+            'geometry': geometry,
+            'coordinates': coordinates,
+            'part_offsets': part_offsets,
+            'lake_name': attrs['lake_name'],
+            'original_shapefile': attrs['original_shapefile'],
+            'properties': attrs['properties'],
+        }
+
+    def read_sdi_data_unseparated(self, line_name):
+        unsep_path = self._survey_line_path(line_name) + \
+            '/sdi_data_unseparated'
+        return self._read_group(unsep_path)
+
+    def read_frequency_data(self, line_name):
+        frequencies_path = self._survey_line_path(line_name) + '/frequencies'
+        freq_data = []
+        for label in self._children(frequencies_path):
+            freq_dict = self._read_group(frequencies_path + '/' + label)
+            freq_dict['kHz'] = self._khz_from_label(label)
+            freq_data.append(freq_dict)
+        return freq_data
+
+    def read_frequency_info(self, line_name):
+        frequencies_path = self._survey_line_path(line_name) + '/frequencies'
+        info = []
+        for label in self._children(frequencies_path):
+            shape = self._read(frequencies_path + '/' + label +
+                               '/intensity').shape
+            info.append({
+                'kHz': self._khz_from_label(label),
+                'n_traces': shape[0],
+                'n_pixels': shape[1],
+            })
+        return info
+
+    def read_frequency_window(self, line_name, khz, trace_range=None, step=1):
+        freq_path = self._frequency_path(line_name, khz)
+        trace_num = self._read(freq_path + '/trace_num')
+        n_traces = trace_num.shape[0]
+        start, stop = 0, n_traces
+        if trace_range is not None:
+            first, last = trace_range
+            start = int(np.searchsorted(trace_num, first, 'left'))
+            stop = int(np.searchsorted(trace_num, last, 'right'))
+        freq_data = {}
+        for name in self._children(freq_path):
+            array = self._read(freq_path + '/' + name)
+            if np.ndim(array) and array.shape[0] == n_traces:
+                array = array[start:stop:step]
+            freq_data[name] = array
+        freq_data['kHz'] = self._khz_from_label(freq_path.rsplit('/', 1)[1])
+        return freq_data
+
+    def read_frequency_rows(self, line_name, khz, start=0, stop=None,
+                            align=False):
+        # arrays are memory-mapped whole, so there are no chunks to align to
+        freq_path = self._frequency_path(line_name, khz)
+        n_traces = self._read(freq_path + '/trace_num').shape[0]
+        freq_data = {}
+        for name in self._children(freq_path):
+            array = self._read(freq_path + '/' + name)
+            if np.ndim(array) and array.shape[0] == n_traces:
+                array = array[start:stop]
+            freq_data[name] = array
+        freq_data['kHz'] = self._khz_from_label(freq_path.rsplit('/', 1)[1])
+        return freq_data
+
+    def read_survey_catalog(self):
+        try:
+            lines = self._read_attrs('survey_catalog')['lines']
+        except (NoSuchNodeError, KeyError):
+            return []
+        nav_coords = self._read_copy('survey_catalog/nav_coords')
+        nav_offsets = self._read_copy('survey_catalog/nav_offsets')
+        catalog = []
+        for i, line in enumerate(lines):
+            entry = dict(line)
+            entry['bounds'] = tuple(entry['bounds'])
+            entry['navigation_line'] = \
+                nav_coords[nav_offsets[i]:nav_offsets[i + 1]]
+            catalog.append(entry)
+        return catalog
+
+    def read_survey_line_summary(self, line_name):
+        line_path = self._survey_line_path(line_name)
+        coords = self._read(line_path + '/navigation_line')
+        trace_num = self._read(line_path + '/sdi_data_unseparated/trace_num')
+        frequencies = [self._khz_from_label(label) for label in
+                       self._children(line_path + '/frequencies')]
+        return summarize_survey_line(line_name, coords, len(trace_num),
+                                     frequencies)
+
+    def read_survey_line_coords(self, line_name):
+        return self._read(self._survey_line_path(line_name) +
+                          '/navigation_line')
+
+    def read_trace_num_repairs(self, line_name):
+        repairs_path = self._survey_line_path(line_name) + \
+            '/trace_num_repairs'
+        return {
+            'index': self._read(repairs_path + '/index'),
+            'value': self._read(repairs_path + '/value'),
+        }
+
+    def _survey_line_path(self, line_name):
+        return 'survey_lines/line_' + line_name
+
+    def _frequency_path(self, line_name, khz):
+        return (self._survey_line_path(line_name) + '/frequencies/khz_' +
+                str(khz).replace('.', '_'))
+
+    def _pick_type_path(self, line_name, line_type):
+        if line_type not in ['current', 'preimpoundment']:
+            raise NotImplementedError(
+                'Unsupported pick type: {}'.format(line_type)
+            )
+        return self._survey_line_path(line_name) + '/picks/' + line_type
+
+    def _pick_path(self, line_name, line_type, pick_name):
+        return self._pick_type_path(line_name, line_type) + '/' + pick_name
+
+    def _khz_from_label(self, frequency_label):
+        """returns the frequency of a 'khz_208_333' style node name"""
+        return float(frequency_label[4:].replace('_', '.'))
+
+    def _read_group(self, path):
+        """returns {name: array} for every array under path"""
+        return dict((name, self._read(path + '/' + name))
+                    for name in self._children(path))
+
+    def _read_pick(self, pick_path):
+        d = self._read_attrs(pick_path)
+        d['depth_array'] = self._read_copy(pick_path + '/depth_array')
+        d['index_array'] = self._read_copy(pick_path + '/index_array')
+        return d
+
+    def _read_pick_node(self, pick_path):
+        """returns a copy of the pick at pick_path, or None if there isn't
+        one
+        """
+        if not self._exists(pick_path):
+            return None
+        return self._read_pick(pick_path)
+
+    def _restore_pick_node(self, pick_path, pick):
+        """puts back a pick saved by _read_pick_node"""
+        if pick is None:
+            self._remove(pick_path)
+            return
+        pick = dict(pick)
+        arrays = [(array_name, pick.pop(array_name))
+                  for array_name in ['depth_array', 'index_array']]
+        self._rewrite_node(pick_path, arrays, pick)
+
+    def _rewrite_node(self, path, arrays, attrs):
+        """replaces the node at path with arrays, a list of (name, array)
+        pairs, and attrs. Each array is replaced where it is and anything
+        else under the node is removed afterwards, so the node is never
+        missing, even if the rewrite is interrupted.
+        """
+        with self._lock:
+            for name, array in arrays:
+                self._write(path + '/' + name, array)
+            self._write_attrs(path, attrs)
+            names = set(name for name, array in arrays)
+            for child in self._children(path):
+                if child not in names:
+                    self._remove(path + '/' + child)
+
+    def _read(self, path):
+        """returns the array at path; raises NoSuchNodeError if missing"""
+        raise NotImplementedError
+
+    def _read_copy(self, path):
+        """returns the array at path in memory, holding nothing open.  Used
+        for the small arrays that are rewritten after import (picks, core
+        samples, the shoreline and the catalog): a memory map of one of
+        those would keep the file from being replaced on Windows.
+        """
+        array = self._read(path)
+        if isinstance(array, np.ndarray):
+            array = np.array(array)
+        return array
+
+    def _write(self, path, array):
+        """stores array at path, replacing anything already there"""
+        raise NotImplementedError
+
+    def _children(self, path):
+        """returns the sorted names of the nodes under path; raises
+        NoSuchNodeError if there is no node at path
+        """
+        raise NotImplementedError
+
+    def _read_attrs(self, path):
+        """returns the attributes of the node at path ({} if it has none);
+        raises NoSuchNodeError if there is no node at path
+        """
+        raise NotImplementedError
+
+    def _write_attrs(self, path, attrs):
+        """replaces the attributes of the node at path, creating the node
+        if needed
+        """
+        raise NotImplementedError
+
+    def _remove(self, path):
+        """removes the node at path and everything under it, if it exists"""
+        raise NotImplementedError
+
+    def _exists(self, path):
+        raise NotImplementedError
+
+
+class MemoryBackend(TreeBackend):
+    """A store held entirely in memory, for tests and benchmarks that should
+    not touch the disk. Arrays are copied on the way in and out, and
+    attributes are round-tripped through JSON, so the store behaves like
+    one on disk.
+    """
+
+    def __init__(self):
+        super(MemoryBackend, self).__init__()
+        self._arrays = {}
+        self._attrs = {}
+
+    def _read(self, path):
+        try:
+            array = self._arrays[path]
+        except KeyError:
+            raise NoSuchNodeError(path)
+        if array.ndim == 0:
+            return array[()]
+        return array.copy()
+
+    def _write(self, path, array):
+        with self._lock:
+            self._arrays[path] = np.array(array)
+
+    def _children(self, path):
+        prefix = path + '/'
+        names = set(
+            key[len(prefix):].split('/', 1)[0]
+            for key in self._arrays.keys() + self._attrs.keys()
+            if key.startswith(prefix)
+        )
+        if not names and path not in self._attrs:
+            raise NoSuchNodeError(path)
+        return sorted(names)
+
+    def _read_attrs(self, path):
+        if path in self._attrs:
+            return json.loads(self._attrs[path])
+        if self._exists(path):
+            return {}
+        raise NoSuchNodeError(path)
+
+    def _write_attrs(self, path, attrs):
+        with self._lock:
+            self._attrs[path] = json.dumps(attrs)
+
+    def _remove(self, path):
+        prefix = path + '/'
+        with self._lock:
+            for store in (self._arrays, self._attrs):
+                for key in store.keys():
+                    if key == path or key.startswith(prefix):
+                        del store[key]
+
+    def _exists(self, path):
+        prefix = path + '/'
+        return any(key == path or key.startswith(prefix)
+                   for key in self._arrays.keys() + self._attrs.keys())
+
+
+class NpyDirectoryBackend(TreeBackend):
+    """A store kept as a directory tree of .npy files, one per array, with
+    node attributes in '_attrs.json' files.
+
+    Arrays are opened memory-mapped and read-only, so opening a line costs
+    little more than mapping its files; data is only read from disk when it
+    is used. Each array is written to a temporary file and renamed into
+    place, so readers never see a partially written array. The arrays that
+    are rewritten after import are read into memory instead (see
+    _read_copy), since Windows cannot replace a file that is mapped.
+    """
+
+    ATTRS_FILE = '_attrs.json'
+
+    def __init__(self, directory):
+        super(NpyDirectoryBackend, self).__init__()
+        self.directory = directory
+
+    def compact(self, storage_policy=None):
+        """arrays are replaced file by file, so there is never unused space
+        to reclaim
+        """
+        size = sum(
+            os.path.getsize(os.path.join(root, filename))
+            for root, dirs, files in os.walk(self.directory)
+            for filename in files
+        )
+        return {'old_size': size, 'new_size': size, 'bytes_reclaimed': 0}
+
+    def _node_path(self, path):
+        return os.path.join(self.directory, *path.split('/'))
+
+    def _read(self, path):
+        filename = self._node_path(path) + '.npy'
+        if not os.path.exists(filename):
+            raise NoSuchNodeError(path)
+        try:
+            array = np.load(filename, mmap_mode='r')
+        except ValueError:
+            # empty arrays cannot be memory-mapped
+            array = np.load(filename)
+        if array.ndim == 0:
+            return array[()]
+        return array
+
+    def _write(self, path, array):
+        filename = self._node_path(path) + '.npy'
+        self._makedirs(os.path.dirname(filename))
+        with self._lock:
+            tmp_filename = filename + '.tmp'
+            with open(tmp_filename, 'wb') as f:
+                np.save(f, np.asarray(array))
+            self._replace(tmp_filename, filename)
+
+    def _children(self, path):
+        node_path = self._node_path(path)
+        if not os.path.isdir(node_path):
+            raise NoSuchNodeError(path)
+        names = []
+        for filename in os.listdir(node_path):
+            if filename == self.ATTRS_FILE or filename.endswith('.tmp'):
+                continue
+            if filename.endswith('.npy'):
+                filename = filename[:-len('.npy')]
+            names.append(filename)
+        return sorted(names)
+
+    def _read_attrs(self, path):
+        node_path = self._node_path(path)
+        if not os.path.isdir(node_path):
+            raise NoSuchNodeError(path)
+        filename = os.path.join(node_path, self.ATTRS_FILE)
+        if not os.path.exists(filename):
+            return {}
+        with open(filename) as f:
+            return json.load(f)
+
+    def _write_attrs(self, path, attrs):
+        node_path = self._node_path(path)
+        self._makedirs(node_path)
+        filename = os.path.join(node_path, self.ATTRS_FILE)
+        with self._lock:
+            tmp_filename = filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                json.dump(attrs, f)
+            self._replace(tmp_filename, filename)
+
+    def _remove(self, path):
+        node_path = self._node_path(path)
+        with self._lock:
+            if os.path.isdir(node_path):
+                shutil.rmtree(node_path)
+            elif os.path.exists(node_path + '.npy'):
+                os.remove(node_path + '.npy')
+
+    def _exists(self, path):
+        node_path = self._node_path(path)
+        return os.path.isdir(node_path) or os.path.exists(node_path + '.npy')
+
+    def _makedirs(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _replace(self, src, dst):
+        """renames src to dst, atomically replacing any existing dst"""
+        if os.name == 'nt':
+            _replace_file_windows(src, dst)
+        else:
+            os.rename(src, dst)
+
+
+def _replace_file_windows(src, dst):
+    """replaces dst with src using MoveFileEx, which, unlike os.rename on
+    Windows, replaces an existing file in a single step. Retries while dst
+    is held open by a reader.
+    """
+    import ctypes
+    MOVEFILE_REPLACE_EXISTING = 0x1
+    MOVEFILE_WRITE_THROUGH = 0x8
+    flags = MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+    move_file = ctypes.windll.kernel32.MoveFileExW
+    error = OSError('could not replace {} with {}'.format(dst, src))
+    for attempt in range(REPLACE_ATTEMPTS):
+        if move_file(unicode(src), unicode(dst), flags):
+            return
+        error = ctypes.WinError()
+        time.sleep(REPLACE_RETRY_DELAY)
+    raise error
@@ -15,7 +15,7 @@ from __future__ import absolute_import
 
 import numpy as np
 
-from traits.api import provides, Str, HasTraits
+from traits.api import provides, Float, HasTraits, Int, Str
 
 
 from .i_algorithm import IAlgorithm
@@ -24,7 +24,9 @@ from .i_algorithm import IAlgorithm
 ALGORITHM_LIST = [
     'ZeroAlgorithm',
     'OnesAlgorithm',
-    'XDepthAlgorithm'
+    'XDepthAlgorithm',
+    'CurrentSurfaceAlgorithm',
+    'PreImpoundmentAlgorithm',
 ]
 
 
@@ -80,3 +82,269 @@ class XDepthAlgorithm(HasTraits):
         trace_array = survey_line.trace_num
         depth_array = depth * np.ones_like(trace_array)
         return trace_array, depth_array
+
+
+def _running_median(values, window):
+    """ Median of values over a sliding window of traces (odd length),
+    with the ends padded by repeating the end values.
+    """
+    if window <= 1 or len(values) < window:
+        return values
+    half = window // 2
+    padded = np.concatenate([np.repeat(values[:1], half), values,
+                             np.repeat(values[-1:], half)])
+    stride = padded.strides[0]
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=(len(values), window), strides=(stride, stride))
+    return np.median(windows, axis=1)
+
+
+def _fill_missing(values, missing):
+    """ Replace values where missing is True by interpolating between the
+    neighbouring good values.
+    """
+    if not missing.any():
+        return values
+    good = np.flatnonzero(~missing)
+    if good.size == 0:
+        return np.zeros_like(values)
+    values = values.copy()
+    values[missing] = np.interp(np.flatnonzero(missing), good, values[good])
+    return values
+
+
+def _leading_edge_rows(block, threshold_fraction, edge_window):
+    """ For each trace (column) of an intensity block, the row of the
+    steepest rise just before intensity first exceeds threshold_fraction of
+    the way from the trace's minimum to its peak.  Also returns a mask of
+    the traces with no return above the background.
+    """
+    n_rows, n_cols = block.shape
+    cols = np.arange(n_cols)
+    background = block.min(axis=0)
+    peak = block.max(axis=0)
+    threshold = background + threshold_fraction * (peak - background)
+    first = np.argmax(block >= threshold, axis=0)
+    # steepest rise in the window of rows leading up to the crossing
+    rise = np.diff(block, axis=0)
+    offsets = np.arange(-max(edge_window, 1), 0)[:, np.newaxis]
+    rows = np.clip(first + offsets, 0, n_rows - 2)
+    edge = rows[np.argmax(rise[rows, cols], axis=0), cols] + 1
+    edge = np.minimum(edge, first)
+    return edge, peak <= background
+
+
+@provides(IAlgorithm)
+class CurrentSurfaceAlgorithm(HasTraits):
+    """ Picks the current lake bottom from the highest frequency
+
+    In each trace the bottom return is the first pixel below the blanking
+    distance whose intensity rises threshold_fraction of the way from the
+    trace's background (minimum) to its peak; the pick is moved up to the
+    steepest rise just above it.  Traces without a return are filled from
+    their neighbours, and spikes are removed with a running median.
+    Traces are processed in blocks, so memory use does not grow with line
+    length.
+
+    Depths are measured like the intensity images are displayed,
+    draft + pixel * pixel_resolution, without the heave correction.
+    Parameters can be given as keyword args to process_line.
+    """
+
+    #: a user-friendly name for the algorithm
+    name = Str('current surface algorithm')
+
+    #: fraction of the way from background to peak intensity counted as
+    #: the bottom return
+    threshold_fraction = Float(0.5)
+
+    #: depth below the transducer to ignore (ringdown), in depth units
+    blanking_distance = Float(1.0)
+
+    #: number of pixels above the threshold crossing searched for the
+    #: steepest rise
+    edge_window = Int(5)
+
+    #: number of traces in the running median that removes spikes; 1 to
+    #: disable
+    median_window = Int(5)
+
+    #: number of traces processed at once
+    block_size = Int(8192)
+
+    def process_line(self, survey_line, *args, **kw):
+        """ returns the trace_num array of the highest frequency and the
+        bottom depth for each of its traces
+        """
+        self.trait_set(**kw)
+        key = max(survey_line.frequencies, key=float)
+        intensity = survey_line.frequencies[key]
+        trace_array = survey_line.freq_trace_num[key]
+        rows = self.pick_rows(intensity, survey_line.draft,
+                              survey_line.pixel_resolution)
+        depth_array = (survey_line.draft +
+                       rows * survey_line.pixel_resolution)
+        return trace_array, depth_array
+
+    def pick_rows(self, intensity, draft, pixel_resolution):
+        """ the bottom pixel row for each trace (column) of an intensity
+        image
+        """
+        n_rows, n_traces = intensity.shape
+        skip = int(np.ceil(self.blanking_distance /
+                           max(pixel_resolution, 1e-12)))
+        skip = min(max(skip, 0), n_rows - 2)
+        rows = np.empty(n_traces)
+        missing = np.zeros(n_traces, dtype=bool)
+        for start in range(0, n_traces, self.block_size):
+            stop = start + self.block_size
+            block = intensity[skip:, start:stop].astype(np.float32)
+            edge, none = _leading_edge_rows(block, self.threshold_fraction,
+                                            self.edge_window)
+            rows[start:stop] = edge + skip
+            missing[start:stop] = none
+        rows = _fill_missing(rows, missing)
+        return _running_median(rows, self.median_window)
+
+
+def _nearest_columns(trace_num, targets):
+    """ Index of the entry of the sorted trace_num array nearest to each
+    of the targets.
+    """
+    if len(trace_num) == 1:
+        return np.zeros(len(targets), dtype=int)
+    right = np.clip(np.searchsorted(trace_num, targets), 1,
+                    len(trace_num) - 1)
+    left = right - 1
+    nearer_left = (targets - trace_num[left]) <= (trace_num[right] - targets)
+    return np.where(nearer_left, left, right)
+
+
+def _smooth_rows(block, n):
+    """ Moving average of n pixels down each trace (column) of a block """
+    if n <= 1:
+        return block
+    cumsum = np.cumsum(block, axis=0)
+    smoothed = cumsum.copy()
+    smoothed[n:] = cumsum[n:] - cumsum[:-n]
+    counts = np.minimum(np.arange(1, len(block) + 1), n)
+    return smoothed / counts[:, np.newaxis]
+
+
+@provides(IAlgorithm)
+class PreImpoundmentAlgorithm(HasTraits):
+    """ Picks the pre-impoundment surface from the contrast between low and
+    high frequencies
+
+    High frequencies are absorbed by the sediment laid down since
+    impoundment while the lowest frequency reaches the old surface below
+    it.  The frequencies' images are aligned on the lowest frequency's
+    traces through freq_trace_num and each trace is scaled by its peak.
+    The pick in each trace is the strongest increase of the lowest
+    frequency over the mean of the others, searched between min_thickness
+    and max_thickness below the current surface.  Where that increase is
+    weaker than min_contrast there is taken to be no sediment and the
+    current surface is used.
+
+    The current surface is the line's final lake depth line if there is
+    one, otherwise it is picked with CurrentSurfaceAlgorithm.  Traces are
+    processed in blocks and parameters can be given as keyword args to
+    process_line.
+    """
+
+    #: a user-friendly name for the algorithm
+    name = Str('pre-impoundment algorithm')
+
+    #: least sediment thickness searched, in depth units
+    min_thickness = Float(0.2)
+
+    #: greatest sediment thickness searched, in depth units
+    max_thickness = Float(20.0)
+
+    #: weakest contrast increase (on the 0-1 peak scaled intensities)
+    #: accepted as the pre-impoundment surface
+    min_contrast = Float(0.4)
+
+    #: number of pixels averaged on each side of a candidate surface when
+    #: measuring the contrast increase across it
+    smoothing = Int(3)
+
+    #: number of traces in the running median that removes spikes; 1 to
+    #: disable
+    median_window = Int(9)
+
+    #: number of traces processed at once
+    block_size = Int(4096)
+
+    def process_line(self, survey_line, *args, **kw):
+        """ returns the trace_num array of the lowest frequency and the
+        pre-impoundment depth for each of its traces
+        """
+        self.trait_set(**kw)
+        keys = sorted(survey_line.frequencies, key=float)
+        trace_array = survey_line.freq_trace_num[keys[0]]
+        draft = survey_line.draft
+        pixel_resolution = max(survey_line.pixel_resolution, 1e-12)
+        surface_rows = (self.current_surface(survey_line, trace_array) -
+                        draft) / pixel_resolution
+        rows = self.pick_rows(survey_line, keys, trace_array, surface_rows,
+                              pixel_resolution)
+        depth_array = draft + rows * pixel_resolution
+        return trace_array, depth_array
+
+    def current_surface(self, survey_line, trace_array):
+        """ current surface depth at each trace of trace_array """
+        depth_line = survey_line.lake_depths.get(survey_line.final_lake_depth)
+        if depth_line is not None and len(depth_line.index_array):
+            surface_traces = np.asarray(depth_line.index_array) + 1
+            depths = np.asarray(depth_line.depth_array, dtype=float)
+        else:
+            surface_traces, depths = \
+                CurrentSurfaceAlgorithm().process_line(survey_line)
+        order = np.argsort(surface_traces)
+        return np.interp(trace_array, surface_traces[order], depths[order])
+
+    def pick_rows(self, survey_line, keys, trace_array, surface_rows,
+                  pixel_resolution):
+        """ the pre-impoundment pixel row for each trace of trace_array """
+        images = [survey_line.frequencies[key] for key in keys]
+        n_rows = min(image.shape[0] for image in images)
+        columns = [_nearest_columns(survey_line.freq_trace_num[key],
+                                    trace_array) for key in keys]
+        surface_rows = np.clip(np.round(surface_rows), 0, n_rows - 1)
+        min_rows = max(int(np.ceil(self.min_thickness / pixel_resolution)), 1)
+        max_rows = int(np.ceil(self.max_thickness / pixel_resolution))
+        n = max(self.smoothing, 1)
+        if n_rows <= n or max_rows < min_rows:
+            # too shallow to compare rows, or no thickness allowed
+            return surface_rows
+        row_index = np.arange(1, n_rows - n + 1)[:, np.newaxis]
+        rows = np.empty(len(trace_array))
+        for start in range(0, len(trace_array), self.block_size):
+            stop = start + self.block_size
+            scaled = []
+            for image, cols in zip(images, columns):
+                block = image[:n_rows, cols[start:stop]].astype(np.float32)
+                peak = block.max(axis=0)
+                block /= np.where(peak > 0, peak, 1)
+                scaled.append(block)
+            if len(scaled) > 1:
+                high = np.mean(scaled[1:], axis=0)
+            else:
+                high = scaled[0]
+            # increase in the low frequency's excess over the high ones from
+            # the n pixels above each row to the n pixels starting at it
+            contrast = _smooth_rows(scaled[0] - high, n)
+            rise = contrast[n:] - contrast[:-n]
+            surface = surface_rows[start:stop]
+            outside = ((row_index < surface + min_rows) |
+                       (row_index > surface + max_rows))
+            rise[outside] = -np.inf
+            best = np.argmax(rise, axis=0)
+            strength = rise[best, np.arange(len(best))]
+            # traces with every row outside the allowed range keep the
+            # surface
+            found = np.isfinite(strength) & (strength >= self.min_contrast)
+            rows[start:stop] = np.where(found, best + 1, surface)
+        rows = _running_median(rows, self.median_window)
+        return np.maximum(rows, surface_rows)
@@ -7,12 +7,13 @@
 
 from __future__ import absolute_import
 
-from traits.api import Interface, Supports, List, Str
+from traits.api import Interface, Instance, Supports, List, Str
 
 from .i_lake import ILake
 from .i_survey_line import ISurveyLine
 from .i_survey_line_group import ISurveyLineGroup
 from .i_core_sample import ICoreSample
+from .spatial_index import SurveySpatialIndex
 
 class ISurvey(Interface):
     """ The abstract interface for a survey object.
@@ -41,6 +42,8 @@ class ISurvey(Interface):
     #: The core samples taken in the survey
     core_samples = List(Supports(ICoreSample))
 
+    #: spatial index over the core samples
+    spatial_index = Instance(SurveySpatialIndex)
 
     def add_survey_line_group(self, group):
         """ Create a new line group, optionally with a set of lines """
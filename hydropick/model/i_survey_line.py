@@ -37,6 +37,9 @@ class ISurveyLine(Interface):
     #: a dictionary mapping frequencies to intensity arrays
     frequencies = Dict
 
+    #: event fired when the frequencies have been (re)loaded
+    frequencies_updated = Event
+
     #: array of trace numbers corresponding to each intensity pixel columns
     freq_trace_num = Dict
 
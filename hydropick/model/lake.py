@@ -9,11 +9,13 @@ from __future__ import absolute_import
 
 # 3rd party imports
 import fiona
+import numpy as np
 from shapely.geometry.base import BaseGeometry
 
 # ETS imports
 from scimath import units
-from traits.api import Dict, Instance, Float, HasTraits, Property, provides, Str
+from traits.api import (Array, Dict, Instance, Float, HasTraits, Property,
+                        provides, Str)
 
 # local imports
 from .i_lake import ILake
@@ -55,6 +57,24 @@ class Lake(HasTraits):
     #: MultiPolygon or collections of lines and/or polygons.
     shoreline = Instance(BaseGeometry)
 
+    #: The shoreline's vertices as an Nx2 array, all parts back to back.
+    #: Empty if the lake was not loaded from a survey file.
+    shoreline_coordinates = Array
+
+    #: Offsets of each shoreline part (line or ring) into
+    #: shoreline_coordinates; part i is [offsets[i]:offsets[i + 1]]
+    shoreline_part_offsets = Array
+
+    def shoreline_parts(self):
+        """ Return the shoreline's parts as a list of coordinate arrays,
+        sliced from shoreline_coordinates when available.
+        """
+        if self.shoreline_part_offsets.size > 1:
+            offsets = self.shoreline_part_offsets
+            return [self.shoreline_coordinates[start:stop]
+                    for start, stop in zip(offsets[:-1], offsets[1:])]
+        return [np.array(line.coords) for line in self.shoreline]
+
     #### Private protocol #####################################################
 
     #: Private trait to hold properties loaded from shapefile
@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+""" Spatial indexes over survey locations.
+
+A PointIndex answers nearest-point and within-radius queries over an Nx2
+array of map coordinates with a scipy cKDTree.
+
+A SurveySpatialIndex is built once per survey over its core sample
+locations and answers "which cores are near this line".  A LineIndex is
+built over the survey lines' navigation lines for map selection.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.geometry import Point, box
+
+
+class PointIndex(object):
+    """ Nearest-point and radius queries over an Nx2 array of points """
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points):
+            self._tree = cKDTree(self.points)
+        else:
+            self._tree = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, xy):
+        """ Return (distance, index) of the point nearest to xy.
+
+        xy may also be an Mx2 array, in which case arrays of distances and
+        indices are returned.
+        """
+        if not len(self.points):
+            raise ValueError('cannot query an empty PointIndex')
+        query = np.asarray(xy, dtype=float)
+        single = query.ndim == 1
+        distances, indices = self._tree.query(query.reshape(-1, 2))
+        if single:
+            return float(distances[0]), int(indices[0])
+        return distances, indices
+
+    def within(self, xy, radius):
+        """ Return the sorted indices of the points within radius of xy, or
+        of any point of an Mx2 array xy.
+        """
+        query = np.asarray(xy, dtype=float).reshape(-1, 2)
+        if not len(self.points) or not len(query):
+            return np.array([], dtype=int)
+        found = self._tree.query_ball_point(query, radius)
+        return np.unique(np.concatenate(
+            [np.asarray(f, dtype=int) for f in found]))
+
+
+def densify_line(coords, spacing):
+    """ Return the vertices of a polyline with extra points added so no two
+    consecutive points are more than spacing apart.
+    """
+    coords = np.asarray(coords, dtype=float)[:, :2]
+    if len(coords) < 2:
+        return coords
+    seg_lengths = np.sqrt(np.sum(np.diff(coords, axis=0) ** 2, axis=1))
+    n_pieces = np.maximum(np.ceil(seg_lengths / spacing), 1).astype(int)
+    # fraction along each segment for every new point
+    seg_index = np.repeat(np.arange(len(n_pieces)), n_pieces)
+    offsets = np.arange(n_pieces.sum()) - np.repeat(
+        np.cumsum(n_pieces) - n_pieces, n_pieces)
+    fractions = (offsets / n_pieces[seg_index].astype(float))[:, np.newaxis]
+    starts = coords[:-1][seg_index]
+    ends = coords[1:][seg_index]
+    points = starts + fractions * (ends - starts)
+    return np.vstack([points, coords[-1:]])
+
+
+class SurveySpatialIndex(object):
+    """ A spatial index over the core samples of a survey """
+
+    def __init__(self, core_samples):
+        self.core_samples = list(core_samples)
+        self.core_index = PointIndex(
+            [core.location for core in self.core_samples])
+
+    def cores_near_line(self, survey_line, dist_tol=100):
+        """ Return the core samples within dist_tol of a survey line's
+        navigation line, in core sample order.
+
+        Cores near any point of the line are found in the index, then the
+        exact distance to the line is checked for just those candidates.
+        """
+        line = survey_line.navigation_line
+        if line is None or not len(self.core_index):
+            return []
+        # every point of the line is within dist_tol / 2 of a densified
+        # vertex, so no core within dist_tol of the line can be missed
+        vertices = densify_line(line.coords, dist_tol)
+        candidates = self.core_index.within(vertices, 1.5 * dist_tol)
+        return [self.core_samples[i] for i in candidates
+                if line.distance(Point(self.core_samples[i].location)) <
+                dist_tol]
+
+
+class LineIndex(object):
+    """ A bounding box index over the navigation lines of survey lines.
+
+    Queries compare against all the bounding boxes at once in numpy, then
+    check exact distances with shapely only for the lines whose boxes
+    qualify.
+    """
+
+    def __init__(self, survey_lines):
+        self.survey_lines = [line for line in survey_lines
+                             if line.navigation_line is not None]
+        bounds = [line.navigation_line.bounds for line in self.survey_lines]
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.survey_lines)
+
+    def _candidates(self, x_min, y_min, x_max, y_max):
+        """ Indices of the lines whose bounding boxes overlap the box """
+        b = self.bounds
+        overlaps = ((b[:, 0] <= x_max) & (b[:, 2] >= x_min) &
+                    (b[:, 1] <= y_max) & (b[:, 3] >= y_min))
+        return np.flatnonzero(overlaps)
+
+    def lines_near(self, xy, tol):
+        """ Return the survey lines within tol of the point xy, in survey
+        line order.
+        """
+        x, y = xy
+        p = Point(x, y)
+        lines = [self.survey_lines[i] for i in
+                 self._candidates(x - tol, y - tol, x + tol, y + tol)]
+        return [line for line in lines
+                if line.navigation_line.distance(p) < tol]
+
+    def nearest_line(self, xy, tol):
+        """ Return the survey line nearest to the point xy, or None if no
+        line is within tol of it.
+        """
+        x, y = xy
+        p = Point(x, y)
+        nearest = None
+        nearest_distance = tol
+        for i in self._candidates(x - tol, y - tol, x + tol, y + tol):
+            line = self.survey_lines[i]
+            distance = line.navigation_line.distance(p)
+            if distance < nearest_distance:
+                nearest, nearest_distance = line, distance
+        return nearest
+
+    def lines_in_box(self, x_min, y_min, x_max, y_max):
+        """ Return the survey lines that cross or lie inside a box """
+        box_polygon = box(min(x_min, x_max), min(y_min, y_max),
+                          max(x_min, x_max), max(y_min, y_max))
+        lines = [self.survey_lines[i] for i in
+                 self._candidates(*box_polygon.bounds)]
+        return [line for line in lines
+                if line.navigation_line.intersects(box_polygon)]
@@ -9,13 +9,15 @@ from __future__ import absolute_import
 
 import logging
 
-from traits.api import File, HasTraits, List, Str, Supports, provides
+from traits.api import (File, HasTraits, Instance, List, Property, Str,
+                        Supports, cached_property, provides)
 
 from .i_survey import ISurvey
 from .i_lake import ILake
 from .i_survey_line import ISurveyLine
 from .i_survey_line_group import ISurveyLineGroup
 from .i_core_sample import ICoreSample
+from .spatial_index import SurveySpatialIndex
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +52,10 @@ class Survey(HasTraits):
     #: backend hdf5 file
     hdf5_file = File
 
+    #: spatial index over the core samples, rebuilt when they change
+    spatial_index = Property(Instance(SurveySpatialIndex),
+                             depends_on='core_samples[]')
+
     def add_survey_line_group(self, group):
         """ Create a new line group, optionally with a set of lines """
         self.survey_line_groups.append(group)
@@ -68,3 +74,7 @@ class Survey(HasTraits):
         logger.debug("Removed survey line group '{}' from index {}".format(
             group.name, index))
         return index
+
+    @cached_property
+    def _get_spatial_index(self):
+        return SurveySpatialIndex(self.core_samples)
@@ -22,6 +22,28 @@ from .depth_line import DepthLine
 
 logger = logging.getLogger(__name__)
 
+# array traits filled by load_data and released by unload_data
+DATA_ARRAYS = ['trace_num', 'locations', 'lat_long', 'heave', 'power', 'gain']
+
+
+def _join_traces(head, tail):
+    ''' Join two frequency dicts holding consecutive traces of the same
+    frequency.  Arrays with one row per trace are concatenated; the rest
+    are the same in both and taken from head.
+    '''
+    n_head = head['trace_num'].shape[0]
+    n_tail = tail['trace_num'].shape[0]
+    joined = {}
+    for key, value in head.items():
+        other = tail[key]
+        if (np.ndim(value) and value.shape[0] == n_head and
+                np.ndim(other) and other.shape[0] == n_tail):
+            joined[key] = np.concatenate([value, other])
+        else:
+            joined[key] = value
+    return joined
+
+
 @provides(ISurveyLine)
 class SurveyLine(HasTraits):
     """ A class representing a single survey line """
@@ -38,9 +60,14 @@ class SurveyLine(HasTraits):
     #: array of associated lat/long available for display
     lat_long = Array(shape=(None, 2))
 
-    #: a dictionary mapping frequencies to intensity arrays
+    #: a dictionary mapping frequencies to intensity arrays. The arrays are
+    #: read-only views of the stored data (memory-mapped where the storage
+    #: backend allows it) shared with the plots; copy before modifying.
     frequencies = Dict
 
+    #: event fired when the frequencies have been (re)loaded
+    frequencies_updated = Event
+
     #: complete trace_num set. array = combined freq_trace_num arrays
     trace_num = Array
 
@@ -97,6 +124,25 @@ class SurveyLine(HasTraits):
     def load_data(self, hdf5_file):
         ''' Called by UI to load this survey line when selected to edit
         '''
+        self.set_data(self.read_data(hdf5_file), hdf5_file)
+
+    def read_data(self, hdf5_file, max_traces=None, snapshot=True,
+                  preview=None):
+        ''' Read this line's data from the hdf5 file without changing the
+        line, so it may be called from a worker thread.  The result is
+        passed to set_data.
+
+        If max_traces is given, only the first max_traces traces of each
+        frequency are read, extended to the end of the stored chunk they end
+        in, for a quick preview of the start of the line.  Passing such a
+        preview back as preview reads only the rest of each frequency and
+        joins it on, reusing everything else the preview read.
+
+        By default everything is read from one consistent state of the file,
+        holding it for the whole read.  With snapshot=False the file is
+        released between the parts of the read, one frequency at a time, so
+        a worker thread doesn't keep the GUI thread from the file.
+        '''
         # read in sdi dictionary.  Only use 'frequencies' item.
         # sdi_dict_separated = binary.read(self.data_file_path)
         # sdi_dict_raw = binary.read(self.data_file_path, separate=False)
@@ -104,19 +150,71 @@ class SurveyLine(HasTraits):
 
         from ..io import survey_io
 
-        # read frequency dict from hdf5 file.
-        sdi_dict_raw = survey_io.read_sdi_data_unseparated_from_hdf(hdf5_file,
-                                                                    self.name)
-        freq_dict_list = survey_io.read_frequency_data_from_hdf(hdf5_file,
-                                                                self.name)
+        if snapshot:
+            # read everything from one consistent state of the hdf5 file.
+            with survey_io.hdf_snapshot(hdf5_file):
+                return self.read_data(hdf5_file, max_traces, snapshot=False,
+                                      preview=preview)
+
+        if preview is None:
+            sdi_dict_raw = survey_io.read_sdi_data_unseparated_from_hdf(
+                hdf5_file, self.name)
+            # depth lines stored separately
+            lake_depths = survey_io.read_pick_lines_from_hdf(
+                hdf5_file, self.name, 'current')
+            preimpoundment_depths = survey_io.read_pick_lines_from_hdf(
+                hdf5_file, self.name, 'preimpoundment')
+            heads = {}
+        else:
+            sdi_dict_raw = preview['sdi_dict_raw']
+            lake_depths = preview['lake_depths']
+            preimpoundment_depths = preview['preimpoundment_depths']
+            heads = dict((freq_dict['kHz'], freq_dict)
+                         for freq_dict in preview['freq_dict_list'])
+        freq_dict_list = []
+        for info in survey_io.read_frequency_info_from_hdf(hdf5_file,
+                                                           self.name):
+            head = heads.get(info['kHz'])
+            start = 0
+            if head is not None:
+                start = head['trace_num'].shape[0]
+            freq_dict = survey_io.read_frequency_rows_from_hdf(
+                hdf5_file, self.name, info['kHz'], start=start,
+                stop=max_traces, align=max_traces is not None)
+            if head is not None:
+                freq_dict = _join_traces(head, freq_dict)
+            freq_dict_list.append(freq_dict)
+        return {'sdi_dict_raw': sdi_dict_raw,
+                'freq_dict_list': freq_dict_list,
+                'lake_depths': lake_depths,
+                'preimpoundment_depths': preimpoundment_depths}
+
+    def set_data(self, data, hdf5_file):
+        ''' Fill this line with data returned by read_data.  A missing sdi
+        surface is written to hdf5_file, unless it is None.
+        '''
+        from ..io import survey_io
+
+        sdi_dict_raw = data['sdi_dict_raw']
+        freq_dict_list = data['freq_dict_list']
+        lake_depths = dict(data['lake_depths'])
+        preimpoundment_depths = dict(data['preimpoundment_depths'])
+
+        # keep depth lines already in memory: they may hold unsaved edits
+        # made before the line's data was unloaded.
+        lake_depths.update(self.lake_depths)
+        preimpoundment_depths.update(self.preimpoundment_depths)
 
         # fill frequncies and freq_trace_num dictionaries with freqs as keys.
         for freq_dict in freq_dict_list:
             key = freq_dict['kHz']
-            # transpose array to go into image plot correctly oriented
+            # transpose array to go into image plot correctly oriented.
+            # the transpose is a view, so the stored data is never copied
             intensity = freq_dict['intensity'].T
+            intensity.flags.writeable = False
             self.frequencies[str(key)] = intensity
             self.freq_trace_num[str(key)] = freq_dict['trace_num']
+        self.frequencies_updated = True
 
         # for all other traits, use un-freq-sorted values
         self.trace_num = sdi_dict_raw['trace_num']
@@ -130,26 +228,45 @@ class SurveyLine(HasTraits):
         self.power = sdi_dict_raw['power']
         self.gain = sdi_dict_raw['gain']
         self.array_sizes_ok()
-        filename = os.path.basename(sdi_dict_raw['filepath'])
-        sdi_surface = DepthLine(
-            name='current_surface_from_bin',
-            survey_line_name=self.name,
-            line_type='current surface',
-            source='sdi_file',
-            source_name=filename,
-            index_array=self.trace_num - 1,
-            depth_array=sdi_dict_raw['depth_r1']            
-        )
-        survey_io.write_depth_line_to_hdf(hdf5_file, sdi_surface, self.name)
-        # depth lines stored separately
-        self.lake_depths = survey_io.read_pick_lines_from_hdf(
-                                     hdf5_file, self.name, 'current')
-        self.preimpoundment_depths = survey_io.read_pick_lines_from_hdf(
-                                     hdf5_file, self.name, 'preimpoundment')
+        self.lake_depths = lake_depths
+        if 'current_surface_from_bin' not in self.lake_depths:
+            # imported before the sdi surface was written at import time:
+            # write it once so later loads are read-only
+            filename = os.path.basename(sdi_dict_raw['filepath'])
+            sdi_surface = DepthLine(
+                name='current_surface_from_bin',
+                survey_line_name=self.name,
+                line_type='current surface',
+                source='sdi_file',
+                source_name=filename,
+                index_array=self.trace_num - 1,
+                depth_array=sdi_dict_raw['depth_r1']
+            )
+            if hdf5_file is not None:
+                survey_io.write_depth_line_to_hdf(hdf5_file, sdi_surface,
+                                                  self.name)
+            self.lake_depths['current_surface_from_bin'] = sdi_surface
+        self.preimpoundment_depths = preimpoundment_depths
+
+    def unload_data(self):
+        ''' Release the arrays read by load_data.  The depth lines are kept,
+        so edits survive until the line is loaded again.
+        '''
+        self.reset_traits(['frequencies', 'freq_trace_num'] + DATA_ARRAYS)
+        self.frequencies_updated = True
+
+    def data_nbytes(self):
+        ''' Number of bytes held by the arrays read by load_data '''
+        arrays = (self.frequencies.values() + self.freq_trace_num.values() +
+                  [getattr(self, name) for name in DATA_ARRAYS])
+        return sum(a.nbytes for a in arrays)
 
     def nearby_core_samples(self, core_samples, dist_tol=100):
         """ Find core samples from a list of CoreSample instances
         that lie within dist_tol units of this survey line.
+
+        This checks every core; when the survey's spatial_index is available
+        use its cores_near_line instead.
         """
         def distance(core, line):
             """ Calculate distance between a core sample and a survey line
@@ -182,15 +299,18 @@ class SurveyLine(HasTraits):
         #     self.fix_trace_num(N, bad_traces, values)
         # now check rest of arrays
         
+        # trace_num is repaired on import; only lines imported before that
+        # still need fixing here
         from ..io import survey_io
         bad_indices, bad_vals = survey_io.check_trace_num_array(self.trace_num,
                                                                 self.name)
-        tn, fn = survey_io.fix_trace_num_arrays(self.trace_num,
-                                                bad_indices,
-                                                self.freq_trace_num)
-        self.trace_num = tn
-        self.freq_trace_num = fn
-        N = len(tn)
+        if bad_indices.size:
+            tn, fn = survey_io.fix_trace_num_arrays(self.trace_num,
+                                                    bad_indices,
+                                                    self.freq_trace_num)
+            self.trace_num = tn
+            self.freq_trace_num = fn
+        N = len(self.trace_num)
         for a in arrays:
             if getattr(self, a).shape[0] != N:
                 s = '{} is not size {}'.format(a, N)
@@ -10,6 +10,10 @@ import numpy as np
 from traits.interface_checker import InterfaceError
 from traits import has_traits
 from hydropick.io import survey_io
+from hydropick.model.algorithms import (CurrentSurfaceAlgorithm,
+                                        PreImpoundmentAlgorithm)
+from hydropick.model.depth_line import DepthLine
+from hydropick.model.survey_line import SurveyLine
 
 
 class TestAlgorithms(unittest.TestCase):
@@ -27,6 +31,7 @@ class TestAlgorithms(unittest.TestCase):
         self.survey_line.load_data(self.h5file)
 
     def tearDown(self):
+        survey_io.close_hdf(self.h5file)
         shutil.rmtree(self.tempdir)
 
     def get_classes(self):
@@ -68,6 +73,101 @@ class TestAlgorithms(unittest.TestCase):
             self.assertTrue(False, msg='undefined: {}'.format(err))
 
 
+class TestCurrentSurfaceAlgorithm(unittest.TestCase):
+
+    def setUp(self):
+        n_pixels, n_traces = 200, 1000
+        rand = np.random.RandomState(0)
+        traces = np.arange(n_traces)
+        self.bottom = (80 + 30 * np.sin(traces / 100.0)).astype(int)
+        rows = np.arange(n_pixels)[:, np.newaxis]
+        image = rand.uniform(0, 10, (n_pixels, n_traces))
+        image[rows >= self.bottom] += 100
+        # ringdown just below the transducer
+        image[:5] = 200
+        self.survey_line = SurveyLine(
+            name='synthetic', draft=1.0, pixel_resolution=0.1,
+            frequencies={'200.0': image},
+            freq_trace_num={'200.0': traces + 1})
+
+    def test_finds_bottom(self):
+        algorithm = CurrentSurfaceAlgorithm()
+        trace_array, depth_array = algorithm.process_line(
+            self.survey_line, block_size=300)
+        np.testing.assert_array_equal(trace_array,
+                                      np.arange(1, len(self.bottom) + 1))
+        np.testing.assert_allclose(depth_array, 1.0 + 0.1 * self.bottom,
+                                   atol=0.1)
+
+
+class TestPreImpoundmentAlgorithm(unittest.TestCase):
+
+    def setUp(self):
+        n_pixels, n_traces = 300, 900
+        rand = np.random.RandomState(0)
+        rows = np.arange(n_pixels)[:, np.newaxis]
+        # frequencies ping in turn, so each has every third trace
+        trace_num = np.arange(1, n_traces + 1)
+        current = (60 + 20 * np.sin(trace_num / 150.0)).astype(int)
+        # no sediment over the first hundred traces
+        thickness = np.where(trace_num > 100, 40 + trace_num // 30, 0)
+        pre = current + thickness
+        self.current = current
+        self.pre = pre
+        frequencies, freq_trace_num = {}, {}
+        for i, key in enumerate(['24.0', '50.0', '200.0']):
+            traces = trace_num[i::3]
+            image = rand.uniform(0, 5, (n_pixels, len(traces)))
+            surface = current[traces - 1]
+            image[(rows >= surface) & (rows < surface + 4)] += 100
+            if key == '24.0':
+                # only the lowest frequency reaches the old surface
+                old = np.where(thickness[traces - 1] > 0, pre[traces - 1],
+                               n_pixels)
+                image[(rows >= old) & (rows < old + 10)] += 80
+            frequencies[key] = image
+            freq_trace_num[key] = traces
+        self.survey_line = SurveyLine(
+            name='synthetic', draft=0.0, pixel_resolution=0.1,
+            frequencies=frequencies, freq_trace_num=freq_trace_num)
+
+    def test_finds_pre_impoundment_surface(self):
+        algorithm = PreImpoundmentAlgorithm()
+        trace_array, depth_array = algorithm.process_line(
+            self.survey_line, block_size=100)
+        np.testing.assert_array_equal(trace_array,
+                                      self.survey_line.freq_trace_num['24.0'])
+        expected = 0.1 * self.pre[trace_array - 1]
+        np.testing.assert_allclose(depth_array, expected, atol=0.15)
+
+    def _set_current_surface(self, survey_line, depths):
+        traces = np.arange(1, len(depths) + 1)
+        survey_line.lake_depths = {'surface': DepthLine(
+            name='surface', index_array=traces - 1, depth_array=depths)}
+        survey_line.final_lake_depth = 'surface'
+
+    def test_no_thickness_allowed(self):
+        self._set_current_surface(self.survey_line, 0.1 * self.current)
+        algorithm = PreImpoundmentAlgorithm(min_thickness=5, max_thickness=1)
+        trace_array, depth_array = algorithm.process_line(self.survey_line)
+        np.testing.assert_allclose(depth_array,
+                                   0.1 * self.current[trace_array - 1])
+
+    def test_shallow_image(self):
+        traces = np.arange(1, 31)
+        frequencies = dict((key, np.ones((2, 10))) for key in
+                           ['24.0', '200.0'])
+        freq_trace_num = {'24.0': traces[::3], '200.0': traces[1::3]}
+        survey_line = SurveyLine(
+            name='shallow', draft=0.0, pixel_resolution=0.1,
+            frequencies=frequencies, freq_trace_num=freq_trace_num)
+        self._set_current_surface(survey_line, 0.1 * np.ones(30))
+        trace_array, depth_array = PreImpoundmentAlgorithm(
+            smoothing=3).process_line(survey_line)
+        np.testing.assert_array_equal(trace_array, traces[::3])
+        np.testing.assert_allclose(depth_array, 0.1)
+
+
 if __name__ == "__main__":
     # from package use "python -m unittest discover -v -s ./tests/"
     unittest.main()
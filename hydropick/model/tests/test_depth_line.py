@@ -31,6 +31,7 @@ class TestDepthLine(unittest.TestCase):
         self.survey_line.load_data(self.h5file)
 
     def tearDown(self):
+        survey_io.close_hdf(self.h5file)
         shutil.rmtree(self.tempdir)
 
     def test_provides(self):
@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+import unittest
+
+import numpy as np
+from shapely.geometry import LineString, Point
+
+from hydropick.model.core_sample import CoreSample
+from hydropick.model.spatial_index import (LineIndex, PointIndex,
+                                           SurveySpatialIndex, densify_line)
+from hydropick.model.survey_line import SurveyLine
+
+
+class TestPointIndex(unittest.TestCase):
+    def setUp(self):
+        self.points = np.random.RandomState(0).uniform(0, 1000, (500, 2))
+        self.index = PointIndex(self.points)
+
+    def test_nearest(self):
+        xy = (123.0, 456.0)
+        dist_sq = np.sum((self.points - xy)**2, axis=1)
+        distance, index = self.index.nearest(xy)
+        self.assertEqual(index, np.argmin(dist_sq))
+        self.assertAlmostEqual(distance, np.sqrt(dist_sq.min()))
+
+    def test_within(self):
+        query = np.array([[100.0, 100.0], [900.0, 500.0]])
+        expected = set()
+        for xy in query:
+            dist = np.sqrt(np.sum((self.points - xy)**2, axis=1))
+            expected.update(np.flatnonzero(dist <= 50))
+        found = self.index.within(query, 50)
+        self.assertEqual(list(found), sorted(expected))
+
+    def test_empty(self):
+        index = PointIndex(np.empty((0, 2)))
+        self.assertEqual(len(index.within((0, 0), 10)), 0)
+        with self.assertRaises(ValueError):
+            index.nearest((0, 0))
+
+
+class TestSurveySpatialIndex(unittest.TestCase):
+    def test_densify_line(self):
+        coords = [(0, 0), (10, 0), (10, 3)]
+        points = densify_line(coords, 4)
+        np.testing.assert_array_equal(points[[0, -1]], [(0, 0), (10, 3)])
+        steps = np.sqrt(np.sum(np.diff(points, axis=0)**2, axis=1))
+        self.assertTrue((steps <= 4).all())
+        self.assertTrue(LineString(coords).buffer(1e-9).contains(
+            LineString(points)))
+
+    def test_cores_near_line(self):
+        rand = np.random.RandomState(1)
+        cores = [CoreSample(core_id=str(i), location=tuple(xy))
+                 for i, xy in enumerate(rand.uniform(0, 2000, (300, 2)))]
+        line = SurveyLine(name='line', navigation_line=LineString(
+            [(0, 0), (1500, 1000), (1600, 2000)]))
+        expected = [core for core in cores if
+                    line.navigation_line.distance(Point(core.location)) < 100]
+        index = SurveySpatialIndex(cores)
+        self.assertEqual(index.cores_near_line(line, 100), expected)
+        self.assertEqual(line.nearby_core_samples(cores, 100), expected)
+
+
+class TestLineIndex(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            SurveyLine(name=str(i), navigation_line=LineString(
+                [(0, 100 * i), (1000, 100 * i + 50)]))
+            for i in range(10)]
+        self.index = LineIndex(self.lines)
+
+    def test_lines_near(self):
+        p = Point(500, 330)
+        expected = [line for line in self.lines
+                    if line.navigation_line.distance(p) < 60]
+        self.assertEqual(self.index.lines_near((500, 330), 60), expected)
+        self.assertEqual(self.index.lines_near((5000, 330), 60), [])
+
+    def test_nearest_line(self):
+        self.assertIs(self.index.nearest_line((500, 330), 60),
+                      self.lines[3])
+        self.assertIsNone(self.index.nearest_line((5000, 330), 60))
+
+    def test_lines_in_box(self):
+        self.assertEqual(self.index.lines_in_box(400, 510, 600, 280),
+                         self.lines[3:5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -32,6 +32,7 @@ class TestSurvey(unittest.TestCase):
         self.h5file = os.path.join(self.tempdir, 'test.h5')
 
     def tearDown(self):
+        survey_io.close_hdf(self.h5file)
         shutil.rmtree(self.tempdir)
 
     def test_empty_survey(self):
@@ -63,6 +63,16 @@ class Application(HasTraits):
                             dest='import_', metavar='DIR')
         parser.add_argument('--with-picks', help='if included, then pre and pick files will be imported',
                             dest='with_picks_', action='store_true')
+        parser.add_argument('--workers', help='number of processes used to parse SDI files on import (default: one per CPU)',
+                            dest='workers_', type=int, metavar='N')
+        parser.add_argument('--shared', help='share survey files with other hydropick processes (one writer, many readers)',
+                            dest='shared_', action='store_true')
+        parser.add_argument('--compact', help='compact an HDF5 survey file, reclaiming unused space, and exit',
+                            dest='compact_', metavar='FILE')
+        parser.add_argument('--complib', help='compression library used by --compact (default: blosc if available, else zlib)',
+                            dest='complib_', metavar='NAME')
+        parser.add_argument('--complevel', help='compression level used by --compact (default: 5)',
+                            dest='complevel_', type=int, default=5, metavar='N')
         parser.add_argument('-v', '--verbose', action='store_const', dest='logging',
                             const=logging.INFO, help='verbose logging')
         parser.add_argument('-q', '--quiet', action='store_const', dest='logging',
@@ -73,17 +83,39 @@ class Application(HasTraits):
         return args
 
     def init(self):
+        """ Set up the application from the command line.  Returns False if
+        the command line asked for a task that does not need the GUI.
+        """
         # set up logging
         self.logger.addHandler(self.logging_handler)
 
         # parse commandline arguments
         args = self.parse_arguments()
+        if args.shared_:
+            from ..io.survey_io import set_concurrent_access
+            set_concurrent_access(True)
+        if args.compact_:
+            self.compact(args.compact_, args.complib_, args.complevel_)
+            return False
         if args.import_:
             from ..io.import_survey import import_survey
-            survey = import_survey(args.import_, args.with_picks_)
+            survey = import_survey(args.import_, args.with_picks_,
+                                   workers=args.workers_)
             self.task.survey = survey
         if args.logging is not None:
             self.logger.setLevel(args.logging)
+        return True
+
+    def compact(self, h5file, complib=None, complevel=5):
+        from ..io.hdf5 import StoragePolicy
+        from ..io.survey_io import compact_hdf
+        policy = StoragePolicy(complib=complib, complevel=complevel)
+        result = compact_hdf(h5file, policy)
+        msg = 'compacted {}: {} -> {} bytes ({} bytes reclaimed)'.format(
+            h5file, result['old_size'], result['new_size'],
+            result['bytes_reclaimed'])
+        self.logger.info(msg)
+        print msg
 
     def start(self):
         self.logger.info('Starting application')
@@ -114,6 +146,11 @@ class Application(HasTraits):
         self.logger.info('Stopping application')
 
     def cleanup(self):
+        from ..io.backend import close_all_backends
+        from .line_loader import stop_all_loaders
+        # background readers must be done before their files are closed
+        stop_all_loaders()
+        close_all_backends()
         logging.shutdown()
 
     def _application_home_default(self):
@@ -0,0 +1,108 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import logging
+from collections import OrderedDict
+
+from traits.api import HasTraits, Instance, Int, Str
+
+from .survey_data_session import SurveyDataSession
+
+logger = logging.getLogger(__name__)
+
+# default memory budget for loaded survey line data
+MAX_LOADED_BYTES = 1 << 30
+
+
+class LineDataCache(HasTraits):
+    """ The data sessions of recently viewed survey lines, kept within a
+    memory budget.
+
+    When the loaded data of the cached lines exceeds max_bytes, the least
+    recently used lines are unloaded and their sessions dropped.  The most
+    recently used line and the current line are never evicted.  Depth lines
+    stay on the survey line, so their edits are kept, and the line is loaded
+    again the next time its session is asked for.
+
+    Each line is counted as its data plus the arrays its session derives
+    from it (see SurveyDataSession.nbytes).  The brightness and contrast
+    adjusted images belong to the view of the line on screen and are not
+    counted.
+    """
+
+    #: memory budget in bytes for the cached lines and their sessions
+    max_bytes = Int(MAX_LOADED_BYTES)
+
+    #: total bytes held by the cached lines and their sessions
+    nbytes = Int(0)
+
+    #: name of the line being viewed
+    current = Str
+
+    #: line name -> (session, nbytes), least recently used first
+    _sessions = Instance(OrderedDict, ())
+
+    def __contains__(self, line_name):
+        return line_name in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def session(self, survey_line, hdf5_file, algorithms=None):
+        """ Return the data session for survey_line, loading the line's data
+        if it is not loaded.  New sessions are given the algorithms dict.
+        """
+        name = survey_line.name
+        entry = self._sessions.pop(name, None)
+        if entry is not None:
+            self._sessions[name] = entry
+            return entry[0]
+        if survey_line.trace_num.size == 0:
+            # need to load data for this line
+            survey_line.load_data(hdf5_file)
+        session = SurveyDataSession(survey_line=survey_line,
+                                    algorithms=algorithms or {})
+        self.add(session)
+        return session
+
+    def add(self, session):
+        """ Add a data session as the most recently used one """
+        name = session.survey_line.name
+        self.discard(name, unload=False)
+        nbytes = session.nbytes()
+        self._sessions[name] = (session, nbytes)
+        self.nbytes += nbytes
+        self._evict()
+
+    def discard(self, line_name, unload=True):
+        """ Drop a line's session, by default unloading its data too """
+        entry = self._sessions.pop(line_name, None)
+        if entry is None:
+            return
+        session, nbytes = entry
+        self.nbytes -= nbytes
+        if unload:
+            session.survey_line.unload_data()
+
+    def clear(self):
+        for name in self._sessions.keys():
+            self.discard(name)
+
+    def _evict(self):
+        # least recently used first, never the newest or current line
+        names = [name for name in self._sessions.keys()[:-1]
+                 if name != self.current]
+        for name in names:
+            if self.nbytes <= self.max_bytes:
+                break
+            logger.info('unloading survey line {}'.format(name))
+            self.discard(name)
+
+    def _max_bytes_changed(self):
+        self._evict()
@@ -0,0 +1,296 @@
+#
+# Copyright (c) 2014, Texas Water Development Board
+# All rights reserved.
+#
+# This code is open-source. See LICENSE file for details.
+#
+
+from __future__ import absolute_import
+
+import itertools
+import logging
+import threading
+import weakref
+from Queue import PriorityQueue
+
+from pyface.api import GUI
+from traits.api import (Bool, Callable, Dict, HasTraits, Instance, Int, List,
+                        Str)
+
+from ..model.survey_line import SurveyLine
+from .line_data_cache import LineDataCache
+from .survey_data_session import SurveyDataSession
+
+logger = logging.getLogger(__name__)
+
+# traces at the start of each frequency shown while a line is loading
+PREVIEW_TRACES = 2000
+
+# queue priorities: stopping goes ahead of everything, and a requested load
+# goes ahead of any prefetch
+STOP, LOAD, PREFETCH = -1, 0, 1
+
+# seconds stop() waits for a read in progress to finish
+STOP_TIMEOUT = 30
+
+# loaders with a running worker thread
+_loaders = weakref.WeakSet()
+
+
+def stop_all_loaders():
+    """ Stop every loader's worker thread.  Called on application shutdown,
+    before the files they read are closed.
+    """
+    for loader in list(_loaders):
+        loader.stop()
+
+
+def _copy_depth_lines(depth_lines):
+    return dict((name, depth_line.clone_traits(copy='deep'))
+                for name, depth_line in depth_lines.items())
+
+
+class LineLoader(HasTraits):
+    """ Loads survey lines into a LineDataCache on a background thread.
+
+    The worker thread only reads from the hdf5 file; the results are handed
+    back to the GUI thread, which fills the survey line and builds its data
+    session, so traits are never changed off the GUI thread.
+
+    load() reads one line for display: the start of the line first, shown
+    as a preview, then the rest of it.  A newer load() cancels the one in
+    progress.  prefetch() reads lines that are likely to be wanted next
+    whenever no load is waiting.  stop() ends the worker thread; the loader
+    does nothing after that.
+
+    The worker reads with read_data(snapshot=False), one frequency at a
+    time, so the GUI thread is never kept from the file for a whole line.
+    """
+
+    #: the cache the loaded lines are put in
+    cache = Instance(LineDataCache)
+
+    #: the survey's hdf5 file
+    hdf5_file = Str
+
+    #: dictionary of depth pick algorithms handed to new sessions
+    algorithms = Dict
+
+    #: called with a function and its arguments to run it on the GUI thread
+    dispatch = Callable(GUI.invoke_later)
+
+    #: names of lines queued or being read by prefetch
+    pending = List(Str)
+
+    #: True while a load() is in progress
+    loading = Bool(False)
+
+    #: progress of the load in progress, from 0 to 100
+    progress = Int(0)
+
+    #: what the load in progress is doing
+    status = Str
+
+    # incremented whenever the prefetched lines are replaced
+    _generation = Int(0)
+
+    # incremented by every load() and cancel()
+    _load_generation = Int(0)
+
+    _queue = Instance(PriorityQueue, ())
+
+    _counter = Instance(itertools.count, ())
+
+    _thread = Instance(threading.Thread)
+
+    # set by stop()
+    _stopped = Bool(False)
+
+    def load(self, survey_line, on_preview, on_loaded):
+        """ Read survey_line in the background, cancelling any load in
+        progress.
+
+        on_preview is called with a data session for a copy of the start of
+        the line, then on_loaded with the line's own session once its
+        data is in the cache.  Both are called on the GUI thread, and not at
+        all if the load is cancelled.
+        """
+        self._load_generation += 1
+        self.loading = True
+        self._set_progress(self._load_generation, 0,
+                           'Loading survey line {}'.format(survey_line.name))
+        self._put(LOAD, (self._load_generation, survey_line,
+                         on_preview, on_loaded))
+
+    def cancel(self):
+        """ Cancel the load in progress, if any """
+        self._load_generation += 1
+        self.loading = False
+
+    def prefetch(self, survey_lines):
+        """ Replace the lines waiting to be prefetched with survey_lines.
+
+        Lines that are already loaded are skipped.  Reads already started
+        are finished and kept.
+        """
+        self._generation += 1
+        lines = [line for line in survey_lines if line is not None and
+                 line.name not in self.cache and line.trace_num.size == 0]
+        self.pending = [line.name for line in lines]
+        for line in lines:
+            self._put(PREFETCH, (self._generation, line))
+
+    def stop(self):
+        """ Drop all waiting requests and stop the worker thread, waiting
+        for a read in progress to finish.
+        """
+        self.cancel()
+        self._generation += 1
+        self.pending = []
+        self._stopped = True
+        _loaders.discard(self)
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put((STOP, next(self._counter), None))
+            thread.join(STOP_TIMEOUT)
+            if thread.is_alive():
+                logger.warning('line loader still reading after stop')
+
+    def _put(self, priority, request):
+        if self._stopped:
+            return
+        self._queue.put((priority, next(self._counter), request))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='hydropick line loader')
+            self._thread.daemon = True
+            self._thread.start()
+            _loaders.add(self)
+
+    #==========================================================================
+    # Worker thread
+    #==========================================================================
+
+    def _run(self):
+        while True:
+            priority, count, request = self._queue.get()
+            if priority == STOP:
+                return
+            elif priority == LOAD:
+                self._run_load(*request)
+            else:
+                self._run_prefetch(*request)
+
+    def _run_prefetch(self, generation, line):
+        if generation != self._generation:
+            # superseded by a later prefetch
+            return
+        hdf5_file = self.hdf5_file
+        try:
+            data = line.read_data(hdf5_file, snapshot=False)
+        except Exception:
+            logger.exception('could not read survey line {}'.format(
+                line.name))
+            data = None
+        self.dispatch(self._prefetched, line, data, hdf5_file)
+
+    def _run_load(self, generation, line, on_preview, on_loaded):
+        hdf5_file = self.hdf5_file
+        try:
+            if generation != self._load_generation:
+                return
+            if line.trace_num.size:
+                # prefetched while waiting: nothing to read
+                self.dispatch(self._load_read, generation, line, None,
+                              hdf5_file, on_loaded)
+                return
+            self.dispatch(self._set_progress, generation, 10,
+                          'Reading preview')
+            preview = line.read_data(hdf5_file, max_traces=PREVIEW_TRACES,
+                                     snapshot=False)
+            if generation != self._load_generation:
+                return
+            self.dispatch(self._preview_read, generation, line, preview,
+                          on_preview)
+            # carry on from where the preview stopped
+            data = line.read_data(hdf5_file, snapshot=False, preview=preview)
+        except Exception:
+            logger.exception('could not read survey line {}'.format(
+                line.name))
+            self.dispatch(self._load_failed, generation, line)
+            return
+        # the full data is worth keeping even if the load was cancelled
+        self.dispatch(self._load_read, generation, line, data, hdf5_file,
+                      on_loaded)
+
+    #==========================================================================
+    # GUI thread
+    #==========================================================================
+
+    def _set_progress(self, generation, progress, status):
+        if generation == self._load_generation:
+            self.progress = progress
+            self.status = status
+
+    def _preview_read(self, generation, line, data, on_preview):
+        if generation != self._load_generation:
+            return
+        self._set_progress(generation, 30, 'Reading the rest of the line')
+        # the preview gets copies of the depth lines so nothing done to it
+        # can reach the line's own, or those read for it
+        data = dict(data,
+                    lake_depths=_copy_depth_lines(data['lake_depths']),
+                    preimpoundment_depths=_copy_depth_lines(
+                        data['preimpoundment_depths']))
+        preview = SurveyLine(name=line.name,
+                             navigation_line=line.navigation_line,
+                             core_samples=line.core_samples,
+                             lake_depths=_copy_depth_lines(line.lake_depths),
+                             preimpoundment_depths=_copy_depth_lines(
+                                 line.preimpoundment_depths))
+        preview.set_data(data, None)
+        on_preview(SurveyDataSession(survey_line=preview,
+                                     algorithms=self.algorithms))
+
+    def _load_read(self, generation, line, data, hdf5_file, on_loaded):
+        current = generation == self._load_generation
+        if current:
+            self._set_progress(generation, 90, 'Building view')
+        session = self._add_to_cache(line, data, hdf5_file)
+        if not current:
+            return
+        if session is None:
+            # loaded some other way while it was being read
+            session = self.cache.session(line, self.hdf5_file,
+                                         self.algorithms)
+        self._set_progress(generation, 100, '')
+        self.loading = False
+        on_loaded(session)
+
+    def _load_failed(self, generation, line):
+        if generation == self._load_generation:
+            self._set_progress(generation, 0, 'Could not load survey line '
+                               '{}'.format(line.name))
+            self.loading = False
+
+    def _prefetched(self, line, data, hdf5_file):
+        if line.name in self.pending:
+            self.pending.remove(line.name)
+        if self._add_to_cache(line, data, hdf5_file) is not None:
+            logger.info('prefetched survey line {}'.format(line.name))
+
+    def _add_to_cache(self, line, data, hdf5_file):
+        """ Fill a line with data read by the worker and cache its session.
+        Returns None if the data is not needed.
+        """
+        if data is None or hdf5_file != self.hdf5_file or self._stopped:
+            return None
+        if line.name in self.cache or line.trace_num.size:
+            return None
+        # never write from here: a write would wait on the worker's reads
+        line.set_data(data, None)
+        session = SurveyDataSession(survey_line=line,
+                                    algorithms=self.algorithms)
+        session.compute_derived_arrays()
+        self.cache.add(session)
+        return session
@@ -6,25 +6,45 @@
 #
 
 # ETS imports
-from enable.api import BaseTool
-from traits.api import Event
+from enable.api import BaseTool, ColorTrait
+from traits.api import Event, Tuple
 
 
 class LineSelectTool(BaseTool):
     """ A tool for selecting navigation lines.
 
-    This tool dispatches events with clicked locations.  The work for
-    choosing which lines to select is done in the survey map view.
+    This tool dispatches events with clicked locations, or with the corners
+    of a box dragged out with the shift key held.  The work for choosing
+    which lines to select is done in the survey map view.
     """
 
     #: select a new line
     select_point = Event
 
+    #: select all lines in a box given as (x_min, y_min, x_max, y_max)
+    select_box = Event
+
     #: make a new line the current one
     current_point = Event
 
+    #: color of the box drawn while dragging
+    box_color = ColorTrait('black')
+
+    #: screen coordinates of the corners of the box being dragged
+    _box_start = Tuple
+    _box_end = Tuple
+
+    # draw the box being dragged over the plot
+    draw_mode = 'overlay'
+    visible = True
+
     def normal_left_down(self, event):
-        """ Dispatch an event with clicked location """
+        """ Dispatch an event with clicked location, or start a box """
+        if event.shift_down:
+            self._box_start = self._box_end = (event.x, event.y)
+            self.event_state = 'selecting'
+            event.handled = True
+            return
         plot = self.component
         x = plot.index_mapper.map_data(event.x)
         y = plot.value_mapper.map_data(event.y)
@@ -36,3 +56,38 @@ class LineSelectTool(BaseTool):
         x = plot.index_mapper.map_data(event.x)
         y = plot.value_mapper.map_data(event.y)
         self.current_point = (x, y)
+
+    def selecting_mouse_move(self, event):
+        self._box_end = (event.x, event.y)
+        self.component.request_redraw()
+        event.handled = True
+
+    def selecting_left_up(self, event):
+        """ Dispatch an event with the box's corners in data coordinates """
+        self._box_end = (event.x, event.y)
+        self.event_state = 'normal'
+        plot = self.component
+        xs = [plot.index_mapper.map_data(p[0])
+              for p in (self._box_start, self._box_end)]
+        ys = [plot.value_mapper.map_data(p[1])
+              for p in (self._box_start, self._box_end)]
+        self.select_box = (min(xs), min(ys), max(xs), max(ys))
+        self.component.request_redraw()
+        event.handled = True
+
+    def selecting_mouse_leave(self, event):
+        """ Cancel the box """
+        self.event_state = 'normal'
+        self.component.request_redraw()
+
+    def overlay(self, component, gc, view_bounds=None, mode='normal'):
+        """ Draw the box being dragged """
+        if self.event_state != 'selecting':
+            return
+        (x0, y0), (x1, y1) = self._box_start, self._box_end
+        with gc:
+            gc.set_stroke_color(self.box_color_)
+            gc.set_line_width(1)
+            gc.set_line_dash([4.0, 4.0])
+            gc.rect(min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0))
+            gc.stroke_path()
@@ -8,18 +8,18 @@
 from __future__ import absolute_import
 
 # std library
-from copy import deepcopy
 import logging
 # other imports
 import numpy as np
 
 # ETS imports
 from traits.api import (Instance, HasTraits, Property, List,
-                        Str, Dict, DelegatesTo, Event)
+                        Str, Dict, DelegatesTo, Event, cached_property)
 
 # Local imports
 from ..model.survey_line import SurveyLine
 from ..model.depth_line import DepthLine
+from ..model.spatial_index import PointIndex
 
 logger = logging.getLogger(__name__)
 
@@ -46,7 +46,11 @@ class SurveyDataSession(HasTraits):
     #: a dictionary mapping frequencies to intensity arrays
     # NOTE:  assume arrays are transposed so that img_plot(array)
     # displays them correctly and array.shape gives (xsize,ysize)
-    frequencies = Property(Dict)
+    # NOTE:  arrays are read-only and shared with the survey line and plots
+    # NOTE:  the dict is cached and shared too, so don't modify it
+    frequencies = Property(Dict, depends_on=['survey_line.frequencies',
+                                             'survey_line.frequencies_items',
+                                             'survey_line.frequencies_updated'])
 
     # dict of array of trace numbers for each freq => pixel location
     #: ! NOTE ! starts at 1, not 0, so need to subtract 1 to use as index
@@ -98,21 +102,32 @@ class SurveyDataSession(HasTraits):
     selected_target = Str
 
     # Sorted keys of frequencies dictionary.
-    freq_choices = Property(List)
+    freq_choices = Property(List, depends_on='frequencies')
 
     # xbounds used for each image display (arguably could be in view class)
     # Dict(freq_key_str, Tuple(min,max))
-    xbounds = Property(Dict)
+    xbounds = Property(Dict, depends_on=['survey_line.freq_trace_num',
+                                         'survey_line.freq_trace_num_items',
+                                         'distance_array'])
 
     # Y bounds should be set based on depth per pixel value of image data.
     # Y axis of depth lines should be set to match this value.
-    ybounds = Property(Dict)
+    ybounds = Property(Dict, depends_on=['frequencies',
+                                         'survey_line.draft',
+                                         'survey_line.pixel_resolution'])
 
     # dict of depth value arrays for each freq/intensity plot to plot slices.
-    y_arrays = Property(Dict)
+    y_arrays = Property(Dict, depends_on=['frequencies', 'ybounds'])
 
     # cumulative distance along path based on locations array.
-    cumulative_distance = Property()
+    cumulative_distance = Property(depends_on='survey_line.locations')
+
+    # spatial index over the locations array for nearest trace lookups.
+    location_index = Property(Instance(PointIndex),
+                              depends_on='survey_line.locations')
+
+    # NOTE: the derived arrays above are cached until the survey line data
+    # they are computed from changes, so callers must not modify them.
 
     # dictionary of algorithms filled by the pane when new survey line selected
     algorithms = Dict
@@ -161,17 +176,37 @@ class SurveyDataSession(HasTraits):
     # Helper functions
     #==========================================================================
 
+    def compute_derived_arrays(self):
+        ''' compute the cached derived arrays now rather than on first draw
+        '''
+        for name in ['freq_choices', 'distance_array', 'xbounds', 'y_arrays',
+                     'location_index']:
+            getattr(self, name)
+
+    def nbytes(self):
+        ''' Approximate bytes held by the line's data and by the arrays
+        derived from it here, counted whether or not they have been computed
+        yet so the figure doesn't grow once the line is drawn.
+        '''
+        line = self.survey_line
+        itemsize = np.dtype(float).itemsize
+        # distance_array and cumulative_distance
+        derived = 2 * itemsize * line.trace_num.size
+        # y_arrays
+        derived += itemsize * sum(intensity.shape[0] for intensity in
+                                  self.frequencies.values())
+        # location_index keeps a copy of the locations and a tree over them
+        derived += 2 * line.locations.nbytes
+        return line.data_nbytes() + derived
+
     def get_nearest_point_to_core(self, core):
         ''' for given core find the closest point in the locations array
         to the core location and then use that index to get the
         associated distance along the survey line from the distance array.
         '''
-        xy_pt = np.array(core.location)
-        diff = self.locations - xy_pt
-        dist_sq_array = np.sum(diff**2, axis=1)
-        loc_index = np.argmin(dist_sq_array)
+        distance_from_line, loc_index = self.location_index.nearest(
+            core.location)
         core_location = self.distance_array[loc_index]
-        distance_from_line = np.sqrt(dist_sq_array.min())
         return loc_index, core_location, distance_from_line
 
     def get_ref_depth_line(self):
@@ -193,6 +228,7 @@ class SurveyDataSession(HasTraits):
     # Get/Set
     #==========================================================================
 
+    @cached_property
     def _get_freq_choices(self):
         ''' Get list of available frequencies as (value,string) pair from
         frequencies dict for use in selector widget.
@@ -206,9 +242,13 @@ class SurveyDataSession(HasTraits):
             logging.error('cannot convert freq key to float. using str sort')
         return s
 
+    @cached_property
     def _get_frequencies(self):
-        new_dict = deepcopy(self.survey_line.frequencies)
-        return new_dict
+        ''' The intensity arrays are read-only and shared with the survey
+        line, so only the dict is copied, once per change of the survey
+        line's frequencies.
+        '''
+        return dict(self.survey_line.frequencies)
 
     def _get_depth_dict(self):
         ''' Combine lake depths and preimpoundment in to one dict.
@@ -229,24 +269,29 @@ class SurveyDataSession(HasTraits):
         '''
         return self.depth_dict.keys()
 
+    @cached_property
     def _get_xbounds(self):
         ''' make dict of distance bounds for each frequency intensity array'''
         d = {}
+        distance_array = self.distance_array
         for key, trace_array in self.freq_trace_num.items():
-            freq_dist = self.distance_array[trace_array - 1]
+            freq_dist = distance_array[trace_array - 1]
             d[key] = (freq_dist.min(), freq_dist.max())
         return d
 
+    @cached_property
     def _get_y_arrays(self):
         ''' y arrays for each freq provided in dictionary'''
         d = {}
+        ybounds = self.ybounds
         for key, intensity in self.frequencies.items():
             N = intensity.shape[0]
-            min, max = self.ybounds[key]
+            min, max = ybounds[key]
             array = np.linspace(min, max, num=N)
             d[key] = array
         return d
 
+    @cached_property
     def _get_ybounds(self):
         ''' made dict of y bounds for each intensity plot'''
         d = {}
@@ -257,17 +302,24 @@ class SurveyDataSession(HasTraits):
             d[key] = (min, max)
         return d
 
+    @cached_property
     def _get_distance_array(self):
         ''' creates linear mapping of cumulative distance to trace_num array
         so each trace_num/index will have an approximate distance along line.
         This can be used to get an x_value array for any function defined on a
         subset of the trace_num array via x_array = distance[index_array]
         '''
-        max = self.cumulative_distance[-1]
-        N = float(self.cumulative_distance.size)
+        cumulative_distance = self.cumulative_distance
+        max = cumulative_distance[-1]
+        N = float(cumulative_distance.size)
         linear_dist = (self.survey_line.trace_num - 1) * max / (N - 1)
         return linear_dist
 
+    @cached_property
+    def _get_location_index(self):
+        return PointIndex(self.locations)
+
+    @cached_property
     def _get_cumulative_distance(self):
         ''' discretely sum up distance along location points.
 
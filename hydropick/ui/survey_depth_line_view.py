@@ -18,6 +18,7 @@ from traitsui.api import (View, VGroup, HGroup, Item, UItem, EnumEditor,
                           TextEditor, ListEditor)
 
 # Local imports
+from ..io import survey_io
 from ..model.depth_line import DepthLine
 from ..model.i_survey_line_group import ISurveyLineGroup
 from ..model.i_survey_line import ISurveyLine
@@ -340,31 +341,39 @@ class DepthLineView(HasTraits):
                    args=self.model.args,
                    color=self.model.color)
             logger.info(s)
-            for line in self.selected_survey_lines:
-                if line.trace_num.size == 0:
-                    # need to load line
-                    line.load_data(self.hdf5_file)
-                    
-                self.model = deepcopy(model)
-                self.model.survey_line_name = line.name
-                alg_name = model.source_name
-                args = model.args
-                logger.info('applying algorithm : {}'.format(alg_name))
-                self.make_from_algorithm(alg_name, args, survey_line=line)
-                self.check_name_and_arrays(self.model)
-                if self.no_problem:
-                    lname = line.name
-                    s = 'saving new depth line to surveyline {}'.format(lname)
-                    logger.info(s)
-                    print 'saving', self.model, line.name
-                    if model.line_type == 'current surface':
-                        line.lake_depths[self.model.name] = self.model
-                        line.final_lake_depth = self.model.name
-                    else:
-                        line.preimpoundment_depths[self.model.name] = self.model
-                        print line.preimpoundment_depths.keys()
-                        line.final_preimpoundment_depth = self.model.name
-                    
+            # stage new lines and write them in one commit
+            with survey_io.depth_line_batch(self.hdf5_file) as batch:
+                for line in self.selected_survey_lines:
+                    loaded_here = line.trace_num.size == 0
+                    if loaded_here:
+                        # need to load line
+                        line.load_data(self.hdf5_file)
+
+                    self.model = deepcopy(model)
+                    self.model.survey_line_name = line.name
+                    alg_name = model.source_name
+                    args = model.args
+                    logger.info('applying algorithm : {}'.format(alg_name))
+                    self.make_from_algorithm(alg_name, args, survey_line=line)
+                    self.check_name_and_arrays(self.model)
+                    if self.no_problem:
+                        lname = line.name
+                        s = 'saving new depth line to surveyline {}'.format(lname)
+                        logger.info(s)
+                        print 'saving', self.model, line.name
+                        if model.line_type == 'current surface':
+                            line.lake_depths[self.model.name] = self.model
+                            line.final_lake_depth = self.model.name
+                        else:
+                            line.preimpoundment_depths[self.model.name] = self.model
+                            print line.preimpoundment_depths.keys()
+                            line.final_preimpoundment_depth = self.model.name
+                        batch.write_depth_line(self.model, line.name)
+                    if loaded_here:
+                        # only loaded to apply the algorithm: don't keep the
+                        # data around outside the pane's line cache
+                        line.unload_data()
+
         self.model = model
 
     @on_trait_change('selected_depth_line_name')
@@ -11,7 +11,7 @@ import logging
 import numpy as np
 
 # ETS imports
-from traits.api import (Instance, Dict, List, on_trait_change)
+from traits.api import (Instance, Dict, List, Bool, on_trait_change)
 from traitsui.api import ModelView, View, VGroup
 
 from chaco.api import (ArrayPlotData)
@@ -72,6 +72,9 @@ class SurveyLineView(ModelView):
     # Defines view for pop up image adjustments window
     cmap_edit_view = Instance(ColormapEditView)
 
+    # when True depth lines cannot be edited, e.g. for a preview of a line
+    read_only = Bool(False)
+
     ######## SAVE FOR NOW - MAY GO BACK TO THIS ########
     # List of which lines are visible in plots
     visible_lines = List([])
@@ -121,7 +124,8 @@ class SurveyLineView(ModelView):
         choices = ['None'] + tgt_choices
         cv = ControlView(target_choices=choices,
                          line_to_edit=self.model.selected_target,
-                         edit='Not Editing'
+                         edit='Not Editing',
+                         edit_enabled=not self.read_only
                          )
         # set default values for widgets
         cv.image_freq = ''
@@ -217,12 +221,14 @@ class SurveyLineView(ModelView):
         d = self.plotdata
 
         if self.model:
-            # add the freq dependent (3@) data
+            # add the freq dependent (3@) data.  images are passed through
+            # uncopied; only contrast adjusted versions are new arrays
+            y_arrays = self.model.y_arrays
             for k, img in self.model.frequencies.items():
                 y_key = k+'_y'
                 slice_key = k+'_slice'
-                kw = {k: self.model.frequencies[k],
-                      y_key: self.model.y_arrays[k],
+                kw = {k: img,
+                      y_key: y_arrays[k],
                       slice_key: np.array([]),
                       }
                 d.update_data(**kw)
@@ -255,7 +261,7 @@ class SurveyLineView(ModelView):
     def set_edit_enabled(self):
         ''' enables editing tool based on ui edit selector'''
         for tool in self.trace_tools.values():
-            if self.control_view.edit == 'Editing':
+            if self.control_view.edit == 'Editing' and not self.read_only:
                 tool.edit_allowed = True
             else:
                 tool.edit_allowed = False
@@ -382,13 +388,14 @@ class SurveyLineView(ModelView):
         called by adjust image
         '''
         c, b, invert = self.image_settings.setdefault(freq, [1, 0, True])
+        # the stored image is read-only: this makes the display copy
         data = self.model.frequencies[freq]
         data = c * data
         b2 = c * b - b
         b3 = b2 + 1
-        data = np.clip(data, b2, b3)
+        np.clip(data, b2, b3, out=data)
         if invert:
-            data = 1-data
+            np.subtract(1, data, out=data)
         self.plot_container.data.update_data({freq: data})
 
     def update_depth(self, depth):
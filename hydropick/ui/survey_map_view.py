@@ -9,20 +9,21 @@ from __future__ import absolute_import
 
 # 3rd party imports
 import numpy as np
-from shapely.geometry import Point
 
 # ETS imports
 from chaco.api import (ArrayPlotData, ArrayDataSource, LinearMapper,
                        Plot, PolygonPlot, ScatterPlot)
 from chaco.tools.api import PanTool, ZoomTool
 from enable.api import BaseTool, ColorTrait
-from traits.api import Bool, Dict, Float, Instance, List, on_trait_change, Property
+from traits.api import (Bool, Dict, Float, Instance, List, on_trait_change,
+                        Property, cached_property)
 from traitsui.api import ModelView
 from pyface.tasks.api import TraitsDockPane
 
 # local imports
 from hydropick.model.i_survey import ISurvey
 from hydropick.model.i_survey_line import ISurveyLine
+from hydropick.model.spatial_index import LineIndex
 from hydropick.ui.line_select_tool import LineSelectTool
 
 
@@ -83,6 +84,14 @@ class SurveyMapView(ModelView):
     def _get_survey_lines(self):
         return self.model.survey_lines
 
+    #: spatial index of the survey lines' navigation lines for selection
+    line_index = Property(Instance(LineIndex),
+                          depends_on='model.survey_lines[]')
+
+    @cached_property
+    def _get_line_index(self):
+        return LineIndex(self.survey_lines)
+
     #: the plot objects for each survey line
     line_plots = Dict
 
@@ -101,11 +110,12 @@ class SurveyMapView(ModelView):
 
     @on_trait_change('current_survey_line, selected_survey_lines')
     def _set_line_colors(self):
+        selected_names = set(line.name for line in self.selected_survey_lines)
         for name, plot in self.line_plots.iteritems():
             lp = plot[0]
             if self.current_survey_line and name == self.current_survey_line.name:
                 lp.color = self.current_line_color
-            elif name in [line.name for line in self.selected_survey_lines]:
+            elif name in selected_names:
                 lp.color = self.selected_line_color
             else:
                 lp.color = self.line_color
@@ -147,10 +157,11 @@ class SurveyMapView(ModelView):
         index_mapper = LinearMapper(range=plot.index_range)
         value_mapper = LinearMapper(range=plot.value_range)
         if self.model.lake is not None:
-            line_lengths = [l.length for l in self.model.lake.shoreline]
+            parts = self.model.lake.shoreline_parts()
+            line_lengths = [np.hypot(*np.diff(line[:, :2], axis=0).T).sum()
+                            for line in parts]
             idx_max = line_lengths.index(max(line_lengths))
-            for num, l in enumerate(self.model.lake.shoreline):
-                line = np.array(l.coords)
+            for num, line in enumerate(parts):
                 x = line[:,0]
                 y = line[:,1]
                 # assume that the longest polygon is lake, all others islands
@@ -199,26 +210,34 @@ class SurveyMapView(ModelView):
         self.line_select_tool.on_trait_event(self.select_point, 'select_point')
         # double click in map sets 'current point': change current survey line
         self.line_select_tool.on_trait_event(self.current_point, 'current_point')
-        plot.tools.append(self.line_select_tool)
+        # shift-drag in map selects all lines crossing the box
+        self.line_select_tool.on_trait_event(self.select_box, 'select_box')
+        # first, so that shift-drag is not taken by the pan tool
+        plot.tools.insert(0, self.line_select_tool)
+        plot.overlays.append(self.line_select_tool)
         return plot
 
     def select_point(self, event):
         ''' single click in map toggles line selection status in selected lines
         '''
-        p = Point(event)
-        for line in self.survey_lines:
-            if line.navigation_line.distance(p) < self.tol:
-                self._select_line(line)
+        for line in self.line_index.lines_near(event, self.tol):
+            self._select_line(line)
 
     def current_point(self, event):
         ''' double click in map sets line as current survey line (for editing)
         '''
-        p = Point(event)
-        for line in self.survey_lines:
-            if line.navigation_line.distance(p) < self.tol:
-                self.current_survey_line = line
-                # never want to set more than one line to current so break now
-                break
+        # never want to set more than one line to current so take nearest
+        line = self.line_index.nearest_line(event, self.tol)
+        if line is not None:
+            self.current_survey_line = line
+
+    def select_box(self, event):
+        ''' shift-drag in map adds the lines crossing the box to the
+        selected lines
+        '''
+        new_lines = [line for line in self.line_index.lines_in_box(*event)
+                     if line not in self.selected_survey_lines]
+        self.selected_survey_lines.extend(new_lines)
 
     def _select_line(self, line):
         print 'select', line.name
@@ -678,11 +678,15 @@ class ControlView(HasTraits):
     # used to explicitly get edit mode
     edit = Enum('Editing', 'Not Editing')     # Button('Not Editing')
 
+    # False when the line being shown cannot be edited
+    edit_enabled = Bool(True)
+
     traits_view = View(
         HGroup(
             UItem('edit',
                   tooltip='Toggle between "not editing" and \
-                          "editing" selected line'
+                          "editing" selected line',
+                  enabled_when='edit_enabled'
                   ),
             Item('line_to_edit',
                  editor=EnumEditor(name='target_choices'),
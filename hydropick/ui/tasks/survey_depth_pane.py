@@ -61,6 +61,9 @@ class SurveyDepthPane(TraitsDockPane):
     def _selected_depth_line_name_changed(self):
         print 'dlp-selectd_dln_chng'
         logger.info('dlp-selectd_dln_chng')
+        if self.current_data_session is None or self.depth_line_view is None:
+            # no line is loaded yet
+            return
         name = self.selected_depth_line_name
         d = self.current_data_session.depth_dict[self.selected_depth_line_name]
         self.depth_line_view.model = d
@@ -95,12 +98,15 @@ class SurveyDepthPane(TraitsDockPane):
         if self.current_data_session:
             self.depth_line_view = self._get_depth_line_view()
             name = self.current_data_session.survey_line.name
+        else:
+            # the line is still loading: drop the previous line's view
+            self.show_view = False
+            self.depth_line_view = None
         logger.info('data session changed: {}'.format(name))
         
     def _get_depth_line_view(self):
         data = self.current_data_session
-        sanity_check = data.survey_line is self.current_survey_line
-        if data and sanity_check:
+        if data and data.survey_line is self.current_survey_line:
             view = DepthLineView(model=DepthLine(),
                                  selected_depth_line_name='none',
                                  data_session=self.current_data_session,
@@ -8,13 +8,13 @@
 from __future__ import absolute_import
 
 import logging
-from traits.api import (DelegatesTo, Instance, Property, Bool, Dict, List, Str,
-                        Supports)
-from traitsui.api import View, Item
+from traits.api import (DelegatesTo, Instance, Property, Bool, List, Supports)
+from traitsui.api import View, Item, ProgressEditor
 from pyface.tasks.api import TraitsTaskPane
 
 from ...model.i_survey_line import ISurveyLine
-from ..survey_data_session import SurveyDataSession
+from ..line_data_cache import LineDataCache
+from ..line_loader import LineLoader
 from ..survey_line_view import SurveyLineView
 from hydropick.model.i_core_sample import ICoreSample
 
@@ -50,8 +50,17 @@ class SurveyLinePane(TraitsTaskPane):
     survey_line_view = Instance(SurveyLineView)
 
     # once a valid survey line is selected a datasession will
-    # created and stored for quick retrieval on line changes
-    data_session_dict = Dict(Str, Instance(SurveyDataSession))
+    # created and stored for quick retrieval on line changes.  Sessions of
+    # lines not viewed recently are dropped to stay within a memory budget.
+    line_data_cache = Instance(LineDataCache, ())
+
+    # reads survey lines in the background
+    line_loader = Instance(LineLoader)
+
+    # progress of a line being loaded, shown while loading is True
+    loading = DelegatesTo('line_loader')
+    load_progress = DelegatesTo('line_loader', 'progress')
+    load_status = DelegatesTo('line_loader', 'status')
 
     #: dictionary of (name, class) pairs for available depth pic algorithms
     algorithms = DelegatesTo('task')
@@ -79,37 +88,77 @@ class SurveyLinePane(TraitsTaskPane):
         ''' Open dialog to change which plots to view (task menu)'''
         self.survey_line_view.plot_view_selection_dialog()
 
+    def destroy(self):
+        ''' stop reading lines in the background before the pane goes '''
+        self.line_loader.stop()
+        super(SurveyLinePane, self).destroy()
+
+    def _line_loader_default(self):
+        return LineLoader(cache=self.line_data_cache,
+                          algorithms=self.algorithms)
+
+    def _survey_changed(self):
+        ''' sessions belong to the lines of the previous survey '''
+        self.line_loader.cancel()
+        self.line_loader.prefetch([])
+        self.line_data_cache.clear()
+
     def _survey_line_changed(self):
         ''' handle loading of survey line view if valid line provide or else
         provide an empty view.
         '''
+        # a load still in progress is for a line no longer wanted
+        self.line_loader.cancel()
         if self.survey_line is None:
             logger.warning('current survey line is None')
             self.show_view = False
             self.survey_line_view = None
         else:
-            data_session = self.data_session_dict.get(self.line_name, None)
-            if data_session is None:
-                # create new datasession object and entry for this surveyline.
-                if self.survey_line.trace_num.size == 0:
-                    # need to load data for this line
-                    self.survey_line.load_data(self.survey.hdf5_file)
-                data_session = SurveyDataSession(survey_line=self.survey_line,
-                                                 algorithms=self.algorithms)
-                self.data_session_dict[self.line_name] = data_session
-            self.current_data_session = data_session
+            self.line_data_cache.current = self.line_name
+            self.line_loader.hdf5_file = self.survey.hdf5_file
 
             # load relevant core samples into survey line
             # must do this before creating survey line view
-            all_samples = self.survey.core_samples
-            near_samples = self.survey_line.nearby_core_samples(all_samples)
+            near_samples = self.survey.spatial_index.cores_near_line(
+                self.survey_line)
             self.survey_line.core_samples = near_samples
 
-            # create survey line view
-            self.survey_line_view = SurveyLineView(model=data_session)
-            self.show_view = True
+            loaded = self.survey_line.trace_num.size != 0
+            if loaded or self.line_name in self.line_data_cache:
+                data_session = self.line_data_cache.session(
+                    self.survey_line, self.survey.hdf5_file, self.algorithms)
+                self._show_data_session(data_session)
+            else:
+                # read the line off the GUI thread, showing a low resolution
+                # preview until the full data is ready.  The previous line's
+                # views go now so nothing edits it while this one loads.
+                self.show_view = False
+                self.survey_line_view = None
+                self.current_data_session = None
+                self.line_loader.load(self.survey_line,
+                                      self._show_preview,
+                                      self._show_data_session)
+
+    def _show_preview(self, data_session):
+        ''' show a read only preview of the line being loaded '''
+        self.survey_line_view = SurveyLineView(model=data_session,
+                                               read_only=True)
+        self.show_view = True
+
+    def _show_data_session(self, data_session):
+        ''' create survey line view for the fully loaded line '''
+        self.current_data_session = data_session
+        self.survey_line_view = SurveyLineView(model=data_session)
+        self.show_view = True
+
+        # read the lines either side in the background so that stepping
+        # to them doesn't wait on the file
+        self.line_loader.prefetch(self.task.adjacent_survey_lines())
 
     view = View(
+        Item('load_progress', show_label=False,
+             editor=ProgressEditor(min=0, max=100, message_name='load_status'),
+             visible_when='loading'),
         Item('survey_line_view', style='custom', show_label=False,
              visible_when='show_view')
         )
@@ -416,6 +416,16 @@ class SurveyTask(Task):
         else:
             return survey_lines[0]
 
+    def adjacent_survey_lines(self):
+        """ The lines on_next_line and on_previous_line would move to """
+        lines = []
+        for line in [self._get_next_survey_line(),
+                     self._get_previous_survey_line()]:
+            if line is not None and line is not self.current_survey_line \
+                    and line not in lines:
+                lines.append(line)
+        return lines
+
     def _get_previous_survey_line(self):
         """ Get the previous selected survey line,
             or previous line if nothing selected """
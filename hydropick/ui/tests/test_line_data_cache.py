@@ -0,0 +1,164 @@
+''' Unit tests for the line data cache
+
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from Queue import Queue
+
+import numpy as np
+
+from hydropick.io import survey_io
+from hydropick.model.depth_line import DepthLine
+from hydropick.ui.line_data_cache import LineDataCache
+from hydropick.ui.line_loader import LineLoader
+
+
+class TestLineDataCache(unittest.TestCase):
+    def setUp(self):
+        here = os.path.dirname(__file__)
+        top = os.path.dirname(os.path.dirname(here))
+        binary_file = os.path.join(top, 'io', 'tests', 'files',
+                                   '12041701.bin')
+        self.tempdir = tempfile.mkdtemp()
+        self.h5file = os.path.join(self.tempdir, 'test.h5')
+        # store the same data as two lines
+        data = survey_io.parse_survey_line_file(binary_file)
+        self.lines = []
+        for name in ['first', 'second']:
+            survey_io.write_survey_line_to_hdf(self.h5file,
+                                               dict(data, line_name=name))
+            self.lines.append(survey_io.read_survey_line_from_hdf(self.h5file,
+                                                                  name))
+        self.cache = LineDataCache()
+        self.loaders = []
+
+    def tearDown(self):
+        # worker threads must be done with the file before it goes
+        for loader in self.loaders:
+            loader.stop()
+        survey_io.close_hdf(self.h5file)
+        shutil.rmtree(self.tempdir)
+
+    def test_session_reused(self):
+        line = self.lines[0]
+        session = self.cache.session(line, self.h5file)
+        self.assertGreater(line.trace_num.size, 0)
+        self.assertGreater(session.nbytes(), line.data_nbytes())
+        self.assertEqual(self.cache.nbytes, session.nbytes())
+        self.assertIs(self.cache.session(line, self.h5file), session)
+
+    def test_evicts_least_recently_used(self):
+        first, second = self.lines
+        session = self.cache.session(first, self.h5file)
+        edit = DepthLine(name='edit', survey_line_name='first')
+        session.lake_depths['edit'] = edit
+        # room for one line only
+        self.cache.max_bytes = session.nbytes()
+        self.cache.session(second, self.h5file)
+        self.assertNotIn('first', self.cache)
+        self.assertIn('second', self.cache)
+        self.assertEqual(first.trace_num.size, 0)
+        self.assertEqual(first.frequencies, {})
+        self.assertIs(first.lake_depths['edit'], edit)
+        # revisiting reloads the data and keeps the edit
+        self.cache.session(first, self.h5file)
+        self.assertGreater(first.trace_num.size, 0)
+        self.assertIs(first.lake_depths['edit'], edit)
+        self.assertNotIn('second', self.cache)
+
+    def test_current_line_not_evicted(self):
+        first, second = self.lines
+        self.cache.current = 'first'
+        session = self.cache.session(first, self.h5file)
+        self.cache.max_bytes = session.nbytes()
+        self.cache.session(second, self.h5file)
+        self.assertIn('first', self.cache)
+        self.assertIn('second', self.cache)
+
+    def _make_loader(self, calls):
+        # calls stands in for the GUI event loop
+        loader = LineLoader(cache=self.cache, hdf5_file=self.h5file,
+                            dispatch=lambda *args: calls.put(args))
+        self.loaders.append(loader)
+        return loader
+
+    def test_prefetch(self):
+        calls = Queue()
+        loader = self._make_loader(calls)
+        loader.prefetch(self.lines)
+        self.assertEqual(loader.pending, ['first', 'second'])
+        for line in self.lines:
+            args = calls.get(timeout=10)
+            args[0](*args[1:])
+        self.assertEqual(loader.pending, [])
+        for line in self.lines:
+            self.assertIn(line.name, self.cache)
+            self.assertGreater(line.trace_num.size, 0)
+
+    def _run_dispatched(self, calls, done):
+        while not done():
+            args = calls.get(timeout=10)
+            args[0](*args[1:])
+
+    def test_load_with_preview(self):
+        calls = Queue()
+        loader = self._make_loader(calls)
+        previews, loaded = [], []
+        first, second = self.lines
+        # the newer load cancels the first
+        loader.load(first, previews.append, loaded.append)
+        loader.load(second, previews.append, loaded.append)
+        self._run_dispatched(calls, lambda: loaded)
+        self.assertEqual([s.survey_line.name for s in previews], ['second'])
+        self.assertIsNot(previews[0].survey_line, second)
+        preview_depths = previews[0].survey_line.lake_depths
+        self.assertEqual(sorted(preview_depths), sorted(second.lake_depths))
+        for name, depth_line in preview_depths.items():
+            self.assertIsNot(depth_line, second.lake_depths[name])
+        self.assertEqual(len(loaded), 1)
+        self.assertIs(loaded[0].survey_line, second)
+        self.assertIn('second', self.cache)
+        self.assertFalse(loader.loading)
+        self.assertEqual(loader.progress, 100)
+
+    def test_stop(self):
+        calls = Queue()
+        loader = self._make_loader(calls)
+        loader.prefetch(self.lines[:1])
+        thread = loader._thread
+        loader.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(loader.pending, [])
+        # a stopped loader takes no more requests
+        loader.prefetch(self.lines[1:])
+        self.assertIsNone(loader._thread)
+        while not calls.empty():
+            args = calls.get()
+            args[0](*args[1:])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_read_preview_data(self):
+        line = self.lines[0]
+        full = line.read_data(self.h5file)
+        preview = line.read_data(self.h5file, max_traces=10)
+        for freq_dict, full_dict in zip(preview['freq_dict_list'],
+                                        full['freq_dict_list']):
+            # the start of the line, to the end of a stored chunk
+            n = freq_dict['trace_num'].shape[0]
+            self.assertGreaterEqual(n, 10)
+            self.assertEqual(freq_dict['intensity'].shape[0], n)
+            np.testing.assert_array_equal(freq_dict['intensity'],
+                                          full_dict['intensity'][:n])
+        # the rest is read on from the end of the preview
+        data = line.read_data(self.h5file, preview=preview)
+        self.assertIs(data['sdi_dict_raw'], preview['sdi_dict_raw'])
+        for freq_dict, full_dict in zip(data['freq_dict_list'],
+                                        full['freq_dict_list']):
+            for key in ['trace_num', 'intensity']:
+                np.testing.assert_array_equal(freq_dict[key], full_dict[key])
+
+
+if __name__ == "__main__":
+    unittest.main()
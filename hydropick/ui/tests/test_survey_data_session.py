@@ -9,6 +9,7 @@ import unittest
 from traits import has_traits
 
 from hydropick.ui.survey_data_session import SurveyDataSession
+from hydropick.io import survey_io
 from hydropick.io.import_survey import import_sdi, import_cores
 
 
@@ -35,6 +36,7 @@ class TestSurveyDataSession(unittest.TestCase):
         self.data_session = SurveyDataSession(survey_line=self.survey_line)
 
     def tearDown(self):
+        survey_io.close_hdf(self.h5file)
         shutil.rmtree(self.tempdir)
 
     def test_get_freq_choices(self):
@@ -63,6 +65,39 @@ class TestSurveyDataSession(unittest.TestCase):
         freq_choices = self.data_session.freq_choices
         self.assertEqual(frequencies, freq_choices)
 
+    def test_frequencies_are_shared_and_read_only(self):
+        for key, intensity in self.data_session.frequencies.items():
+            self.assertIs(intensity, self.survey_line.frequencies[key])
+            self.assertFalse(intensity.flags.writeable)
+            with self.assertRaises(ValueError):
+                intensity[0, 0] = 0
+
+    def test_frequencies_cached_until_changed(self):
+        frequencies = self.data_session.frequencies
+        self.assertIs(frequencies, self.data_session.frequencies)
+        key = frequencies.keys()[0]
+        self.survey_line.frequencies[key + 'a'] = frequencies[key]
+        self.assertIsNot(frequencies, self.data_session.frequencies)
+        self.assertIn(key + 'a', self.data_session.frequencies)
+        frequencies = self.data_session.frequencies
+        self.survey_line.frequencies_updated = True
+        self.assertIsNot(frequencies, self.data_session.frequencies)
+
+    def test_derived_arrays_cached_until_changed(self):
+        sds = self.data_session
+        distance_array = sds.distance_array
+        xbounds = sds.xbounds
+        y_arrays = sds.y_arrays
+        self.assertIs(distance_array, sds.distance_array)
+        self.assertIs(xbounds, sds.xbounds)
+        self.assertIs(y_arrays, sds.y_arrays)
+        self.survey_line.locations = self.survey_line.locations * 2
+        self.assertIsNot(distance_array, sds.distance_array)
+        self.assertIsNot(xbounds, sds.xbounds)
+        self.assertIs(y_arrays, sds.y_arrays)
+        self.survey_line.pixel_resolution *= 2
+        self.assertIsNot(y_arrays, sds.y_arrays)
+
     def test_get_nearest_point_to_core(self):
         ''' check that given a line and '''
         sds = self.data_session